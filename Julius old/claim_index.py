@@ -0,0 +1,232 @@
+"""
+Processlokalt vektorindex för claims, med åtkomst per NPC.
+
+Alla claim-vektorer ligger normaliserade i en NumPy-matris, och varje NPC
+har en bitmask över raderna med de claims den känner till (direkt eller via
+GROUP). En sökning är en enda matris-vektor-multiplikation där otillgängliga
+rader maskas bort, så top-k är exakt och alltid fullt om NPC:n känner till
+minst top_k claims, till skillnad från att filtrera grannarna från det
+globala claim_index i efterhand.
+
+Indexet hålls i synk med skrivningar via db_utils.add_write_listener. Andra
+processer (t.ex. de interaktiva skripten) märks via ett billigt fingeravtryck
+som kollas högst var CHECK_INTERVAL sekund.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from db_utils import add_write_listener, driver
+
+CHECK_INTERVAL = float(os.getenv("CLAIM_INDEX_CHECK_INTERVAL", "30"))
+
+CLAIMS_QUERY = """
+    MATCH (c:CLAIM) WHERE c.embedding IS NOT NULL
+    RETURN id(c) AS id, c.content AS content, c.veracity AS veracity, c.type AS type, c.embedding AS embedding
+"""
+
+# Åtkomst läses ur kunskapsvyn: direkt BELIEF eller via GROUP
+ACCESS_QUERY = """
+    MATCH (n:NPC)-[:KNOWS]->(c:CLAIM)
+    WHERE $names IS NULL OR n.name IN $names
+    RETURN n.name AS npc, collect(id(c)) AS ids
+"""
+
+KNOWERS_QUERY = """
+    MATCH (n:NPC)-[:KNOWS]->(c:CLAIM) WHERE id(c) = $claim_id
+    RETURN collect(n.name) AS names
+"""
+
+# Antal claims och KNOWS, plus vilka claims som har embedding och från vilken
+# text (embedding_hash), så att embeddings som skrivits av andra processer
+# (embedding_backfill, world_sync) också märks
+FINGERPRINT_QUERY = """
+    MATCH (c:CLAIM)
+    WITH count(c) AS claims,
+         collect(CASE WHEN c.embedding IS NOT NULL THEN [id(c), c.embedding_hash] END) AS embedded
+    RETURN claims, COUNT { ()-[:KNOWS]->() } AS known, embedded
+"""
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ClaimIndex:
+    """Exakt, åtkomstfiltrerad top-k-sökning över alla claims."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._checked_at = 0.0
+        self._fingerprint = None
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.claims = []      # rad -> {"id", "content", "veracity", "type"}
+        self.row_of = {}      # claim-id -> rad
+        self.access = {}      # NPC-namn -> bool-mask över raderna
+
+    # -------------------------------------------------------------------------
+    # Laddning
+    # -------------------------------------------------------------------------
+
+    def _read_fingerprint(self, session):
+        record = session.run(FINGERPRINT_QUERY).single()
+        embedded = json.dumps(sorted(record["embedded"])).encode()
+        return record["claims"], record["known"], len(record["embedded"]), hashlib.sha256(embedded).hexdigest()
+
+    def _read_access(self, session, names=None):
+        result = session.run(ACCESS_QUERY, names=names)
+        return {r["npc"]: r["ids"] for r in result}
+
+    def _mask(self, ids):
+        mask = np.zeros(len(self.claims), dtype=bool)
+        rows = [self.row_of[i] for i in ids if i in self.row_of]
+        mask[rows] = True
+        return mask
+
+    def load(self):
+        """Läs in alla claims och all åtkomst från databasen."""
+        with driver.session() as session:
+            fingerprint = self._read_fingerprint(session)
+            records = list(session.run(CLAIMS_QUERY))
+            access = self._read_access(session)
+
+        with self._lock:
+            self.claims = [{"id": r["id"], "content": r["content"], "veracity": r["veracity"], "type": r["type"]}
+                           for r in records]
+            self.row_of = {c["id"]: i for i, c in enumerate(self.claims)}
+            if records:
+                self.matrix = _normalize(np.array([r["embedding"] for r in records], dtype=np.float32))
+            else:
+                self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.alive = np.ones(len(self.claims), dtype=bool)
+            self.access = {npc: self._mask(ids) for npc, ids in access.items()}
+            self._fingerprint = fingerprint
+            self._checked_at = time.monotonic()
+            self._loaded = True
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self.load()
+            return
+        if time.monotonic() - self._checked_at < CHECK_INTERVAL:
+            return
+        with driver.session() as session:
+            fingerprint = self._read_fingerprint(session)
+        if fingerprint != self._fingerprint:
+            self.load()
+        else:
+            self._checked_at = time.monotonic()
+
+    # -------------------------------------------------------------------------
+    # Inkrementella uppdateringar
+    # -------------------------------------------------------------------------
+
+    def upsert_claim(self, claim_id):
+        """Lägg till eller uppdatera en claims vektor och metadata."""
+        with driver.session() as session:
+            record = session.run(
+                "MATCH (c:CLAIM) WHERE id(c) = $claim_id AND c.embedding IS NOT NULL "
+                "RETURN id(c) AS id, c.content AS content, c.veracity AS veracity, c.type AS type, "
+                "c.embedding AS embedding",
+                claim_id=claim_id,
+            ).single()
+            # Kunskap kan ha kopplats till claimen innan den fick en vektor
+            knowers = session.run(KNOWERS_QUERY, claim_id=claim_id).single()["names"]
+        if record is None:
+            self.remove_claim(claim_id)
+            return
+
+        vector = _normalize(np.array(record["embedding"], dtype=np.float32))
+        claim = {"id": record["id"], "content": record["content"], "veracity": record["veracity"], "type": record["type"]}
+        with self._lock:
+            row = self.row_of.get(claim_id)
+            if row is not None:
+                self.matrix[row] = vector
+                self.claims[row] = claim
+                self.alive[row] = True
+            else:
+                row = len(self.claims)
+                self.claims.append(claim)
+                self.row_of[claim_id] = row
+                self.matrix = vector[None, :] if self.matrix.size == 0 else np.vstack([self.matrix, vector])
+                self.alive = np.append(self.alive, True)
+                for npc in self.access:
+                    self.access[npc] = np.append(self.access[npc], False)
+            for npc in knowers:
+                self.access.setdefault(npc, np.zeros(len(self.claims), dtype=bool))[row] = True
+
+    def remove_claim(self, claim_id):
+        with self._lock:
+            row = self.row_of.get(claim_id)
+            if row is not None:
+                self.alive[row] = False
+
+    def refresh_access(self, entity_name, entity_type):
+        """Läs om åtkomsten för en NPC, eller för alla medlemmar i en GROUP."""
+        with driver.session() as session:
+            if entity_type == "GROUP":
+                result = session.run(
+                    "MATCH (n:NPC)-[:MEMBER_OF]->(:GROUP {name: $name}) RETURN collect(n.name) AS names",
+                    name=entity_name,
+                )
+                names = result.single()["names"]
+            else:
+                names = [entity_name]
+            access = self._read_access(session, names)
+        with self._lock:
+            for name in names:
+                self.access[name] = self._mask(access.get(name, []))
+
+    def on_write(self, kind, key):
+        """Lyssnare för db_utils.notify_write."""
+        if not self._loaded:
+            return
+        if kind == "claim":
+            if key is None:
+                self.load()
+            else:
+                self.upsert_claim(key)
+        elif kind == "claim_deleted":
+            self.remove_claim(key)
+        elif kind == "access":
+            self.refresh_access(*key)
+        elif kind == "npc_deleted":
+            with self._lock:
+                self.access.pop(key, None)
+
+    # -------------------------------------------------------------------------
+    # Sökning
+    # -------------------------------------------------------------------------
+
+    def search(self, npc_name, query_vector, top_k=5):
+        """
+        De top_k claims NPC:n känner till som ligger närmast query_vector
+        (cosinuslikhet), bästa först.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            mask = self.access.get(npc_name)
+            if mask is None or not self.claims:
+                return []
+            mask = mask & self.alive
+            candidates = np.flatnonzero(mask)
+            if candidates.size == 0:
+                return []
+
+            query = _normalize(np.asarray(query_vector, dtype=np.float32))
+            scores = self.matrix[candidates] @ query
+            k = min(top_k, candidates.size)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [dict(self.claims[candidates[i]], score=float(scores[i])) for i in best]
+
+
+claim_index = ClaimIndex()
+add_write_listener(claim_index.on_write)
@@ -1,5 +1,12 @@
 from neo4j import GraphDatabase
-from langchain_community.embeddings import OllamaEmbeddings
+import os
+import sys
+
+# Embeddingar går via projektets gemensamma modul i rotkatalogen, så att
+# samma modell och samma persistenta cache används som i API:t
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings import EMBEDDING_MODEL, create_embedding, text_hash
+from knowledge_view import REBUILD_QUERY, REFRESH_QUERY
 
 # Database connection
 driver = GraphDatabase.driver(
@@ -7,22 +14,64 @@ driver = GraphDatabase.driver(
     auth=("neo4j", "9k6CKG5Mei8KtoVKtZqbre3EZBbuWRQ_SPzRkNGINpE")
 )
 
-# Embedding model
-embed_model = OllamaEmbeddings(model="mxbai-embed-large")
+# =============================================================================
+# ÄNDRINGSLYSSNARE
+# =============================================================================
+
+# Anropas som listener(kind, key) efter skrivningar som ändrar claims eller
+# vem som känner till dem, t.ex. för att hålla claim_index i synk:
+#   "claim"          key = claim-id som skapats eller fått ny embedding (None = alla)
+#   "claim_deleted"  key = claim-id
+#   "access"         key = (entity_name, entity_type) vars kunskap/medlemskap ändrats
+#   "npc_deleted"    key = NPC-namn
+_write_listeners = []
+
+def add_write_listener(listener):
+    """Registrera en funktion som anropas efter skrivningar, se ovan."""
+    _write_listeners.append(listener)
+
+def notify_write(kind, key=None):
+    for listener in list(_write_listeners):
+        listener(kind, key)
 
 # =============================================================================
-# EMBEDDING FUNCTIONS
+# KUNSKAPSVY
 # =============================================================================
 
-def create_embedding(text):
-    """Skapa en embedding-vektor för ett dokument (claim content)."""
-    # Inget prefix för dokument enligt mxbai-embed-large dokumentation
-    return embed_model.embed_query(text)
+# (NPC)-[:KNOWS {belief, stance, source}]->(CLAIM) är vad en NPC effektivt vet,
+# direkt eller ärvt via GROUP (se knowledge_view.py). Vyn uppdateras här av
+# alla funktioner som ändrar BELIEF, STANCE eller MEMBER_OF.
+
+def refresh_knowledge(entity_name, entity_type, claim_id=None):
+    """
+    Räkna om KNOWS för en NPC, eller för alla medlemmar i en GROUP.
+    Med claim_id räknas bara den claimen om.
+    """
+    with driver.session() as session:
+        if entity_type == "GROUP":
+            result = session.run(
+                "MATCH (n:NPC)-[:MEMBER_OF]->(:GROUP {name: $name}) RETURN collect(n.name) AS names",
+                name=entity_name
+            )
+            names = result.single()["names"]
+        else:
+            names = [entity_name]
+        session.run(REFRESH_QUERY, names=names, claim_id=claim_id)
+
+def rebuild_knowledge_view():
+    """Räkna om hela KNOWS-vyn, t.ex. efter ändringar gjorda utanför db_utils."""
+    with driver.session() as session:
+        known = session.run(REBUILD_QUERY).single()["known"]
+        print(f"\n✓ Kunskapsvyn ombyggd ({known} KNOWS)")
+    notify_write("claim", None)
+    return known
+
+# =============================================================================
+# EMBEDDING FUNCTIONS
+# =============================================================================
 
-def create_query_embedding(text):
-    """Skapa en embedding-vektor för en sökfråga."""
-    # Prefix för queries enligt mxbai-embed-large dokumentation
-    return embed_model.embed_query(f"Represent this sentence for searching relevant passages: {text}")
+# create_embedding (dokument, utan prefix) och create_query_embedding (sökfrågor,
+# med mxbai-embed-large-prefixet) importeras ovan och cachas på (modell, prefix, text)
 
 def update_claim_embedding(claim_id):
     """Uppdatera embedding för en CLAIM baserat på dess content."""
@@ -42,21 +91,23 @@ def update_claim_embedding(claim_id):
         
         # Uppdatera CLAIM med embedding
         session.run(
-            "MATCH (c:CLAIM) WHERE id(c) = $claim_id SET c.embedding = $embedding",
-            claim_id=claim_id, embedding=embedding
+            """MATCH (c:CLAIM) WHERE id(c) = $claim_id
+            SET c.embedding = $embedding, c.embedding_hash = $embedding_hash, c.embedding_model = $embedding_model""",
+            claim_id=claim_id, embedding=embedding, embedding_hash=text_hash(content), embedding_model=EMBEDDING_MODEL
         )
         print(f"✓ Embedding uppdaterad för CLAIM: '{content[:50]}...'" if len(content) > 50 else f"✓ Embedding uppdaterad för CLAIM: '{content}'")
-        return True
+    notify_write("claim", claim_id)
+    return True
 
 def update_all_claim_embeddings():
-    """Uppdatera embeddings för alla CLAIM noder."""
-    claims = get_all_claims()
-    print(f"\nUppdaterar embeddings för {len(claims)} claims...")
-    
-    for claim in claims:
-        update_claim_embedding(claim["id"])
-    
-    print(f"\n✓ Alla {len(claims)} embeddings uppdaterade!")
+    """Uppdatera embeddings för alla CLAIM noder vars embedding saknas eller är inaktuell."""
+    # Samma inkrementella backfill som i rotkatalogen (sidvis, parallellt och
+    # återupptagbar); importeras här eftersom den kräver NEO4J_* i miljön
+    from embedding_backfill import backfill
+    stats = backfill("CLAIM")
+    if stats.embedded:
+        notify_write("claim", None)
+    return stats
 
 # =============================================================================
 # RELATION DEFINITIONS
@@ -159,6 +210,8 @@ def create_membership(npc_name, group_name):
         """
         session.run(query, npc_name=npc_name, group_name=group_name)
         print(f"\n✓ {npc_name} är nu MEMBER_OF {group_name}")
+    refresh_knowledge(npc_name, "NPC")
+    notify_write("access", (npc_name, "NPC"))
 
 def create_claim(veracity, content, relation_type=None):
     """Skapa en CLAIM nod med given information, veracity, optional relation type och embedding."""
@@ -168,19 +221,20 @@ def create_claim(veracity, content, relation_type=None):
 
     with driver.session() as session:
         if relation_type:
-            query = "CREATE (c:CLAIM {content: $content, veracity: $veracity, type: $relation_type, embedding: $embedding}) RETURN id(c) AS claim_id"
-            result = session.run(query, content=content, veracity=veracity, relation_type=relation_type, embedding=embedding)
+            query = "CREATE (c:CLAIM {content: $content, veracity: $veracity, type: $relation_type, embedding: $embedding, embedding_hash: $embedding_hash, embedding_model: $embedding_model}) RETURN id(c) AS claim_id"
+            result = session.run(query, content=content, veracity=veracity, relation_type=relation_type, embedding=embedding, embedding_hash=text_hash(content), embedding_model=EMBEDDING_MODEL)
         else:
-            query = "CREATE (c:CLAIM {content: $content, veracity: $veracity, embedding: $embedding}) RETURN id(c) AS claim_id"
-            result = session.run(query, content=content, veracity=veracity, embedding=embedding)
+            query = "CREATE (c:CLAIM {content: $content, veracity: $veracity, embedding: $embedding, embedding_hash: $embedding_hash, embedding_model: $embedding_model}) RETURN id(c) AS claim_id"
+            result = session.run(query, content=content, veracity=veracity, embedding=embedding, embedding_hash=text_hash(content), embedding_model=EMBEDDING_MODEL)
         
         record = result.single()
         claim_id = record["claim_id"] if record else None
         print(f"\n✓ CLAIM skapad: '{content}' (veracity: {veracity})")
-        return claim_id
+    notify_write("claim", claim_id)
+    return claim_id
 
 def delete_claim(claim_id):
-    """Ta bort en CLAIM nod och alla kopplade OPINION noder."""
+    """Ta bort en CLAIM nod och alla kopplade OPINION noder (och därmed dess KNOWS)."""
     with driver.session() as session:
         # Hämta info om noden och räkna kopplade OPINION noder
         info_query = """
@@ -210,6 +264,7 @@ def delete_claim(claim_id):
         print(f"\n✓ CLAIM borttagen: '{content}' (veracity: {veracity})")
         if opinion_count > 0:
             print(f"✓ {opinion_count} kopplad(e) OPINION nod(er) borttagen(a)")
+    notify_write("claim_deleted", claim_id)
 
 def delete_npc(name):
     """Ta bort en NPC och alla dess relationer."""
@@ -233,6 +288,7 @@ def delete_npc(name):
         print(f"\n✓ NPC '{name}' borttagen")
         if relation_count > 0:
             print(f"✓ {relation_count} relation(er) borttagna")
+    notify_write("npc_deleted", name)
 
 # =============================================================================
 # RELATION FUNCTIONS
@@ -443,6 +499,8 @@ def create_knowledge(entity_name, entity_type, claim_id, belief, stance):
             print(f"\n✓ {entity_name} ({entity_type}) → [{veracity}] \"{content}\"")
             print(f"  BELIEF: {belief} (intern övertygelse)")
             print(f"  STANCE: {stance} (yttre ställningstagande)")
+    refresh_knowledge(entity_name, entity_type, claim_id)
+    notify_write("access", (entity_name, entity_type))
 
 def get_entity_knowledge(entity_name, entity_type):
     """Hämta alla kunskaps-kopplingar för en NPC eller GROUP."""
@@ -488,6 +546,8 @@ def delete_knowledge(entity_name, entity_type, claim_id):
         session.run(delete_query, entity_name=entity_name, claim_id=claim_id)
         
         print(f"\n✓ Tog bort {entity_name}s kunskap om [{veracity}] \"{content}\"")
+    refresh_knowledge(entity_name, entity_type, claim_id)
+    notify_write("access", (entity_name, entity_type))
 
 # =============================================================================
 # LOGIC FUNCTIONS
@@ -1,4 +1,5 @@
-from db_utils import driver, create_query_embedding
+from db_utils import driver
+from embeddings import create_query_embedding
 
 # Test vektorsökning
 query = "Vem är din mamma?"
@@ -1,4 +1,6 @@
-from db_utils import driver, get_all_npcs, select_from_menu, create_query_embedding
+from db_utils import driver, get_all_npcs, select_from_menu
+from embeddings import create_query_embedding
+from claim_index import claim_index
 
 # =============================================================================
 # RENDERING: Modifiera claim-text baserat på BELIEF/STANCE
@@ -75,47 +77,25 @@ def render_claim(content, negative, belief_intensity, stance_intensity):
 # =============================================================================
 
 def get_accessible_claim_ids(npc_name):
-    """Hämta alla claim-IDs som NPC:n har tillgång till."""
+    """Hämta alla claim-IDs som NPC:n har tillgång till (direkt eller via GROUP)."""
     with driver.session() as session:
         result = session.run("""
-            MATCH (n:NPC {name: $npc_name})
-            OPTIONAL MATCH (n)-[:BELIEF]->(c1:CLAIM)
-            OPTIONAL MATCH (n)-[:MEMBER_OF]->(g:GROUP)-[:BELIEF]->(c2:CLAIM)
-            WITH collect(DISTINCT c1) + collect(DISTINCT c2) AS claims
-            UNWIND claims AS c
-            WITH c WHERE c IS NOT NULL AND c.embedding IS NOT NULL
-            RETURN DISTINCT id(c) AS id
+            MATCH (:NPC {name: $npc_name})-[:KNOWS]->(c:CLAIM)
+            WHERE c.embedding IS NOT NULL
+            RETURN id(c) AS id
         """, npc_name=npc_name)
         return [r["id"] for r in result]
 
 def find_top_claims(npc_name, query, top_k=5):
-    """Semantisk sökning: hitta de mest relevanta claims för frågan."""
-    accessible_ids = get_accessible_claim_ids(npc_name)
-    if not accessible_ids:
-        return []
+    """
+    Semantisk sökning: hitta de mest relevanta claims för frågan.
     
+    Exakt sökning bland just NPC:ns claims i det processlokala claim_index,
+    så resultatet är fullt även när få av de globalt närmaste claims är
+    tillgängliga för NPC:n. "type" är None eller "relation".
+    """
     query_embedding = create_query_embedding(query)
-    
-    with driver.session() as session:
-        result = session.run("""
-            CALL db.index.vector.queryNodes('claim_index', $top_k * 3, $query_vector)
-            YIELD node, score
-            WHERE id(node) IN $accessible_ids
-            RETURN id(node) AS id, 
-                   node.content AS content, 
-                   node.veracity AS veracity,
-                   node.type AS type,
-                   score
-            LIMIT $top_k
-        """, query_vector=query_embedding, accessible_ids=accessible_ids, top_k=top_k)
-        
-        return [{
-            "id": r["id"], 
-            "content": r["content"], 
-            "veracity": r["veracity"],
-            "type": r["type"],  # None eller "relation"
-            "score": r["score"]
-        } for r in result]
+    return claim_index.search(npc_name, query_embedding, top_k=top_k)
 
 # =============================================================================
 # STEG 2: Hitta refererade konstanter och relation-claims
@@ -145,12 +125,7 @@ def find_relation_claims(npc_name, constant_ids, min_refs=2):
     
     with driver.session() as session:
         result = session.run("""
-            MATCH (n:NPC {name: $npc_name})
-            OPTIONAL MATCH (n)-[:BELIEF]->(c1:CLAIM {type: "relation"})
-            OPTIONAL MATCH (n)-[:MEMBER_OF]->(g:GROUP)-[:BELIEF]->(c2:CLAIM {type: "relation"})
-            WITH collect(DISTINCT c1) + collect(DISTINCT c2) AS claims
-            UNWIND claims AS c
-            WITH c WHERE c IS NOT NULL
+            MATCH (:NPC {name: $npc_name})-[:KNOWS]->(c:CLAIM {type: "relation"})
             
             // Räkna hur många av våra konstanter denna claim refererar till
             MATCH (c)-[:REFERENCE]->(target)
@@ -191,47 +166,48 @@ def remove_duplicates(claims):
 # STEG 4: Gruppera claims i referenskedjor
 # =============================================================================
 
-def get_reference_chain(claim_id, npc_name):
+def get_reference_chains(claim_ids, npc_name):
     """
-    Hämta referenskedjan för en claim (djupaste först).
-    Inkluderar BELIEF/STANCE-värden för rendering.
+    Hämta referenskedjorna för flera claims i en enda fråga.
+    
+    Returnerar {claim_id: kedja}, där varje kedja är sorterad djupaste först
+    och bär NPC:ns BELIEF/STANCE för rendering. En claim som nås på flera
+    djup i samma kedja tas bara med en gång, på sitt största djup.
     """
+    if not claim_ids:
+        return {}
+    
     with driver.session() as session:
         result = session.run("""
+            UNWIND $claim_ids AS claim_id
             MATCH path = (start:CLAIM)-[:REFERENCE*0..5]->(ref:CLAIM)
-            WHERE id(start) = $claim_id
-            WITH ref, length(path) AS depth
-            ORDER BY depth DESC
-            
-            // Hämta BELIEF från NPC eller via GROUP
-            OPTIONAL MATCH (n:NPC {name: $npc_name})-[b:BELIEF]->(ref)
-            OPTIONAL MATCH (n:NPC {name: $npc_name})-[:MEMBER_OF]->(g:GROUP)-[gb:BELIEF]->(ref)
-            
-            // Hämta STANCE
-            OPTIONAL MATCH (n:NPC {name: $npc_name})-[s:STANCE]->(ref)
+            WHERE id(start) = claim_id
+            WITH claim_id, ref, max(length(path)) AS depth
             
-            WITH ref, depth,
-                 COALESCE(b.intensity, gb.intensity) AS belief_intensity,
-                 s.intensity AS stance_intensity
+            // BELIEF/STANCE från NPC:n själv eller ärvt via GROUP
+            OPTIONAL MATCH (:NPC {name: $npc_name})-[k:KNOWS]->(ref)
             
-            RETURN DISTINCT id(ref) AS id, 
-                   ref.content AS content, 
-                   ref.negative AS negative,
-                   ref.type AS type, 
-                   depth,
-                   belief_intensity,
-                   stance_intensity
-        """, claim_id=claim_id, npc_name=npc_name)
+            WITH claim_id, ref, depth, k
+            ORDER BY depth DESC, id(ref)
+            RETURN claim_id, collect({
+                id: id(ref),
+                content: ref.content,
+                negative: ref.negative,
+                type: ref.type,
+                depth: depth,
+                belief_intensity: k.belief,
+                stance_intensity: k.stance
+            }) AS chain
+        """, claim_ids=list(claim_ids), npc_name=npc_name)
         
-        return [{
-            "id": r["id"], 
-            "content": r["content"], 
-            "negative": r["negative"],
-            "type": r["type"], 
-            "depth": r["depth"],
-            "belief_intensity": r["belief_intensity"],
-            "stance_intensity": r["stance_intensity"]
-        } for r in result]
+        return {r["claim_id"]: r["chain"] for r in result}
+
+def get_reference_chain(claim_id, npc_name):
+    """
+    Hämta referenskedjan för en claim (djupaste först).
+    Inkluderar BELIEF/STANCE-värden för rendering.
+    """
+    return get_reference_chains([claim_id], npc_name).get(claim_id, [])
 
 def build_claim_chains(claims, npc_name):
     """
@@ -244,9 +220,12 @@ def build_claim_chains(claims, npc_name):
     claim_ids = {c["id"] for c in claims}
     claims_in_others_chain = set()
     
+    # Alla kedjor i en fråga, används både för överlapp och för att bygga
+    chains = get_reference_chains(claim_ids, npc_name)
+    
     # Identifiera vilka claims som ingår i andras kedjor
     for claim in claims:
-        chain = get_reference_chain(claim["id"], npc_name)
+        chain = chains.get(claim["id"], [])
         for c in chain:
             if c["id"] != claim["id"] and c["id"] in claim_ids:
                 claims_in_others_chain.add(c["id"])
@@ -259,8 +238,7 @@ def build_claim_chains(claims, npc_name):
         if claim["id"] in claims_in_others_chain or claim["id"] in processed:
             continue
         
-        chain = get_reference_chain(claim["id"], npc_name)
-        chain = [c for c in chain if c["id"] not in processed]
+        chain = [c for c in chains.get(claim["id"], []) if c["id"] not in processed]
         
         if not chain:
             continue
@@ -4,12 +4,7 @@ def get_claims_for_npc(npc_name):
     """Hämta alla claims som en NPC har tillgång till."""
     with driver.session() as session:
         result = session.run("""
-            MATCH (n:NPC {name: $npc_name})
-            OPTIONAL MATCH (n)-[:BELIEF]->(c1:CLAIM)
-            OPTIONAL MATCH (n)-[:MEMBER_OF]->(g:GROUP)-[:BELIEF]->(c2:CLAIM)
-            WITH collect(DISTINCT c1) + collect(DISTINCT c2) AS claims
-            UNWIND claims AS c
-            WITH c WHERE c IS NOT NULL
+            MATCH (:NPC {name: $npc_name})-[:KNOWS]->(c:CLAIM)
             RETURN id(c) AS id, 
                    c.content AS content, 
                    c.negative AS negative,
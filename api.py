@@ -1,14 +1,45 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from npc_chat import chat_with_npc, get_npc_context
-from db_neo4j import ex_query
+from typing import AsyncIterator, List, Optional
+from npc_chat import chat_with_npc_async, get_npc_context_async, prepare_chat_prompt_async, context_cache, prompt_cache
+from npc_hybrid_chat import build_hybrid_prompt, chat_with_npc_hybrid
+from llms.backend import chat_stream_async, close_client, close_async_client
+from llms import response_cache
+from query_rag import cypher_cache
+import cypher_guard
+import embeddings
+import memory_writer
+import schema
+import sessions
+from question_classifier import question_classifier
+from db_neo4j import ex_query_async, close_driver, close_async_driver
+import asyncio
+import json
+import uuid
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    memory_writer.start()
+    yield
+    # Let queued memories reach the database before its connections close
+    await run_in_threadpool(memory_writer.stop)
+    # Release the pooled database connections on shutdown
+    await close_async_driver()
+    close_driver()
+    await close_async_client()
+    close_client()
+
 
 app = FastAPI(
     title="Dynamic NPC Chat API",
     description="API for chatting with AI-powered NPCs with persistent memories",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Enable CORS for web frontend integration
@@ -24,11 +55,14 @@ app.add_middleware(
 class ChatRequest(BaseModel):
     npc_name: str
     message: str
+    hybrid: bool = False
+    session_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
     npc_name: str
     response: str
+    session_id: str
 
 
 class NPCInfo(BaseModel):
@@ -55,7 +89,9 @@ async def root():
         "endpoints": {
             "GET /npcs": "List all available NPCs",
             "GET /npcs/{npc_name}": "Get detailed info about an NPC",
-            "POST /chat": "Send a message to an NPC and get a response"
+            "POST /chat": "Send a message to an NPC and get a response",
+            "POST /chat/stream": "Same as /chat, but streams the response as Server-Sent Events",
+            "GET /stats": "Cache and query guard counters"
         }
     }
 
@@ -69,7 +105,7 @@ async def list_npcs():
         RETURN npc.name as name, npc.age as age, npc.role as role
         ORDER BY npc.name
         """
-        records, _, _ = ex_query(query)
+        records, _, _ = await ex_query_async(query)
         
         npcs = [
             NPCInfo(
@@ -89,7 +125,7 @@ async def list_npcs():
 async def get_npc_info(npc_name: str):
     """Get detailed information about a specific NPC"""
     try:
-        context = get_npc_context(npc_name)
+        context = await get_npc_context_async(npc_name)
         
         if not context:
             raise HTTPException(status_code=404, detail=f"NPC '{npc_name}' not found")
@@ -111,20 +147,61 @@ async def get_npc_info(npc_name: str):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+def _record_turn(session: sessions.Session, message: str, response: str,
+                 background_tasks: Optional[BackgroundTasks] = None):
+    """
+    Store a finished turn. Summarizing older turns and queueing the turn for
+    memory write-back happen after the response is sent.
+    """
+    sessions.record_turn(session, message, response)
+    # A fresh id per turn: turn_count starts over when a session is recreated
+    turn = (session.npc_name, session.session_id, uuid.uuid4().hex, message, response)
+    tasks = [(memory_writer.submit, turn)]
+    if session.needs_summary:
+        tasks.append((session.summarize, ()))
+    for task, args in tasks:
+        if background_tasks is not None:
+            background_tasks.add_task(task, *args)
+        else:
+            # Streaming responses have no background tasks; keep the journal
+            # write and the summary call off the event loop all the same
+            future = asyncio.get_running_loop().run_in_executor(None, task, *args)
+            future.add_done_callback(_log_task_failure)
+
+
+def _log_task_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Background task after a streamed turn failed: {future.exception()!r}")
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
     """
     Send a message to an NPC and get a response.
     
     - **npc_name**: Name of the NPC to chat with (e.g., "Elin von Dahlen")
     - **message**: Your message to the NPC
+    - **hybrid**: Verify factual questions against the database first
+    - **session_id**: Continue this conversation; omit it to start a new one
+      and pass the returned session_id with the next message
     """
     try:
-        response = chat_with_npc(request.npc_name, request.message)
+        session = sessions.get_session(request.session_id, request.npc_name)
+        history = session.history()
+        if request.hybrid:
+            response = await run_in_threadpool(
+                chat_with_npc_hybrid, request.npc_name, request.message, history
+            )
+        else:
+            response = await chat_with_npc_async(request.npc_name, request.message, history)
+        
+        if not response.startswith("Error:"):
+            _record_turn(session, request.message, response, background_tasks)
         
         return ChatResponse(
             npc_name=request.npc_name,
-            response=response
+            response=response,
+            session_id=session.session_id
         )
     except Exception as e:
         if "not found" in str(e).lower():
@@ -132,17 +209,85 @@ async def chat(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+def _sse(data: dict, event: Optional[str] = None) -> str:
+    """Format one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def _sse_tokens(tokens: AsyncIterator[str], session: sessions.Session,
+                      message: str) -> AsyncIterator[str]:
+    reply = []
+    try:
+        async for token in tokens:
+            reply.append(token)
+            yield _sse({"token": token})
+    except Exception as e:
+        yield _sse({"detail": str(e)}, event="error")
+        return
+    _record_turn(session, message, "".join(reply))
+    yield _sse({"session_id": session.session_id}, event="done")
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Send a message to an NPC and stream the response as it is generated.
+
+    Each token arrives as `data: {"token": "..."}`. The stream ends with an
+    `event: done` message carrying the session_id, or `event: error` if
+    generation fails midway.
+    """
+    try:
+        session = sessions.get_session(request.session_id, request.npc_name)
+        history = session.history()
+        if request.hybrid:
+            prompt = await run_in_threadpool(
+                build_hybrid_prompt, request.npc_name, request.message, history=history
+            )
+        else:
+            prompt = await prepare_chat_prompt_async(request.npc_name, request.message, history)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    if prompt is None:
+        raise HTTPException(status_code=404, detail=f"NPC '{request.npc_name}' not found")
+    
+    return StreamingResponse(
+        _sse_tokens(chat_stream_async(prompt), session, request.message),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
         # Test database connection
-        ex_query("RETURN 1")
+        await ex_query_async("RETURN 1")
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
 
+@app.get("/stats")
+async def stats():
+    """Cache hit/miss/eviction counters"""
+    return {
+        "npc_context_cache": context_cache.stats(),
+        "npc_prompt_cache": prompt_cache.stats(),
+        "llm_response_cache": response_cache.stats(),
+        "cypher_cache": cypher_cache.stats(),
+        "cypher_guard": cypher_guard.stats(),
+        "schema": schema.stats(),
+        "embedding_cache": embeddings.cache_stats(),
+        "sessions": sessions.stats(),
+        "memory_writer": memory_writer.stats(),
+        "question_classifier": question_classifier.stats(),
+    }
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,126 @@
+"""
+Benchmark: per-NPC claim retrieval, vector index + filter vs the in-process index.
+
+Seeds synthetic CLAIMs with random vectors and one NPC that believes a small
+fraction of them, then runs the same query vectors through
+
+  - the previous find_top_claims: query the global claim_index for top_k * 3
+    neighbours and keep those the NPC can access, and
+  - claim_index.search: exact masked top-k over the NPC's claims in memory,
+
+and reports latency and recall@k against a brute-force ground truth. Uses
+the database of the scripts in "Julius old". All seeded nodes carry
+bench = true and are removed afterwards.
+
+    python -m benchmarks.bench_claim_index
+"""
+from benchmarks.common import print_table, time_call
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Julius old"))
+from claim_index import claim_index  # noqa: E402
+from db_utils import driver, refresh_knowledge  # noqa: E402
+from hitta_info import get_accessible_claim_ids  # noqa: E402
+
+CLAIMS = 5000
+DIMENSIONS = 1024
+ACCESS_FRACTION = 0.05
+QUERIES = 20
+TOP_K = 5
+NPC_NAME = "Bench NPC"
+
+
+def legacy_top_claims(npc_name, query_vector, top_k):
+    """find_top_claims as it was before the in-process index."""
+    accessible_ids = get_accessible_claim_ids(npc_name)
+    if not accessible_ids:
+        return []
+    with driver.session() as session:
+        result = session.run("""
+            CALL db.index.vector.queryNodes('claim_index', $top_k * 3, $query_vector)
+            YIELD node, score
+            WHERE id(node) IN $accessible_ids
+            RETURN id(node) AS id, score
+            LIMIT $top_k
+        """, query_vector=query_vector, accessible_ids=accessible_ids, top_k=top_k)
+        return [{"id": r["id"], "score": r["score"]} for r in result]
+
+
+def seed(vectors, known):
+    with driver.session() as session:
+        session.run("CREATE (:NPC {name: $name, bench: true})", name=NPC_NAME)
+        ids = []
+        for start in range(0, len(vectors), 500):
+            rows = [{"i": i, "embedding": vectors[i].tolist(), "known": bool(known[i])}
+                    for i in range(start, min(start + 500, len(vectors)))]
+            result = session.run("""
+                MATCH (n:NPC {name: $name})
+                UNWIND $rows AS row
+                CREATE (c:CLAIM {content: 'Benchmark claim ' + row.i, veracity: 1.0,
+                                 embedding: row.embedding, bench: true})
+                FOREACH (_ IN CASE WHEN row.known THEN [1] ELSE [] END |
+                    CREATE (n)-[:BELIEF {intensity: 1.0}]->(c))
+                RETURN id(c) AS id ORDER BY row.i
+            """, name=NPC_NAME, rows=rows)
+            ids += [r["id"] for r in result]
+        session.run("CALL db.awaitIndexes(300)")
+    refresh_knowledge(NPC_NAME, "NPC")
+    return ids
+
+
+def cleanup():
+    with driver.session() as session:
+        while True:
+            deleted = session.run("""
+                MATCH (n) WHERE n.bench = true
+                WITH n LIMIT 10000
+                DETACH DELETE n
+                RETURN count(*) AS deleted
+            """).single()["deleted"]
+            if deleted == 0:
+                return
+
+
+def recall(results, truth):
+    return len({r["id"] for r in results} & truth) / len(truth)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((CLAIMS, DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    known = rng.random(CLAIMS) < ACCESS_FRACTION
+    queries = rng.standard_normal((QUERIES, DIMENSIONS)).astype(np.float32)
+
+    cleanup()
+    try:
+        ids = np.array(seed(vectors, known))
+        claim_index.load()
+
+        # Ground truth: brute force over the NPC's claims only
+        truths = []
+        for query in queries:
+            scores = vectors[known] @ (query / np.linalg.norm(query))
+            truths.append(set(ids[known][np.argsort(-scores)[:TOP_K]].tolist()))
+
+        rows = []
+        for name, search in [
+            ("vector index + filter", lambda q: legacy_top_claims(NPC_NAME, q.tolist(), TOP_K)),
+            ("in-process index", lambda q: claim_index.search(NPC_NAME, q, TOP_K)),
+        ]:
+            recalls = [recall(search(q), truth) for q, truth in zip(queries, truths)]
+            timing = time_call(lambda: search(queries[0]))
+            rows.append([name, timing["median_ms"], timing["p95_ms"], float(np.mean(recalls))])
+
+        print(f"\n{CLAIMS} claims, {int(known.sum())} known by the NPC, top {TOP_K}")
+        print_table(["method", "median ms", "p95 ms", f"recall@{TOP_K}"], rows)
+    finally:
+        cleanup()
+        claim_index.load()
+
+
+if __name__ == "__main__":
+    main()
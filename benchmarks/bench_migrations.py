@@ -0,0 +1,125 @@
+"""
+Benchmark: lookups and MERGE-heavy writes before and after the migrations.
+
+Seeds a few thousand synthetic NPCs with memories and events, rolls the
+migrations back, times NPC context loading and the MERGE-based writers
+without constraints, applies the migrations and times them again. The
+database is left migrated. All seeded nodes carry bench = true and are
+removed afterwards.
+
+Rolling back drops every constraint and index and the KNOWS view, so this
+only runs against a scratch database, given with --database or
+NEO4J_BENCH_DB, never the one in NEO4J_DATABASE or the server's default:
+
+    python -m benchmarks.bench_migrations --database bench
+"""
+from benchmarks.common import print_table, time_call
+from db_neo4j import ex_query, get_driver
+from npc_chat import NPC_CONTEXTS_QUERY
+import argparse
+import db_neo4j
+import itertools
+import migrations
+import os
+
+NPCS = 5000
+MEMORIES_PER_NPC = 4
+
+# The writers' statements, minus embedding and cache invalidation
+EVENT_UPSERT = """
+MERGE (e:Event {event_id: $event_id})
+SET e.location = 'Great hall', e.start_time = '20:00', e.stop_time = '21:00',
+    e.summary = 'Benchmark event', e.bench = true
+"""
+MEMORY_UPSERT = """
+MATCH (npc:NPC {name: $npc_name})
+MERGE (m:Memory {memory_id: $memory_id})
+SET m.memory = 'Benchmark memory', m.bench = true
+MERGE (npc)-[:HAS_MEMORY]->(m)
+WITH m
+MATCH (e:Event {event_id: $event_id})
+MERGE (m)-[:MEMORY_OF]->(e)
+"""
+NPC_UPSERT = "MERGE (npc:NPC {name: $name}) SET npc.bench = true"
+
+
+def seed():
+    for start in range(0, NPCS, 500):
+        ex_query("""
+        UNWIND range($start, $end) AS i
+        CREATE (npc:NPC {name: 'Bench NPC ' + i, age: 40, role: 'benchmark', bench: true})
+        WITH npc, i
+        UNWIND range(1, $memories) AS j
+        CREATE (m:Memory {memory_id: 'bench-memory-' + i + '-' + j, memory: 'Benchmark memory', bench: true})
+        CREATE (e:Event {event_id: 'bench-event-' + i + '-' + j, location: 'Great hall', start_time: '20:00',
+                         stop_time: '21:00', summary: 'Benchmark event', bench: true})
+        CREATE (npc)-[:HAS_MEMORY]->(m)-[:MEMORY_OF]->(e)
+        """, {"start": start, "end": min(start + 500, NPCS) - 1, "memories": MEMORIES_PER_NPC})
+
+
+def cleanup():
+    while True:
+        records, _, _ = ex_query("""
+        MATCH (n) WHERE n.bench = true
+        WITH n LIMIT 10000
+        DETACH DELETE n
+        RETURN count(*) AS deleted
+        """)
+        if not records or records[0]["deleted"] == 0:
+            return
+
+
+def measure() -> dict:
+    ids = itertools.count()
+    name = f"Bench NPC {NPCS // 2}"
+    return {
+        "get_npc_context": time_call(lambda: ex_query(NPC_CONTEXTS_QUERY, {"npc_names": [name]})),
+        "event by id": time_call(lambda: ex_query(
+            "MATCH (e:Event {event_id: $event_id}) RETURN e", {"event_id": "bench-event-10-1"})),
+        "MERGE NPC": time_call(lambda: ex_query(NPC_UPSERT, {"name": f"Bench new NPC {next(ids)}"})),
+        "MERGE event": time_call(lambda: ex_query(EVENT_UPSERT, {"event_id": f"bench-new-event-{next(ids)}"})),
+        "MERGE memory": time_call(lambda: ex_query(MEMORY_UPSERT, {
+            "npc_name": name, "memory_id": f"bench-new-memory-{next(ids)}", "event_id": "bench-event-10-1"})),
+    }
+
+
+def _scratch_database(name: str) -> str:
+    """name, if it is safe to roll back; raises SystemExit otherwise."""
+    if not name:
+        raise SystemExit("Refusing to run: give a scratch database with --database or NEO4J_BENCH_DB")
+    records, _, _ = get_driver().execute_query("SHOW DEFAULT DATABASE YIELD name", database_="system")
+    protected = {db_neo4j.DATABASE, "system"} | {r["name"] for r in records}
+    if name in protected:
+        raise SystemExit(f"Refusing to run against '{name}': the benchmark rolls back every migration")
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lookups and writes before and after the migrations.")
+    parser.add_argument("--database", default=os.getenv("NEO4J_BENCH_DB", ""),
+                        help="scratch database to run in (default: NEO4J_BENCH_DB)")
+    args = parser.parse_args()
+    # Every ex_query below, including the migrations', now runs in the scratch database
+    db_neo4j.DATABASE = _scratch_database(args.database)
+
+    cleanup()
+    try:
+        seed()
+        migrations.rollback(0)
+        before = measure()
+        migrations.migrate()
+        after = measure()
+
+        print(f"\n{NPCS} NPCs, {NPCS * MEMORIES_PER_NPC} memories and events (median ms)")
+        print_table(
+            ["operation", "before", "after", "speedup"],
+            [[op, before[op]["median_ms"], after[op]["median_ms"],
+              before[op]["median_ms"] / after[op]["median_ms"]] for op in before],
+        )
+    finally:
+        cleanup()
+        migrations.migrate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: NPC context loading, chained OPTIONAL MATCH vs. batched subqueries.
+
+Seeds synthetic NPCs with a grid of trait and memory counts, times the old
+single-NPC query against NPC_CONTEXTS_QUERY (cache bypassed), and then times
+loading every seeded NPC one by one versus in a single batched round trip.
+All seeded nodes carry bench = true and are removed afterwards.
+
+    python -m benchmarks.bench_npc_context
+"""
+from benchmarks.common import print_table, time_call
+from db_neo4j import ex_query
+from npc_chat import NPC_CONTEXTS_QUERY
+
+# The query get_npc_context used before the batched loader
+LEGACY_QUERY = """
+    MATCH (npc:NPC {name: $npc_name})
+    OPTIONAL MATCH (npc)-[:HAS_PERSONALITY]->(p:Personality)
+    OPTIONAL MATCH (p)-[:HAS_TRAIT]->(t:Trait)
+    OPTIONAL MATCH (npc)-[:HAS_MEMORY]->(m:Memory)
+    OPTIONAL MATCH (m)-[:MEMORY_OF]->(e:Event)
+    RETURN
+        npc,
+        p as personality,
+        collect(DISTINCT t.trait) as traits,
+        collect(DISTINCT {
+            memory_id: m.memory_id,
+            memory: m.memory,
+            event_id: e.event_id,
+            event_location: e.location,
+            event_time: e.start_time + ' - ' + e.stop_time,
+            event_summary: e.summary
+        }) as memories
+    """
+
+TRAIT_COUNTS = [1, 5, 20]
+MEMORY_COUNTS = [10, 100, 1000]
+
+
+def seed_npc(name: str, traits: int, memories: int):
+    ex_query("""
+    MERGE (npc:NPC {name: $name})
+    SET npc.bench = true, npc.age = 40, npc.role = 'benchmark'
+    MERGE (p:Personality {personality_id: $name + '-personality'})
+    SET p.bench = true, p.summary = 'Benchmark persona', p.lie_style = 'none',
+        p.conflict_style = 'none', p.stress_response = 'none'
+    MERGE (npc)-[:HAS_PERSONALITY]->(p)
+    WITH p
+    UNWIND range(1, $traits) AS i
+    MERGE (t:Trait {trait: $name + ' trait ' + i})
+    SET t.bench = true
+    MERGE (p)-[:HAS_TRAIT]->(t)
+    """, {"name": name, "traits": traits})
+
+    ex_query("""
+    MATCH (npc:NPC {name: $name})
+    UNWIND range(1, $memories) AS i
+    CREATE (m:Memory {memory_id: $name + '-memory-' + i, memory: 'Benchmark memory ' + i, bench: true})
+    CREATE (e:Event {event_id: $name + '-event-' + i, location: 'Great hall', start_time: '20:00',
+                     stop_time: '21:00', summary: 'Benchmark event ' + i, bench: true})
+    CREATE (npc)-[:HAS_MEMORY]->(m)-[:MEMORY_OF]->(e)
+    """, {"name": name, "memories": memories})
+
+
+def cleanup():
+    ex_query("MATCH (n) WHERE n.bench = true DETACH DELETE n")
+
+
+def main():
+    cleanup()
+    names = []
+    rows = []
+    try:
+        for traits in TRAIT_COUNTS:
+            for memories in MEMORY_COUNTS:
+                name = f"Bench NPC t{traits} m{memories}"
+                seed_npc(name, traits, memories)
+                names.append(name)
+
+                legacy = time_call(lambda: ex_query(LEGACY_QUERY, {"npc_name": name}), repeat=10)
+                batched = time_call(lambda: ex_query(NPC_CONTEXTS_QUERY, {"npc_names": [name]}), repeat=10)
+                rows.append([traits, memories, legacy["median_ms"], batched["median_ms"],
+                             legacy["median_ms"] / batched["median_ms"]])
+
+        print("\nSingle NPC context load (median ms)")
+        print_table(["traits", "memories", "chained", "subqueries", "speedup"], rows)
+
+        one_by_one = time_call(lambda: [ex_query(LEGACY_QUERY, {"npc_name": n}) for n in names], repeat=5)
+        one_trip = time_call(lambda: ex_query(NPC_CONTEXTS_QUERY, {"npc_names": names}), repeat=5)
+        print(f"\nAll {len(names)} NPCs (median ms)")
+        print_table(["chained, one query per NPC", "batched, one round trip"],
+                    [[one_by_one["median_ms"], one_trip["median_ms"]]])
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark: reference-chain resolution in build_claim_chains as claims grow.
+
+Seeds chains of CLAIMs linked by REFERENCE and an NPC that believes them,
+then resolves the chains for an increasing number of claims, once with the
+original per-claim query, twice over, as build_claim_chains used to do, and
+once with the batched get_reference_chains. Uses the database of
+the scripts in "Julius old". All seeded nodes carry bench = true and are
+removed afterwards.
+
+    python -m benchmarks.bench_reference_chains
+"""
+from benchmarks.common import print_table, time_call
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Julius old"))
+from db_utils import driver, refresh_knowledge  # noqa: E402
+from hitta_info import get_reference_chains  # noqa: E402
+
+CLAIM_COUNTS = [1, 3, 5, 10, 20, 50]
+CHAIN_LENGTH = 4
+NPC_NAME = "Bench NPC"
+
+# The query get_reference_chain ran for each claim before the batched version
+LEGACY_QUERY = """
+    MATCH path = (start:CLAIM)-[:REFERENCE*0..5]->(ref:CLAIM)
+    WHERE id(start) = $claim_id
+    WITH ref, length(path) AS depth
+    ORDER BY depth DESC
+    OPTIONAL MATCH (n:NPC {name: $npc_name})-[b:BELIEF]->(ref)
+    OPTIONAL MATCH (n:NPC {name: $npc_name})-[:MEMBER_OF]->(g:GROUP)-[gb:BELIEF]->(ref)
+    OPTIONAL MATCH (n:NPC {name: $npc_name})-[s:STANCE]->(ref)
+    WITH ref, depth, COALESCE(b.intensity, gb.intensity) AS belief_intensity, s.intensity AS stance_intensity
+    RETURN DISTINCT id(ref) AS id, ref.content AS content, ref.negative AS negative,
+           ref.type AS type, depth, belief_intensity, stance_intensity
+"""
+
+
+def seed(chains):
+    """Create chains of CHAIN_LENGTH claims and return the id of each chain's head."""
+    heads = []
+    with driver.session() as session:
+        session.run("CREATE (:NPC {name: $name, bench: true})", name=NPC_NAME)
+        for i in range(chains):
+            result = session.run("""
+                MATCH (n:NPC {name: $name})
+                UNWIND range(1, $length) AS j
+                CREATE (c:CLAIM {content: 'Benchmark claim ' + $chain + '.' + j, veracity: 1.0, bench: true})
+                CREATE (n)-[:BELIEF {intensity: 0.8}]->(c)
+                CREATE (n)-[:STANCE {intensity: 0.2}]->(c)
+                RETURN id(c) AS id ORDER BY j
+            """, name=NPC_NAME, chain=i, length=CHAIN_LENGTH)
+            ids = [r["id"] for r in result]
+            session.run("""
+                UNWIND range(0, size($ids) - 2) AS k
+                MATCH (a:CLAIM), (b:CLAIM) WHERE id(a) = $ids[k] AND id(b) = $ids[k + 1]
+                CREATE (a)-[:REFERENCE]->(b)
+            """, ids=ids)
+            heads.append(ids[0])
+    refresh_knowledge(NPC_NAME, "NPC")
+    return heads
+
+
+def cleanup():
+    with driver.session() as session:
+        session.run("MATCH (n) WHERE n.bench = true DETACH DELETE n")
+
+
+def per_claim(claim_ids):
+    # One pass to find overlaps and one to build, a session per call, as before
+    for _ in range(2):
+        for claim_id in claim_ids:
+            with driver.session() as session:
+                [record.data() for record in session.run(LEGACY_QUERY, claim_id=claim_id, npc_name=NPC_NAME)]
+
+
+def main():
+    cleanup()
+    try:
+        heads = seed(max(CLAIM_COUNTS))
+        rows = []
+        for count in CLAIM_COUNTS:
+            claim_ids = heads[:count]
+            before = time_call(lambda: per_claim(claim_ids))
+            after = time_call(lambda: get_reference_chains(claim_ids, NPC_NAME))
+            rows.append([count, 2 * count, before["median_ms"], after["median_ms"],
+                         before["median_ms"] / after["median_ms"]])
+
+        print(f"\nChains of {CHAIN_LENGTH} claims (median ms)")
+        print_table(["claims", "queries before", "per claim", "batched", "speedup"], rows)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
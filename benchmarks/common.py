@@ -0,0 +1,38 @@
+"""
+Small timing helpers shared by the benchmark scripts.
+
+Benchmarks are run from the repository root against the database in .env,
+for example: python -m benchmarks.bench_npc_context
+"""
+import statistics
+import time
+from typing import Callable, List, Sequence
+
+
+def time_call(fn: Callable[[], object], repeat: int = 20, warmup: int = 2) -> dict:
+    """Call fn repeatedly and return latency statistics in milliseconds."""
+    for _ in range(warmup):
+        fn()
+
+    samples: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    samples.sort()
+    return {
+        "median_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_ms": samples[0],
+    }
+
+
+def print_table(headers: Sequence[str], rows: Sequence[Sequence[object]]):
+    """Print rows as a fixed-width table."""
+    cells = [[f"{c:.2f}" if isinstance(c, float) else str(c) for c in row] for row in rows]
+    widths = [max(len(h), *(len(r[i]) for r in cells)) if cells else len(h) for i, h in enumerate(headers)]
+    print("  ".join(h.rjust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in cells:
+        print("  ".join(c.rjust(w) for c, w in zip(row, widths)))
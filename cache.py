@@ -0,0 +1,234 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with an optional time-to-live.
+
+    Each key has a version that is bumped whenever the key is invalidated.
+    Loaders read the version before going to the database and pass it to
+    set(), so a value loaded before an invalidation is never stored after it.
+
+    Versions are dropped together with evicted or expired entries, and at
+    most max_size of them are kept. Keys without a version share a floor
+    that is raised to every dropped version, so a load that started before
+    its key was dropped is still rejected.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._versions: "OrderedDict[Hashable, int]" = OrderedDict()
+        # Versions come from one counter; _floor is the version of keys without one
+        self._clock = 0
+        self._floor = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None,
+            accept: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Return the cached value for key, or default if missing or expired.
+
+        If accept is given, a value it rejects is left in place but treated
+        (and counted) as a miss.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._drop_version(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            if accept is not None and not accept(value):
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Like get(), but without touching recency or the hit/miss counters."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                return default
+            return entry[1]
+
+    def version(self, key: Hashable) -> Tuple[int, int]:
+        """Current version of key, to be passed back to set()."""
+        with self._lock:
+            return self._generation, self._versions.get(key, self._floor)
+
+    def set(self, key: Hashable, value: Any, version: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        Store value under key.
+
+        If version is given and the key has been invalidated since it was
+        read, the value is stale and is dropped. Returns True if stored.
+        """
+        with self._lock:
+            if version is not None and version != (self._generation, self._versions.get(key, self._floor)):
+                return False
+
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                evicted, _ = self._data.popitem(last=False)
+                self._drop_version(evicted)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key: Hashable):
+        """Drop key and bump its version."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._clock += 1
+            self._versions[key] = self._clock
+            self._versions.move_to_end(key)
+            # Keys invalidated but never loaded again are dropped oldest first
+            while len(self._versions) > self.max_size:
+                _, dropped = self._versions.popitem(last=False)
+                self._floor = max(self._floor, dropped)
+            self.invalidations += 1
+
+    def _drop_version(self, key: Hashable):
+        # Caller holds the lock
+        dropped = self._versions.pop(key, None)
+        if dropped is not None:
+            self._floor = max(self._floor, dropped)
+
+    def clear(self):
+        """Drop every entry and invalidate all in-flight loads."""
+        with self._lock:
+            self._data.clear()
+            self._versions.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SQLiteCache:
+    """
+    Persistent key/value cache in a SQLite file with LRU eviction.
+
+    Values are bytes. The file survives restarts and can be shared by
+    several worker processes; each instance is safe to share across threads.
+    """
+
+    def __init__(self, path: str, table: str = "cache", max_entries: int = 10000):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        self._count = self._conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the value stored under key and mark it as recently used."""
+        with self._lock:
+            row = self._conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes):
+        """Store value under key, evicting the least recently used entries if full."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {self.table} (key, value, last_used) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            if cursor.rowcount:
+                self._count += 1
+            else:
+                self._conn.execute(
+                    f"UPDATE {self.table} SET value = ?, last_used = ? WHERE key = ?",
+                    (value, time.time(), key),
+                )
+
+            if self._count > self.max_entries:
+                # Other processes may have written too, so recount before evicting
+                self._count = self._conn.execute(f"SELECT count(*) FROM {self.table}").fetchone()[0]
+                excess = self._count - self.max_entries
+                if excess > 0:
+                    self._conn.execute(
+                        f"DELETE FROM {self.table} WHERE key IN "
+                        f"(SELECT key FROM {self.table} ORDER BY last_used LIMIT ?)",
+                        (excess,),
+                    )
+                    self._count -= excess
+                    self.evictions += excess
+
+    def delete(self, key: str):
+        with self._lock:
+            cursor = self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._count -= cursor.rowcount
+
+    def __len__(self) -> int:
+        return self._count
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
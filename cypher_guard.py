@@ -0,0 +1,154 @@
+"""
+Guarded execution of LLM-generated Cypher.
+
+Generated queries are untrusted: a hallucinated cartesian product or an
+unbounded variable-length match can keep the database busy for everyone.
+Before a query runs it is EXPLAINed, and it is rejected if it is not
+read-only, contains a cartesian product or an unbounded path, or if its plan
+is estimated to touch too many rows or has too many operators. Queries that
+pass run in a read-only transaction with a timeout, and at most MAX_ROWS
+records are fetched.
+
+Every rejection is counted and the most recent ones are kept for /stats.
+"""
+from collections import Counter, deque
+from dataclasses import dataclass
+from db_neo4j import DATABASE, get_driver
+from dotenv import load_dotenv
+from neo4j import READ_ACCESS, RoutingControl
+from neo4j.exceptions import ClientError
+from typing import Any, Dict, Iterator, List, Optional
+import os
+import re
+import threading
+import time
+
+load_dotenv()
+
+# Highest row estimate allowed for any operator in the plan
+MAX_ESTIMATED_ROWS = float(os.getenv("CYPHER_MAX_ESTIMATED_ROWS", "100000"))
+# Most operators allowed in the plan
+MAX_OPERATORS = int(os.getenv("CYPHER_MAX_OPERATORS", "40"))
+# Transaction timeout in seconds
+TIMEOUT = float(os.getenv("CYPHER_TIMEOUT", "5"))
+# Records fetched at most; the rest of the result is discarded server-side
+MAX_ROWS = int(os.getenv("CYPHER_MAX_ROWS", "200"))
+# Number of recent rejections kept for inspection
+REJECTION_LOG_SIZE = int(os.getenv("CYPHER_REJECTION_LOG_SIZE", "100"))
+
+# -[*]-, -[r*2..]-, -[:KNOWS*..]- and similar lengths without an upper bound
+UNBOUNDED_PATH = re.compile(r"\[[^\]]*\*\s*(\d+\s*\.\.\s*|\.\.\s*)?\]")
+
+_lock = threading.Lock()
+_checked = 0
+_rejections: Counter = Counter()
+_recent: deque = deque(maxlen=REJECTION_LOG_SIZE)
+
+
+class CypherRejected(Exception):
+    """A generated query was refused before or while running."""
+
+    def __init__(self, reason: str, detail: str, cypher: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+        self.cypher = cypher
+
+
+@dataclass
+class GuardedResult:
+    records: List[Any]
+    keys: List[str]
+    truncated: bool
+
+
+def _reject(reason: str, detail: str, cypher: str) -> CypherRejected:
+    with _lock:
+        _rejections[reason] += 1
+        _recent.append({"time": time.time(), "reason": reason, "detail": detail, "cypher": cypher})
+    print(f"🛑 Rejected query ({reason}: {detail})")
+    return CypherRejected(reason, detail, cypher)
+
+
+def _operators(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("children", []):
+        yield from _operators(child)
+
+
+def check(cypher: str, parameters: Optional[Dict[str, Any]] = None):
+    """
+    EXPLAIN the query and raise CypherRejected if it may not run.
+
+    Syntax errors from the database are raised as they are.
+    """
+    global _checked
+    with _lock:
+        _checked += 1
+
+    if UNBOUNDED_PATH.search(cypher):
+        raise _reject("unbounded_path", "variable-length pattern without an upper bound", cypher)
+
+    _, summary, _ = get_driver().execute_query(
+        f"EXPLAIN {cypher}",
+        parameters or {},
+        database_=DATABASE,
+        routing_=RoutingControl.READ,
+    )
+    if summary.query_type != "r":
+        raise _reject("not_read_only", f"query type {summary.query_type!r}", cypher)
+
+    operators = list(_operators(summary.plan or {}))
+    if len(operators) > MAX_OPERATORS:
+        raise _reject("too_many_operators", f"{len(operators)} > {MAX_OPERATORS}", cypher)
+
+    for op in operators:
+        op_type = op.get("operatorType", "")
+        if op_type.startswith("CartesianProduct"):
+            raise _reject("cartesian_product", op_type, cypher)
+
+    estimated = max((op.get("arguments", {}).get("EstimatedRows", 0) for op in operators), default=0)
+    if estimated > MAX_ESTIMATED_ROWS:
+        raise _reject("too_many_rows", f"estimated {estimated:.0f} > {MAX_ESTIMATED_ROWS:.0f}", cypher)
+
+
+def run_guarded(cypher: str, parameters: Optional[Dict[str, Any]] = None) -> GuardedResult:
+    """
+    Check the query, then run it read-only with a timeout and a row cap.
+
+    Raises CypherRejected if the plan is refused or the query times out.
+    """
+    check(cypher, parameters)
+
+    # Fetching one row past the cap tells us whether the result was cut off;
+    # rolling back (instead of committing on exit) discards the rest unread.
+    with get_driver().session(database=DATABASE, default_access_mode=READ_ACCESS,
+                              fetch_size=MAX_ROWS + 1) as session:
+        try:
+            with session.begin_transaction(timeout=TIMEOUT) as tx:
+                result = tx.run(cypher, parameters or {})
+                keys = list(result.keys())
+                records = result.fetch(MAX_ROWS + 1)
+                tx.rollback()
+        except ClientError as e:
+            if "TransactionTimedOut" in (e.code or ""):
+                raise _reject("timeout", f"exceeded {TIMEOUT:.0f}s", cypher) from e
+            raise
+
+    truncated = len(records) > MAX_ROWS
+    if truncated:
+        print(f"⚠️ Result truncated to {MAX_ROWS} rows")
+    return GuardedResult(records=records[:MAX_ROWS], keys=keys, truncated=truncated)
+
+
+def stats() -> Dict[str, Any]:
+    """Counters of checked and rejected queries, plus the latest rejections."""
+    with _lock:
+        rejected = sum(_rejections.values())
+        return {
+            "checked": _checked,
+            "rejected": rejected,
+            "rejection_rate": rejected / _checked if _checked else 0.0,
+            "by_reason": dict(_rejections),
+            "recent": list(_recent),
+        }
@@ -1,6 +1,9 @@
-from neo4j import Driver, GraphDatabase
+from neo4j import AsyncDriver, AsyncGraphDatabase, Driver, GraphDatabase
 from dotenv import load_dotenv
+from embeddings import EMBEDDING_MODEL, create_embedding, text_hash
 import os
+import threading
+from typing import Callable
 
 load_dotenv()  # reads variables from a .env file and sets them in os.environ
 
@@ -14,26 +17,129 @@ if not db_user or not db_password or not db_uri:
 
 AUTH = (db_user, db_password)
 
-def ex_query(query, parameters=None):
-    if not db_uri:
-        raise ValueError("NEO4J_URI environment variable must be set")
-    
-    with GraphDatabase.driver(db_uri, auth=AUTH) as driver:
-        driver.verify_connectivity()
-        print("Connection established.")
-
-        records, summary, keys = driver.execute_query(
-            query,
-            parameters or {},
-            database_="neo4j",
+# Database every query runs against
+DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+
+# Connection pool settings, shared by every query in the process
+MAX_POOL_SIZE = int(os.getenv("NEO4J_MAX_POOL_SIZE", "50"))
+ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", "30"))
+MAX_CONNECTION_LIFETIME = float(os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", "3600"))
+
+_driver: Driver | None = None
+_driver_lock = threading.Lock()
+_async_driver: AsyncDriver | None = None
+
+# Callbacks run after writes that change what an NPC knows (see notify_npc_changed)
+_invalidation_listeners: list[Callable[[str | None], None]] = []
+
+
+def get_driver() -> Driver:
+    """
+    Return the process-wide Neo4j driver, creating it on first use.
+
+    The driver owns a thread-safe connection pool, so it is shared by all
+    callers instead of opening a new connection per query.
+    """
+    global _driver
+    if _driver is not None:
+        return _driver
+
+    with _driver_lock:
+        if _driver is None:
+            if not db_uri:
+                raise ValueError("NEO4J_URI environment variable must be set")
+            driver = GraphDatabase.driver(
+                db_uri,
+                auth=AUTH,
+                max_connection_pool_size=MAX_POOL_SIZE,
+                connection_acquisition_timeout=ACQUISITION_TIMEOUT,
+                max_connection_lifetime=MAX_CONNECTION_LIFETIME,
+            )
+            driver.verify_connectivity()
+            print("Connection established.")
+            _driver = driver
+    return _driver
+
+
+def close_driver():
+    """Close the shared driver and its pooled connections (e.g. on shutdown)."""
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+
+def get_async_driver() -> AsyncDriver:
+    """
+    Return the process-wide async Neo4j driver, creating it on first use.
+
+    Must be called from the event loop that serves requests; the driver is
+    created without awaiting, so concurrent first calls cannot race.
+    """
+    global _async_driver
+    if _async_driver is None:
+        if not db_uri:
+            raise ValueError("NEO4J_URI environment variable must be set")
+        _async_driver = AsyncGraphDatabase.driver(
+            db_uri,
+            auth=AUTH,
+            max_connection_pool_size=MAX_POOL_SIZE,
+            connection_acquisition_timeout=ACQUISITION_TIMEOUT,
+            max_connection_lifetime=MAX_CONNECTION_LIFETIME,
         )
-        return records, summary, keys
+    return _async_driver
+
+
+async def close_async_driver():
+    """Close the shared async driver and its pooled connections."""
+    global _async_driver
+    if _async_driver is not None:
+        driver, _async_driver = _async_driver, None
+        await driver.close()
+
+
+def ex_query(query, parameters=None):
+    records, summary, keys = get_driver().execute_query(
+        query,
+        parameters or {},
+        database_=DATABASE,
+    )
+    return records, summary, keys
+
+
+def add_invalidation_listener(listener: Callable[[str | None], None]):
+    """
+    Register a callback that is run after writes that change an NPC's context.
+
+    The callback receives the NPC name, or None if every NPC may be affected.
+    """
+    _invalidation_listeners.append(listener)
+
+
+def notify_npc_changed(npc_name: str | None = None):
+    """Tell caches that the context of npc_name (or of every NPC) changed."""
+    for listener in list(_invalidation_listeners):
+        listener(npc_name)
+
+
+async def ex_query_async(query, parameters=None):
+    """Async counterpart of ex_query that never blocks the event loop."""
+    records, summary, keys = await get_async_driver().execute_query(
+        query,
+        parameters or {},
+        database_=DATABASE,
+    )
+    return records, summary, keys
 
 
 def execute_create_event_node(event_id: str, start_time: str, stop_time: str | None = None, location: str = "", summary: str = ""):
     query = """
-    MERGE (e:Event {event_id: $event_id, location: $location, start_time: $start_time, stop_time: $stop_time, summary: $summary})
-    RETURN e
+    MERGE (e:Event {event_id: $event_id})
+    SET e.location = $location, e.start_time = $start_time, e.stop_time = $stop_time, e.summary = $summary
+    WITH e
+    OPTIONAL MATCH (npc:NPC)-[:HAS_MEMORY]->(:Memory)-[:MEMORY_OF]->(e)
+    RETURN e, collect(DISTINCT npc.name) AS npc_names
     """
     parameters = {
         "event_id": event_id, 
@@ -42,4 +148,57 @@ def execute_create_event_node(event_id: str, start_time: str, stop_time: str | N
         "stop_time": stop_time or None,  
         "summary": summary
     }
-    return ex_query(query, parameters)
\ No newline at end of file
+    result = ex_query(query, parameters)
+
+    # NPCs that remember this event now see it in their context
+    records = result[0]
+    for npc_name in records[0]["npc_names"] if records else []:
+        notify_npc_changed(npc_name)
+    return result
+
+
+def _try_embedding(text: str) -> list[float] | None:
+    """Embed text, or return None so the write can go ahead and be backfilled later."""
+    try:
+        return create_embedding(text)
+    except Exception as e:
+        print(f"Embedding failed, storing without it: {e}")
+        return None
+
+
+def execute_create_memory_node(npc_name: str, memory_id: str, memory: str, event_id: str | None = None):
+    query = """
+    MATCH (npc:NPC {name: $npc_name})
+    MERGE (m:Memory {memory_id: $memory_id})
+    SET m.memory = $memory, m.embedding = $embedding,
+        m.embedding_hash = $embedding_hash, m.embedding_model = $embedding_model
+    MERGE (npc)-[:HAS_MEMORY]->(m)
+    WITH m
+    OPTIONAL MATCH (e:Event {event_id: $event_id})
+    FOREACH (_ IN CASE WHEN e IS NULL THEN [] ELSE [1] END | MERGE (m)-[:MEMORY_OF]->(e))
+    RETURN m
+    """
+    embedding = _try_embedding(memory)
+    parameters = {
+        "npc_name": npc_name,
+        "memory_id": memory_id,
+        "memory": memory,
+        "embedding": embedding,
+        "embedding_hash": text_hash(memory) if embedding else None,
+        "embedding_model": EMBEDDING_MODEL if embedding else None,
+        "event_id": event_id
+    }
+    result = ex_query(query, parameters)
+    notify_npc_changed(npc_name)
+    return result
+
+
+def execute_update_memory_embeddings(batch_size: int = 100) -> int:
+    """
+    Embed every Memory node whose embedding is missing or stale.
+
+    Returns the number of memories that were updated.
+    """
+    # Imported here: embedding_backfill itself imports this module
+    from embedding_backfill import backfill
+    return backfill("Memory", page_size=batch_size).embedded
@@ -0,0 +1,148 @@
+"""
+Incremental embedding backfill for CLAIM and Memory nodes.
+
+Next to each vector the node stores embedding_hash (a hash of the embedded
+text) and embedding_model. The job streams the nodes in one read, a page
+(fetch) at a time, and only embeds those whose vector is missing, was made
+from different text or by a different model. Texts are embedded in batches with
+a bounded number of requests in flight, and every page is written back with
+a single UNWIND.
+
+Progress lives in the graph itself, so an interrupted run simply continues
+where it stopped the next time: everything already done is skipped.
+
+    python embedding_backfill.py                 # CLAIM and Memory
+    python embedding_backfill.py --label CLAIM
+    python embedding_backfill.py --force         # re-embed everything
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from db_neo4j import DATABASE, ex_query, get_driver
+from embeddings import EMBED_BATCH_SIZE, EMBEDDING_MODEL, create_embeddings, text_hash
+from typing import Any, Dict, Iterator, List, Optional
+import argparse
+import os
+import time
+
+# Label -> property holding the text that is embedded
+TARGETS = {"CLAIM": "content", "Memory": "memory"}
+
+# Nodes read per page
+PAGE_SIZE = int(os.getenv("EMBED_PAGE_SIZE", "500"))
+# Embedding requests in flight at once
+WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+
+
+@dataclass
+class BackfillStats:
+    scanned: int = 0
+    stale: int = 0
+    embedded: int = 0
+    failed: int = 0
+    # Text changed between reading and writing; left for the next run
+    skipped: int = 0
+
+
+def _pages(label: str, text_field: str, page_size: int) -> Iterator[List[Any]]:
+    """
+    Every node of label, page_size at a time, from a single label scan.
+
+    Paging with separate queries would need an indexed key to seek to; there
+    is none shared by all nodes, so the scan is streamed instead and the
+    driver fetches page_size records at a time. Writes go through other
+    pooled connections while it is open.
+    """
+    with get_driver().session(database=DATABASE, fetch_size=page_size) as session:
+        result = session.run(f"""
+        MATCH (n:`{label}`)
+        WHERE n.`{text_field}` IS NOT NULL
+        RETURN elementId(n) AS id, n.`{text_field}` AS text,
+               n.embedding IS NULL AS missing, n.embedding_hash AS hash, n.embedding_model AS model
+        """)
+        page = []
+        for record in result:
+            page.append(record)
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+
+def is_stale(record: Any) -> bool:
+    return (
+        record["missing"]
+        or record["model"] != EMBEDDING_MODEL
+        or record["hash"] != text_hash(record["text"])
+    )
+
+
+def _embed_batch(batch: List[Any]) -> Optional[List[List[float]]]:
+    try:
+        return create_embeddings([r["text"] for r in batch])
+    except Exception as e:
+        print(f"Embedding batch of {len(batch)} failed: {e}")
+        return None
+
+
+def _write(label: str, text_field: str, rows: List[Dict[str, Any]]) -> int:
+    # Only written if the text is still the one that was embedded
+    records, _, _ = ex_query(f"""
+    UNWIND $rows AS row
+    MATCH (n:`{label}`)
+    WHERE elementId(n) = row.id AND n.`{text_field}` = row.text
+    SET n.embedding = row.embedding, n.embedding_hash = row.hash, n.embedding_model = $model
+    RETURN count(n) AS written
+    """, {"rows": rows, "model": EMBEDDING_MODEL})
+    return records[0]["written"] if records else 0
+
+
+def backfill(label: str = "CLAIM", force: bool = False, page_size: int = PAGE_SIZE,
+             workers: int = WORKERS) -> BackfillStats:
+    """Embed every node of label whose embedding is missing or stale."""
+    text_field = TARGETS[label]
+    stats = BackfillStats()
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for records in _pages(label, text_field, page_size):
+            stats.scanned += len(records)
+
+            stale = [r for r in records if force or is_stale(r)]
+            stats.stale += len(stale)
+            batches = [stale[i:i + EMBED_BATCH_SIZE] for i in range(0, len(stale), EMBED_BATCH_SIZE)]
+
+            rows = []
+            for batch, vectors in zip(batches, pool.map(_embed_batch, batches)):
+                if vectors is None:
+                    stats.failed += len(batch)
+                    continue
+                rows += [
+                    {"id": r["id"], "text": r["text"], "hash": text_hash(r["text"]), "embedding": vector}
+                    for r, vector in zip(batch, vectors)
+                ]
+
+            if rows:
+                written = _write(label, text_field, rows)
+                stats.embedded += written
+                stats.skipped += len(rows) - written
+            print(f"{label}: {stats.scanned} scanned, {stats.embedded} embedded, {stats.failed} failed")
+
+    elapsed = time.perf_counter() - start
+    print(f"✓ {label}: {stats.embedded}/{stats.stale} stale embeddings updated in {elapsed:.1f}s")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed CLAIM and Memory nodes whose embedding is missing or stale.")
+    parser.add_argument("--label", choices=sorted(TARGETS), help="only this label (default: all)")
+    parser.add_argument("--force", action="store_true", help="re-embed every node")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="embedding requests in flight")
+    args = parser.parse_args()
+
+    for label in [args.label] if args.label else sorted(TARGETS):
+        backfill(label, force=args.force, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from langchain_community.embeddings import OllamaEmbeddings
+from cache import SQLiteCache
+from dotenv import load_dotenv
+from typing import Callable, Optional
+import array
+import hashlib
+import httpx
+import os
+
+load_dotenv()
+
+# Same model and prefix convention as the legacy tools, so Memory and CLAIM
+# vectors live in the same space
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "mxbai-embed-large")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+# Texts per request to Ollama's batch endpoint
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+
+# Persistent cache of vectors keyed by (model, prefix, text). Shared by the
+# API and the legacy tools; set EMBEDDING_CACHE_PATH to "" to turn it off.
+CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_cache.sqlite3")
+)
+CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+
+# mxbai-embed-large wants this prefix on search queries, but not on documents
+QUERY_PREFIX = "Represent this sentence for searching relevant passages: "
+
+embed_model = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+
+# Keep-alive connections for the batch endpoint
+_http = httpx.Client(base_url=OLLAMA_BASE_URL, timeout=EMBED_TIMEOUT)
+
+_cache: Optional[SQLiteCache] = (
+    SQLiteCache(CACHE_PATH, table="embeddings", max_entries=CACHE_MAX_ENTRIES) if CACHE_PATH else None
+)
+
+
+def _cache_key(prefix: str, text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{prefix}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _pack(vector: list[float]) -> bytes:
+    # float32 is plenty for cosine similarity and half the size of float64
+    return array.array("f", vector).tobytes()
+
+
+def _unpack(data: bytes) -> list[float]:
+    vector = array.array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+def _cached(prefix: str, text: str, embed: Callable[[str], list[float]]) -> list[float]:
+    if _cache is None:
+        return embed(prefix + text)
+    key = _cache_key(prefix, text)
+    data = _cache.get(key)
+    if data is not None:
+        return _unpack(data)
+    vector = embed(prefix + text)
+    _cache.set(key, _pack(vector))
+    return vector
+
+
+def create_embedding(text: str) -> list[float]:
+    """Embed a document (memory or claim content)."""
+    return _cached("", text, embed_model.embed_query)
+
+
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH_SIZE):
+        response = _http.post("/api/embed", json={"model": EMBEDDING_MODEL, "input": texts[i:i + EMBED_BATCH_SIZE]})
+        response.raise_for_status()
+        vectors.extend(response.json()["embeddings"])
+    return vectors
+
+
+def create_embeddings(texts: list[str]) -> list[list[float]]:
+    """
+    Embed several documents, EMBED_BATCH_SIZE texts per request.
+
+    Cached texts are not sent. Uses Ollama's /api/embed, which returns
+    unit-length vectors; cosine similarity is the same as for create_embedding().
+    """
+    if _cache is None:
+        return _embed_batch(texts)
+
+    keys = [_cache_key("", text) for text in texts]
+    vectors: list[Optional[list[float]]] = []
+    for key in keys:
+        data = _cache.get(key)
+        vectors.append(_unpack(data) if data is not None else None)
+
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+    if unique_texts:
+        embedded = dict(zip(unique_texts, _embed_batch(unique_texts)))
+        for i in missing:
+            vectors[i] = embedded[texts[i]]
+        for text, vector in embedded.items():
+            _cache.set(_cache_key("", text), _pack(vector))
+    return vectors
+
+
+def text_hash(text: str) -> str:
+    """Hash stored next to an embedding, to tell when the text has changed since."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def create_query_embedding(text: str) -> list[float]:
+    """Embed a search query, e.g. the player's message."""
+    return _cached(QUERY_PREFIX, text, embed_model.embed_query)
+
+
+def cache_stats() -> Optional[dict]:
+    """Counters of the embedding cache, or None if it is off."""
+    return _cache.stats() if _cache is not None else None
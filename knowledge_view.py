@@ -0,0 +1,58 @@
+"""
+Materialized view of what each NPC effectively knows.
+
+An NPC knows a claim through its own BELIEF/STANCE edges or inherits it from a
+GROUP it is a member of. Instead of recomputing that union on every retrieval,
+the result is stored as
+
+    (:NPC)-[:KNOWS {belief, stance, source}]->(:CLAIM)
+
+where source is "direct" or the name of the group it was inherited from. The
+NPC's own edges win over inherited ones; between groups the first by name
+wins, and belief and stance always come from the same source. Readers then
+need a single lookup on the (unique, indexed) NPC name.
+
+This module only holds the Cypher, so that both the API side (db_neo4j) and
+the interactive tools in "Julius old" (their own driver) can run it.
+Writers that change BELIEF, STANCE or MEMBER_OF refresh the affected rows
+with REFRESH_QUERY; REBUILD_QUERY recomputes the whole view. Deleting an NPC
+or a claim needs nothing extra, DETACH DELETE removes its KNOWS edges.
+"""
+
+
+def _refresh_query(npc_filter: str, claim_filter: str) -> str:
+    return f"""
+    MATCH (n:NPC) WHERE {npc_filter}
+    CALL {{
+        WITH n
+        MATCH (n)-[k:KNOWS]->(c:CLAIM) WHERE {claim_filter}
+        DELETE k
+    }}
+    CALL {{
+        WITH n
+        MATCH (n)-[b:BELIEF]->(c:CLAIM) WHERE {claim_filter}
+        OPTIONAL MATCH (n)-[s:STANCE]->(c)
+        RETURN c, b.intensity AS belief, s.intensity AS stance, 'direct' AS source, 0 AS rank
+        UNION
+        WITH n
+        MATCH (n)-[:MEMBER_OF]->(g:GROUP)-[b:BELIEF]->(c:CLAIM) WHERE {claim_filter}
+        OPTIONAL MATCH (g)-[s:STANCE]->(c)
+        RETURN c, b.intensity AS belief, s.intensity AS stance, g.name AS source, 1 AS rank
+    }}
+    WITH n, c, belief, stance, source, rank
+    ORDER BY rank, source
+    WITH n, c, collect({{belief: belief, stance: stance, source: source}})[0] AS best
+    CREATE (n)-[:KNOWS {{belief: best.belief, stance: best.stance, source: best.source}}]->(c)
+    RETURN count(*) AS known
+    """
+
+
+# Recompute the rows of the NPCs in $names, for the claim $claim_id or (null) all claims
+REFRESH_QUERY = _refresh_query("n.name IN $names", "$claim_id IS NULL OR id(c) = $claim_id")
+
+# Recompute the rows of each NPC in $claims (a map from NPC name to claim
+# keys) for the claims listed for it; used by world_sync, whose claims have keys
+REFRESH_BY_KEY_QUERY = _refresh_query("n.name IN keys($claims)", "c.key IN $claims[n.name]")
+
+# Recompute the whole view
+REBUILD_QUERY = _refresh_query("true", "true")
@@ -0,0 +1,102 @@
+"""
+LLM backend selected by configuration.
+
+Everything that talks to an LLM imports chat, chat_async, chat_stream and
+chat_stream_async from here instead of from a provider module. LLM_BACKEND
+picks the implementation:
+
+    groq    llms.groq, the hosted Groq API (default)
+    openai  llms.openai_compatible, any OpenAI-compatible server at LLM_BASE_URL
+    local   the same, pointed at llms.local_server (python -m llms.local_server)
+
+A backend is a module providing the functions of LLMBackend below. More can
+be added with register_backend(). The module is imported on first use, so the
+Groq SDK is not needed when running against the local server.
+"""
+from dotenv import load_dotenv
+from typing import AsyncIterator, Dict, Iterator, Optional, Protocol
+import importlib
+import os
+import threading
+
+load_dotenv()
+
+BACKEND = os.getenv("LLM_BACKEND", "groq")
+
+_backends: Dict[str, str] = {
+    "groq": "llms.groq",
+    "openai": "llms.openai_compatible",
+    "local": "llms.openai_compatible",
+}
+
+_module = None
+_module_lock = threading.Lock()
+
+
+class LLMBackend(Protocol):
+    DEFAULT_MODEL: str
+
+    def chat(self, message: str, model: str = ..., temperature: float = ..., max_tokens: int = ...,
+             timeout: Optional[float] = ..., cache_site: Optional[str] = ...) -> str: ...
+
+    async def chat_async(self, message: str, model: str = ..., temperature: float = ..., max_tokens: int = ...,
+                         timeout: Optional[float] = ..., cache_site: Optional[str] = ...) -> str: ...
+
+    def chat_stream(self, message: str, model: str = ..., temperature: float = ..., max_tokens: int = ...,
+                    timeout: Optional[float] = ...) -> Iterator[str]: ...
+
+    def chat_stream_async(self, message: str, model: str = ..., temperature: float = ..., max_tokens: int = ...,
+                          timeout: Optional[float] = ...) -> AsyncIterator[str]: ...
+
+    def close_client(self): ...
+
+    async def close_async_client(self): ...
+
+
+def register_backend(name: str, module: str):
+    """Make the backend implemented by module (a dotted path) selectable as name."""
+    _backends[name] = module
+
+
+def get_backend() -> LLMBackend:
+    """The configured backend module, imported on first use."""
+    global _module
+    if _module is None:
+        with _module_lock:
+            if _module is None:
+                if BACKEND not in _backends:
+                    raise ValueError(f"Unknown LLM_BACKEND '{BACKEND}', expected one of: {', '.join(sorted(_backends))}")
+                _module = importlib.import_module(_backends[BACKEND])
+    return _module
+
+
+def chat(message: str, **kwargs) -> str:
+    """Send a message and return the response; see llms.groq.chat() for the arguments."""
+    return get_backend().chat(message, **kwargs)
+
+
+async def chat_async(message: str, **kwargs) -> str:
+    """Async version of chat()."""
+    return await get_backend().chat_async(message, **kwargs)
+
+
+def chat_stream(message: str, **kwargs) -> Iterator[str]:
+    """Like chat(), but yields the response piece by piece as it is generated."""
+    return get_backend().chat_stream(message, **kwargs)
+
+
+def chat_stream_async(message: str, **kwargs) -> AsyncIterator[str]:
+    """Async version of chat_stream()."""
+    return get_backend().chat_stream_async(message, **kwargs)
+
+
+def close_client():
+    """Close the backend's sync client, if one was created."""
+    if _module is not None:
+        _module.close_client()
+
+
+async def close_async_client():
+    """Close the backend's async client, if one was created."""
+    if _module is not None:
+        await _module.close_async_client()
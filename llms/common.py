@@ -0,0 +1,213 @@
+"""
+Retry and concurrency policy shared by the LLM backends.
+
+Every backend bounds the requests it has in flight with the same Slots and
+retries failed requests with the same backoff: full-jitter exponential,
+never shorter than the provider's Retry-After (or x-ratelimit-reset-* on a
+429), and given up when the provider asks for longer than BACKOFF_MAX.
+
+The settings are read from LLM_*, falling back to the older GROQ_* names.
+"""
+from collections import deque
+from dotenv import load_dotenv
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Optional, Tuple, Type, TypeVar
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+
+load_dotenv()
+
+
+def _setting(name: str, default: str) -> str:
+    return os.getenv(f"LLM_{name}", os.getenv(f"GROQ_{name}", default))
+
+
+# At most this many requests in flight; the rest wait for a slot
+MAX_CONCURRENCY = int(_setting("MAX_CONCURRENCY", "8"))
+
+# Jittered exponential backoff between retries
+MAX_RETRIES = int(_setting("MAX_RETRIES", "4"))
+BACKOFF_BASE = float(_setting("BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(_setting("BACKOFF_MAX", "30"))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class Slots:
+    """
+    A counting semaphore shared by threads and event loops.
+
+    Sync calls use it as a context manager, async calls as an async context
+    manager; both draw from the same count. Async waiters are woken through
+    their loop and never block it.
+    """
+
+    def __init__(self, size: int):
+        self._free = size
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._async_waiters: Deque[asyncio.Future] = deque()
+
+    def acquire(self):
+        with self._released:
+            while self._free == 0:
+                self._released.wait()
+            self._free -= 1
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._free > 0:
+                    self._free -= 1
+                    return
+                waiter = loop.create_future()
+                self._async_waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def release(self):
+        with self._released:
+            self._free += 1
+            self._released.notify()
+            # Waiters retry the acquire on their own loop; whoever loses waits again
+            waiters, self._async_waiters = list(self._async_waiters), deque()
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+# One budget for sync and async calls together. Retries keep their slot, so
+# while the provider is rate limiting us new calls queue here instead of
+# adding to the load.
+slots = Slots(MAX_CONCURRENCY)
+
+
+def _status(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """Parse reset durations such as '7.66s', '2m59.56s' or '150ms'."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it said so."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    if _status(error) == 429:
+        resets = [
+            parse_duration(headers[name])
+            for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+            if name in headers
+        ]
+        resets = [r for r in resets if r is not None]
+        if resets:
+            return max(resets)
+    return None
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    How long to wait before retrying after error, or None to give up.
+
+    Uses full-jitter exponential backoff, but never less than the provider's
+    Retry-After. Gives up when the provider asks for more than BACKOFF_MAX.
+    """
+    if attempt >= MAX_RETRIES:
+        return None
+    status = _status(error)
+    if status is not None and status not in RETRYABLE_STATUS:
+        return None
+
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    wait = retry_after(error)
+    if wait is not None:
+        if wait > BACKOFF_MAX:
+            return None
+        delay = wait + random.uniform(0, BACKOFF_BASE)
+    return delay
+
+
+def with_retries(call: Callable[[], T], errors: Tuple[Type[Exception], ...]) -> T:
+    """call(), retried on errors as retry_delay() allows."""
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except errors as e:
+            delay = retry_delay(e, attempt)
+            if delay is None:
+                raise
+            print(f"LLM call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+        attempt += 1
+
+
+async def with_retries_async(call: Callable[[], Awaitable[T]], errors: Tuple[Type[Exception], ...]) -> T:
+    """Async version of with_retries()."""
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except errors as e:
+            delay = retry_delay(e, attempt)
+            if delay is None:
+                raise
+            print(f"LLM call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+        attempt += 1
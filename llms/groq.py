@@ -1,35 +1,215 @@
-from groq import Groq
+from groq import APIConnectionError, APIStatusError, AsyncGroq, Groq
 from dotenv import load_dotenv
+from llms import response_cache
+from llms.common import slots, with_retries, with_retries_async
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+import httpx
 import os
+import threading
 
 load_dotenv()
 
-# Initialize Groq client
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
 
-def chat(message: str, model: str = "llama-3.3-70b-versatile") -> str:
+# HTTP connection pool shared by all calls
+MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GROQ_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+
+# Per-call timeouts in seconds
+TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+
+# Errors retried as llms.common.retry_delay() allows; concurrency and
+# backoff are configured there
+RETRIED = (APIConnectionError, APIStatusError)
+
+_client: Optional[Groq] = None
+_async_client: Optional[AsyncGroq] = None
+_client_lock = threading.Lock()
+
+
+def _timeout(seconds: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(seconds or TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client() -> Groq:
+    """Return the shared Groq client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Groq(
+                api_key=os.getenv("GROQ_API_KEY"),
+                max_retries=0,  # retried by llms.common.with_retries
+                timeout=_timeout(),
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+            )
+    return _client
+
+
+def get_async_client() -> AsyncGroq:
+    """Return the shared AsyncGroq client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncGroq(
+            api_key=os.getenv("GROQ_API_KEY"),
+            max_retries=0,
+            timeout=_timeout(),
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+        )
+    return _async_client
+
+
+def close_client():
+    """Close the shared sync client and its pooled connections."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def close_async_client():
+    """Close the shared async client and its pooled connections."""
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.close()
+
+
+def _request(message: str, model: str, temperature: float, max_tokens: int,
+             timeout: Optional[float], stream: bool = False) -> Dict[str, Any]:
+    return dict(
+        model=model,
+        messages=[
+            {"role": "user", "content": message}
+        ],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        timeout=_timeout(timeout),
+        stream=stream,
+    )
+
+
+def _cache_key(request: Dict[str, Any], cache_site: Optional[str]) -> Optional[str]:
+    if not response_cache.is_enabled(cache_site):
+        return None
+    return response_cache.cache_key(request["model"], request["messages"],
+                                    request["temperature"], request["max_tokens"])
+
+
+def chat(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+         max_tokens: int = 1024, timeout: Optional[float] = None,
+         cache_site: Optional[str] = None) -> str:
     """
     Send a message to the AI and get a response.
-    
+
     Args:
         message: The message to send to the AI
         model: The model to use (default: llama-3.3-70b-versatile)
                Other options: mixtral-8x7b-32768, gemma2-9b-it
-    
+        temperature: Sampling temperature
+        max_tokens: Maximum length of the response
+        timeout: Seconds to wait for the response (default: GROQ_TIMEOUT)
+        cache_site: Name of the call site; identical requests from a site
+                    with caching enabled are answered from the response cache
+
     Returns:
         The AI's response as a string
     """
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "user", "content": message}
-        ],
-        temperature=0.7,
-        max_tokens=1024,
-    )
-    return completion.choices[0].message.content or ""
+    request = _request(message, model, temperature, max_tokens, timeout)
+    key = _cache_key(request, cache_site)
+    if key is not None:
+        cached = response_cache.get(cache_site, key)
+        if cached is not None:
+            return cached
+
+    with slots:
+        completion = with_retries(lambda: get_client().chat.completions.create(**request), RETRIED)
+    response = completion.choices[0].message.content or ""
+
+    if key is not None:
+        response_cache.put(key, response)
+    return response
+
+
+async def chat_async(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                     max_tokens: int = 1024, timeout: Optional[float] = None,
+                     cache_site: Optional[str] = None) -> str:
+    """
+    Async version of chat() for use inside the API's event loop.
+
+    Args:
+        message: The message to send to the AI
+        model: The model to use (default: llama-3.3-70b-versatile)
+        temperature: Sampling temperature
+        max_tokens: Maximum length of the response
+        timeout: Seconds to wait for the response (default: GROQ_TIMEOUT)
+        cache_site: Name of the call site, see chat()
+
+    Returns:
+        The AI's response as a string
+    """
+    request = _request(message, model, temperature, max_tokens, timeout)
+    key = _cache_key(request, cache_site)
+    if key is not None:
+        cached = response_cache.get(cache_site, key)
+        if cached is not None:
+            return cached
+
+    async with slots:
+        completion = await with_retries_async(lambda: get_async_client().chat.completions.create(**request), RETRIED)
+    response = completion.choices[0].message.content or ""
+
+    if key is not None:
+        response_cache.put(key, response)
+    return response
+
+
+def chat_stream(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                max_tokens: int = 1024, timeout: Optional[float] = None) -> Iterator[str]:
+    """
+    Like chat(), but yields the response piece by piece as it is generated.
+
+    Only the initial request is retried; the slot is held until the stream ends.
+    """
+    request = _request(message, model, temperature, max_tokens, timeout, stream=True)
+    with slots:
+        stream = with_retries(lambda: get_client().chat.completions.create(**request), RETRIED)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+
+async def chat_stream_async(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                            max_tokens: int = 1024, timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Async version of chat_stream().
+    """
+    request = _request(message, model, temperature, max_tokens, timeout, stream=True)
+    async with slots:
+        stream = await with_retries_async(lambda: get_async_client().chat.completions.create(**request), RETRIED)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
 
 
 if __name__ == "__main__":
     response = chat("What's 2+2?")
-    print(response)
\ No newline at end of file
+    print(response)
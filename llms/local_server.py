@@ -0,0 +1,174 @@
+"""
+Local stand-in for an OpenAI-compatible LLM server.
+
+Answers POST /v1/chat/completions (streaming or not) with scripted or
+deterministic replies after a configurable delay, so the API can be run and
+load-tested without a provider and our own overhead can be measured apart
+from theirs:
+
+    python -m llms.local_server --port 8001
+    LLM_BACKEND=local uvicorn api:app
+
+Replies are chosen in order from:
+  1. LOCAL_LLM_SCRIPT, a JSON file of [{"match": "<regex>", "reply": "..."}]
+     tried against the last user message,
+  2. built-in replies for the prompts this project sends (question
+     classification, Cypher generation, memory extraction, summaries),
+  3. a reply made up from a hash of the prompt, so the same prompt always
+     gets the same answer.
+
+Timing: LOCAL_LLM_LATENCY seconds before the first token, then
+LOCAL_LLM_TOKENS_PER_SECOND tokens per second (0 for no delay).
+"""
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+
+LATENCY = float(os.getenv("LOCAL_LLM_LATENCY", "0.2"))
+TOKENS_PER_SECOND = float(os.getenv("LOCAL_LLM_TOKENS_PER_SECOND", "50"))
+REPLY_WORDS = int(os.getenv("LOCAL_LLM_REPLY_WORDS", "40"))
+SCRIPT_PATH = os.getenv("LOCAL_LLM_SCRIPT")
+
+BUILT_IN_REPLIES: List[Tuple[str, str]] = [
+    (r"Classify this question/statement", '{"type": "GENERAL", "reason": "Local stand-in"}'),
+    (r"Generate a Cypher query", "MATCH (npc:NPC) RETURN npc.name AS name, npc.role AS role LIMIT 5"),
+    (r"Return a JSON array of at most", "[]"),
+    (r"running summary of a conversation", "The player and I talked for a while; nothing of note was settled."),
+]
+
+SENTENCES = [
+    "I remember that evening well.",
+    "You ask a great many questions.",
+    "The great hall was colder than usual.",
+    "Perhaps you should speak to my uncle about that.",
+    "I would rather not say.",
+    "There was a letter, but I never read it.",
+    "Everyone was at dinner, or so they claim.",
+    "Why does it matter to you?",
+    "I heard footsteps in the corridor after midnight.",
+    "That is not how I remember it.",
+]
+
+
+def _load_script() -> List[Tuple[str, str]]:
+    if not SCRIPT_PATH:
+        return []
+    with open(SCRIPT_PATH, encoding="utf-8") as f:
+        return [(entry["match"], entry["reply"]) for entry in json.load(f)]
+
+
+SCRIPT = _load_script()
+
+
+def reply_for(prompt: str, max_tokens: int) -> str:
+    """The reply to prompt: scripted, built in, or derived from its hash."""
+    for pattern, reply in SCRIPT + BUILT_IN_REPLIES:
+        if re.search(pattern, prompt):
+            return reply
+    rng = random.Random(hashlib.sha256(prompt.encode()).digest())
+    words: List[str] = []
+    while len(words) < min(REPLY_WORDS, max_tokens):
+        words += rng.choice(SENTENCES).split()
+    return " ".join(words[:min(REPLY_WORDS, max_tokens)])
+
+
+def tokens_of(text: str) -> List[str]:
+    return re.findall(r"\S+\s*", text)
+
+
+def _token_delay() -> float:
+    return 1 / TOKENS_PER_SECOND if TOKENS_PER_SECOND > 0 else 0.0
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class CompletionRequest(BaseModel):
+    model: str = "local-npc"
+    messages: List[Message]
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = 1024
+    stream: bool = False
+
+
+app = FastAPI(title="Local LLM stand-in", description="OpenAI-compatible server with deterministic replies")
+
+
+def _usage(prompt: str, tokens: List[str]) -> Dict[str, int]:
+    prompt_tokens = len(prompt) // 4 + 1
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens)}
+
+
+async def _stream(request: CompletionRequest, tokens: List[str]) -> AsyncIterator[str]:
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    await asyncio.sleep(LATENCY)
+    for token in tokens:
+        chunk = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": request.model,
+            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(_token_delay())
+    done = {
+        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": request.model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {json.dumps(done)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: CompletionRequest) -> Any:
+    prompt = next((m.content for m in reversed(request.messages) if m.role == "user"), "")
+    tokens = tokens_of(reply_for(prompt, request.max_tokens or 1024))
+
+    if request.stream:
+        return StreamingResponse(_stream(request, tokens), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY + len(tokens) * _token_delay())
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                     "finish_reason": "stop"}],
+        "usage": _usage(prompt, tokens),
+    }
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "local-npc", "object": "model", "owned_by": "local"}]}
+
+
+def main():
+    global LATENCY, TOKENS_PER_SECOND
+    parser = argparse.ArgumentParser(description="Run the local OpenAI-compatible LLM stand-in.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("LOCAL_LLM_PORT", "8001")))
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND, help="0 for no delay")
+    args = parser.parse_args()
+    LATENCY, TOKENS_PER_SECOND = args.latency, args.tokens_per_second
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
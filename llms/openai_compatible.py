@@ -0,0 +1,185 @@
+"""
+LLM backend for any server speaking the OpenAI chat completions API.
+
+Used for LLM_BACKEND=openai and LLM_BACKEND=local (llms.local_server by
+default). Same interface as llms.groq: pooled HTTP clients, bounded
+concurrency, retries on connection errors and retryable statuses, and the
+per-call-site response cache, with the concurrency limit and backoff
+from llms.common.
+"""
+from dotenv import load_dotenv
+from llms import response_cache
+from llms.common import slots, with_retries, with_retries_async
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+import httpx
+import json
+import os
+import threading
+
+load_dotenv()
+
+BASE_URL = os.getenv("LLM_BASE_URL", "http://127.0.0.1:8001/v1").rstrip("/")
+API_KEY = os.getenv("LLM_API_KEY", "")
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "local-npc")
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+
+# Errors retried as llms.common.retry_delay() allows
+RETRIED = (httpx.TransportError, httpx.HTTPStatusError)
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_client_lock = threading.Lock()
+
+
+def _timeout(seconds: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(seconds or TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {API_KEY}"} if API_KEY else {}
+
+
+def get_client() -> httpx.Client:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(base_url=BASE_URL, headers=_headers(), timeout=_timeout(),
+                                   limits=httpx.Limits(max_connections=MAX_CONNECTIONS))
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(base_url=BASE_URL, headers=_headers(), timeout=_timeout(),
+                                          limits=httpx.Limits(max_connections=MAX_CONNECTIONS))
+    return _async_client
+
+
+def close_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.aclose()
+
+
+def _body(message: str, model: str, temperature: float, max_tokens: int, stream: bool = False) -> Dict[str, Any]:
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": message}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": stream,
+    }
+
+
+def _post(body: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+    def call():
+        response = get_client().post("/chat/completions", json=body, timeout=_timeout(timeout))
+        response.raise_for_status()
+        return response.json()
+    return with_retries(call, RETRIED)
+
+
+async def _post_async(body: Dict[str, Any], timeout: Optional[float]) -> Dict[str, Any]:
+    async def call():
+        response = await get_async_client().post("/chat/completions", json=body, timeout=_timeout(timeout))
+        response.raise_for_status()
+        return response.json()
+    return await with_retries_async(call, RETRIED)
+
+
+def _cache_key(body: Dict[str, Any], cache_site: Optional[str]) -> Optional[str]:
+    if not response_cache.is_enabled(cache_site):
+        return None
+    return response_cache.cache_key(body["model"], body["messages"], body["temperature"], body["max_tokens"])
+
+
+def _delta(line: str) -> Optional[str]:
+    """The text in one Server-Sent Events line of a streamed completion."""
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if not data or data == "[DONE]":
+        return None
+    chunk = json.loads(data)
+    choices = chunk.get("choices") or []
+    return choices[0].get("delta", {}).get("content") if choices else None
+
+
+def chat(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+         max_tokens: int = 1024, timeout: Optional[float] = None,
+         cache_site: Optional[str] = None) -> str:
+    """Send a message and return the response; arguments as in llms.groq.chat()."""
+    body = _body(message, model, temperature, max_tokens)
+    key = _cache_key(body, cache_site)
+    if key is not None:
+        cached = response_cache.get(cache_site, key)
+        if cached is not None:
+            return cached
+
+    with slots:
+        completion = _post(body, timeout)
+    response = completion["choices"][0]["message"].get("content") or ""
+
+    if key is not None:
+        response_cache.put(key, response)
+    return response
+
+
+async def chat_async(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                     max_tokens: int = 1024, timeout: Optional[float] = None,
+                     cache_site: Optional[str] = None) -> str:
+    """Async version of chat()."""
+    body = _body(message, model, temperature, max_tokens)
+    key = _cache_key(body, cache_site)
+    if key is not None:
+        cached = response_cache.get(cache_site, key)
+        if cached is not None:
+            return cached
+
+    async with slots:
+        completion = await _post_async(body, timeout)
+    response = completion["choices"][0]["message"].get("content") or ""
+
+    if key is not None:
+        response_cache.put(key, response)
+    return response
+
+
+def chat_stream(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                max_tokens: int = 1024, timeout: Optional[float] = None) -> Iterator[str]:
+    """Like chat(), but yields the response piece by piece. Not retried."""
+    body = _body(message, model, temperature, max_tokens, stream=True)
+    with slots:
+        with get_client().stream("POST", "/chat/completions", json=body, timeout=_timeout(timeout)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                delta = _delta(line)
+                if delta:
+                    yield delta
+
+
+async def chat_stream_async(message: str, model: str = DEFAULT_MODEL, temperature: float = 0.7,
+                            max_tokens: int = 1024, timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """Async version of chat_stream()."""
+    body = _body(message, model, temperature, max_tokens, stream=True)
+    async with slots:
+        async with get_async_client().stream("POST", "/chat/completions", json=body,
+                                             timeout=_timeout(timeout)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                delta = _delta(line)
+                if delta:
+                    yield delta
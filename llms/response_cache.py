@@ -0,0 +1,96 @@
+"""
+Opt-in, persistent exact-match cache of LLM responses.
+
+A response is cached under a hash of (model, messages, temperature,
+max_tokens), so only byte-identical requests hit. Each caller passes a call
+site name (e.g. "classify"), and caching can be switched on or off per site.
+
+Enabled by setting LLM_CACHE_PATH to a SQLite file.
+"""
+from cache import SQLiteCache
+from collections import defaultdict
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import os
+import threading
+
+load_dotenv()
+
+CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+# Call sites that use the cache when it is enabled
+_enabled_sites = {
+    site.strip()
+    for site in os.getenv("LLM_CACHE_SITES", "classify,rag_answer").split(",")
+    if site.strip()
+}
+
+_store: Optional[SQLiteCache] = None
+_store_lock = threading.Lock()
+_site_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+
+def _get_store() -> Optional[SQLiteCache]:
+    global _store
+    if CACHE_PATH is None:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteCache(CACHE_PATH, table="llm_responses", max_entries=MAX_ENTRIES)
+    return _store
+
+
+def enable_site(site: str):
+    _enabled_sites.add(site)
+
+
+def disable_site(site: str):
+    _enabled_sites.discard(site)
+
+
+def is_enabled(site: Optional[str]) -> bool:
+    """True if responses for this call site should be cached."""
+    return CACHE_PATH is not None and site is not None and site in _enabled_sites
+
+
+def cache_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(site: str, key: str) -> Optional[str]:
+    """Return the cached response for key, counting the lookup against site."""
+    store = _get_store()
+    if store is None:
+        return None
+    value = store.get(key)
+    _site_stats[site]["hits" if value is not None else "misses"] += 1
+    return value.decode("utf-8") if value is not None else None
+
+
+def put(key: str, response: str):
+    store = _get_store()
+    if store is not None and response:
+        store.set(key, response.encode("utf-8"))
+
+
+def stats() -> Dict[str, Any]:
+    """Hit rates per call site plus the counters of the underlying store."""
+    sites = {}
+    for site, counts in _site_stats.items():
+        lookups = counts["hits"] + counts["misses"]
+        sites[site] = dict(counts, hit_rate=counts["hits"] / lookups if lookups else 0.0)
+    store = _get_store()
+    return {
+        "enabled": CACHE_PATH is not None,
+        "enabled_sites": sorted(_enabled_sites),
+        "sites": sites,
+        "store": store.stats() if store is not None else None,
+    }
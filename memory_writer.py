@@ -0,0 +1,465 @@
+"""
+Background write-back of memories from conversations.
+
+When MEMORY_WRITEBACK=1, every finished chat turn is handed to submit(),
+which only journals it and puts it on a bounded queue. A worker thread takes
+turns off the queue in batches, asks the LLM what the NPC would remember
+from each one, embeds those memories in one request and writes the whole
+batch in a single UNWIND transaction: a Memory per remembered fact, linked
+to the NPC and to an Event for the conversation. None of this happens on the
+request path.
+
+Delivery is at least once. A turn is journaled in SQLite
+(MEMORY_JOURNAL_PATH) before it is queued and stays there until its
+memories are written. Several processes (e.g. uvicorn workers) can share
+the journal: each row is leased by the process working on it, which renews
+the lease while it runs, and a process takes over pending rows whose lease
+ran out (on start and then periodically), so no turn is worked on by two
+processes at once. Turns fail
+individually: a failed turn is retried with backoff and, after MAX_ATTEMPTS,
+marked failed in the journal (a dead letter) so it cannot block the rest.
+Memory ids are derived from the turn's unique id, so a turn that is
+processed twice overwrites its own memories instead of duplicating them.
+When the queue is full, new turns are dropped and counted.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from db_neo4j import ex_query, notify_npc_changed
+from dotenv import load_dotenv
+from embeddings import EMBEDDING_MODEL, create_embeddings, text_hash
+from llms.backend import chat
+from typing import Any, Dict, List, Optional, Tuple
+import datetime
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+load_dotenv()
+
+ENABLED = os.getenv("MEMORY_WRITEBACK", "0") == "1"
+
+# Turns waiting to be processed; more than this and new turns are dropped
+QUEUE_SIZE = int(os.getenv("MEMORY_QUEUE_SIZE", "1000"))
+# Turns processed per batch, and seconds to wait for a batch to fill
+BATCH_SIZE = int(os.getenv("MEMORY_BATCH_SIZE", "20"))
+FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "2"))
+# Extraction calls to the LLM in flight at once
+EXTRACT_WORKERS = int(os.getenv("MEMORY_EXTRACT_WORKERS", "4"))
+MAX_MEMORIES_PER_TURN = int(os.getenv("MEMORY_MAX_PER_TURN", "3"))
+# Backoff between retries of a failed turn, and attempts before it is given up on
+RETRY_BASE = float(os.getenv("MEMORY_RETRY_BASE", "1"))
+RETRY_MAX = float(os.getenv("MEMORY_RETRY_MAX", "60"))
+MAX_ATTEMPTS = int(os.getenv("MEMORY_MAX_ATTEMPTS", "5"))
+
+# Seconds a process holds the turns it works on without renewing its lease
+LEASE = float(os.getenv("MEMORY_JOURNAL_LEASE", "300"))
+
+# Turns survive restarts here until written; "" keeps them in memory only
+JOURNAL_PATH = os.getenv(
+    "MEMORY_JOURNAL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "memory_writeback.sqlite3")
+)
+
+EXTRACT_PROMPT = """You are deciding what {npc_name} will remember from a conversation with a player.
+
+User: {user_message}
+{npc_name}: {reply}
+
+List the facts worth remembering later: what the player said about themselves
+or others, claims they made, requests, promises, threats, and anything
+{npc_name} revealed or agreed to. Skip greetings and small talk. Write each
+memory in first person, from {npc_name}'s point of view, as one sentence.
+
+Return a JSON array of at most {max_memories} strings, or [] if nothing is worth remembering.
+"""
+
+WRITE_QUERY = """
+UNWIND $rows AS row
+MATCH (npc:NPC {name: row.npc_name})
+MERGE (e:Event {event_id: row.event_id})
+ON CREATE SET e.start_time = row.at, e.location = '', e.summary = 'Conversation with a player'
+SET e.stop_time = row.at
+MERGE (m:Memory {memory_id: row.memory_id})
+SET m.memory = row.memory, m.source = 'conversation', m.embedding = row.embedding,
+    m.embedding_hash = row.embedding_hash, m.embedding_model = row.embedding_model
+MERGE (npc)-[:HAS_MEMORY]->(m)
+MERGE (m)-[:MEMORY_OF]->(e)
+RETURN count(m) AS written
+"""
+
+_queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=QUEUE_SIZE)
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+_journal: Optional[sqlite3.Connection] = None
+_journal_lock = threading.Lock()
+# This process, as the owner of journal leases
+_owner = uuid.uuid4().hex
+
+_counters = {"submitted": 0, "dropped": 0, "turns_done": 0, "memories_written": 0,
+             "failed_attempts": 0, "dead_lettered": 0}
+# Request threads and the worker both update _counters
+_counters_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1):
+    with _counters_lock:
+        _counters[name] += n
+
+
+# -----------------------------------------------------------------------------
+# Journal
+# -----------------------------------------------------------------------------
+
+def _open_journal():
+    global _journal
+    if not JOURNAL_PATH or _journal is not None:
+        return
+    _journal = sqlite3.connect(JOURNAL_PATH, check_same_thread=False, isolation_level=None)
+    _journal.execute("PRAGMA journal_mode=WAL")
+    # state is 'pending' until written, or 'failed' after MAX_ATTEMPTS (kept for inspection).
+    # owner holds a pending row until lease_until (Unix time).
+    _journal.execute(
+        "CREATE TABLE IF NOT EXISTS turns (key TEXT PRIMARY KEY, turn TEXT NOT NULL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, state TEXT NOT NULL DEFAULT 'pending', error TEXT, "
+        "owner TEXT, lease_until REAL NOT NULL DEFAULT 0)"
+    )
+    columns = {row[1] for row in _journal.execute("PRAGMA table_info(turns)")}
+    if "owner" not in columns:
+        # Journals written before leases
+        _journal.execute("ALTER TABLE turns ADD COLUMN owner TEXT")
+        _journal.execute("ALTER TABLE turns ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+
+def _journal_add(turn: Dict[str, Any]):
+    if _journal is None:
+        return
+    with _journal_lock:
+        _journal.execute(
+            "INSERT OR IGNORE INTO turns (key, turn, owner, lease_until) VALUES (?, ?, ?, ?)",
+            (turn["key"], json.dumps(turn), _owner, time.time() + LEASE),
+        )
+
+
+def _journal_remove(turns: List[Dict[str, Any]]):
+    if _journal is None:
+        return
+    with _journal_lock:
+        _journal.executemany("DELETE FROM turns WHERE key = ?", [(t["key"],) for t in turns])
+
+
+def _journal_failure(turn: Dict[str, Any], error: Exception, dead: bool):
+    if _journal is None:
+        return
+    with _journal_lock:
+        _journal.execute(
+            "UPDATE turns SET attempts = ?, error = ?, state = ? WHERE key = ?",
+            (turn["attempts"], str(error)[:1000], "failed" if dead else "pending", turn["key"]),
+        )
+
+
+def _journal_claim(limit: int) -> List[Dict[str, Any]]:
+    """Lease up to limit pending turns whose lease ran out, and return them."""
+    if _journal is None or limit <= 0:
+        return []
+    now = time.time()
+    with _journal_lock:
+        # IMMEDIATE takes the write lock, so two processes cannot claim the same rows
+        _journal.execute("BEGIN IMMEDIATE")
+        try:
+            rows = _journal.execute(
+                "SELECT key, turn, attempts FROM turns WHERE state = 'pending' AND lease_until < ? "
+                "ORDER BY rowid LIMIT ?", (now, limit),
+            ).fetchall()
+            _journal.executemany(
+                "UPDATE turns SET owner = ?, lease_until = ? WHERE key = ?",
+                [(_owner, now + LEASE, key) for key, _, _ in rows],
+            )
+            _journal.execute("COMMIT")
+        except Exception:
+            _journal.execute("ROLLBACK")
+            raise
+    return [dict(json.loads(turn), attempts=attempts) for _, turn, attempts in rows]
+
+
+def _journal_release(turns: List[Dict[str, Any]]):
+    """Give up the lease on turns this process will not work on after all."""
+    if _journal is None:
+        return
+    with _journal_lock:
+        _journal.executemany("UPDATE turns SET lease_until = 0 WHERE key = ? AND owner = ?",
+                             [(t["key"], _owner) for t in turns])
+
+
+def _journal_renew(lease_until: float):
+    """Extend (or, with 0, give up) the lease on every pending turn this process holds."""
+    if _journal is None:
+        return
+    with _journal_lock:
+        _journal.execute(
+            "UPDATE turns SET lease_until = ? WHERE owner = ? AND state = 'pending'", (lease_until, _owner)
+        )
+
+
+def _journal_failed_count() -> int:
+    if _journal is None:
+        return 0
+    with _journal_lock:
+        return _journal.execute("SELECT count(*) FROM turns WHERE state = 'failed'").fetchone()[0]
+
+
+# -----------------------------------------------------------------------------
+# Queueing
+# -----------------------------------------------------------------------------
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+def submit(npc_name: str, session_id: str, turn_id: str, user_message: str, reply: str) -> bool:
+    """
+    Queue a finished turn for memory extraction. Never blocks on the queue,
+    but writes the journal, so call it off the event loop.
+
+    turn_id must be unique per turn (e.g. a uuid4): memory ids are derived
+    from it. Returns False if write-back is off or the queue is full (the
+    turn is dropped).
+    """
+    if not ENABLED:
+        return False
+    turn = {
+        "key": turn_id,
+        "npc_name": npc_name,
+        "session_id": session_id,
+        "user_message": user_message,
+        "reply": reply,
+        "at": _now(),
+        "attempts": 0,
+    }
+    # Journal first, so a crash after this point cannot lose the turn
+    _journal_add(turn)
+    try:
+        _queue.put_nowait(turn)
+    except queue.Full:
+        _journal_remove([turn])
+        _count("dropped")
+        return False
+    _count("submitted")
+    return True
+
+
+def _next_batch(retries: List[Tuple[float, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Turns whose retry is due, plus new turns from the queue (waiting up to
+    FLUSH_INTERVAL for the first one), at most BATCH_SIZE in total.
+    """
+    now = time.monotonic()
+    batch = [turn for due, turn in retries if due <= now][:BATCH_SIZE]
+    retries[:] = [(due, turn) for due, turn in retries if not any(turn is t for t in batch)]
+    if not batch:
+        wait = min([due for due, _ in retries] + [now + FLUSH_INTERVAL]) - now
+        try:
+            batch.append(_queue.get(timeout=max(0.0, wait)))
+        except queue.Empty:
+            return []
+    while len(batch) < BATCH_SIZE:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _parse_memories(response: str) -> List[str]:
+    if "```" in response:
+        response = response.split("```")[1].replace("json", "", 1).strip()
+    try:
+        memories = json.loads(response)
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(memories, list):
+        return []
+    return [m.strip() for m in memories if isinstance(m, str) and m.strip()][:MAX_MEMORIES_PER_TURN]
+
+
+def extract_memories(turn: Dict[str, Any]) -> List[str]:
+    """What the NPC would remember from one turn (one LLM call)."""
+    response = chat(EXTRACT_PROMPT.format(
+        npc_name=turn["npc_name"],
+        user_message=turn["user_message"],
+        reply=turn["reply"],
+        max_memories=MAX_MEMORIES_PER_TURN,
+    ), temperature=0.2, max_tokens=400)
+    return _parse_memories(response)
+
+
+def memory_id(turn: Dict[str, Any], index: int) -> str:
+    digest = hashlib.sha256(f"{turn['key']}\0{index}".encode()).hexdigest()[:24]
+    return f"conversation-{digest}"
+
+
+def _event_id(turn: Dict[str, Any]) -> str:
+    digest = hashlib.sha256(f"{turn['session_id']}\0{turn['npc_name']}".encode()).hexdigest()[:24]
+    return f"conversation-{digest}"
+
+
+def _rows(turn: Dict[str, Any], memories: List[str]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "npc_name": turn["npc_name"],
+            "event_id": _event_id(turn),
+            "at": turn["at"],
+            "memory_id": memory_id(turn, i),
+            "memory": memory,
+        }
+        for i, memory in enumerate(memories)
+    ]
+
+
+def _embed(rows: List[Dict[str, Any]]):
+    try:
+        vectors = create_embeddings([row["memory"] for row in rows]) if rows else []
+    except Exception as e:
+        # Written without vectors; embedding_backfill picks them up later
+        print(f"Embedding conversation memories failed, storing without them: {e}")
+        vectors = [None] * len(rows)
+    for row, vector in zip(rows, vectors):
+        row["embedding"] = vector
+        row["embedding_hash"] = text_hash(row["memory"]) if vector else None
+        row["embedding_model"] = EMBEDDING_MODEL if vector else None
+
+
+def _write(rows: List[Dict[str, Any]]) -> int:
+    if not rows:
+        return 0
+    records, _, _ = ex_query(WRITE_QUERY, {"rows": rows})
+    for npc_name in {row["npc_name"] for row in rows}:
+        notify_npc_changed(npc_name)
+    return records[0]["written"] if records else 0
+
+
+def _extract(turn: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[List[str]], Optional[Exception]]:
+    try:
+        return turn, extract_memories(turn), None
+    except Exception as e:
+        return turn, None, e
+
+
+def process_batch(turns: List[Dict[str, Any]], pool: ThreadPoolExecutor) -> List[Tuple[Dict[str, Any], Exception]]:
+    """
+    Extract, embed and write a batch of turns. Every turn succeeds or fails
+    on its own; returns the turns that failed, with their errors.
+    """
+    failed = []
+    extracted = []
+    for turn, memories, error in pool.map(_extract, turns):
+        if error is not None:
+            failed.append((turn, error))
+        else:
+            extracted.append((turn, _rows(turn, memories)))
+
+    _embed([row for _, rows in extracted for row in rows])
+    try:
+        # The whole batch in one transaction when possible...
+        _count("memories_written", _write([row for _, rows in extracted for row in rows]))
+        done = [turn for turn, _ in extracted]
+    except Exception:
+        # ...otherwise turn by turn, so one bad turn cannot hold back the others
+        done = []
+        for turn, rows in extracted:
+            try:
+                _count("memories_written", _write(rows))
+                done.append(turn)
+            except Exception as e:
+                failed.append((turn, e))
+
+    _journal_remove(done)
+    _count("turns_done", len(done))
+    return failed
+
+
+def _retry_or_give_up(turn: Dict[str, Any], error: Exception,
+                      retries: List[Tuple[float, Dict[str, Any]]]):
+    turn["attempts"] += 1
+    _count("failed_attempts")
+    dead = turn["attempts"] >= MAX_ATTEMPTS
+    _journal_failure(turn, error, dead)
+    if dead:
+        _count("dead_lettered")
+        print(f"Memory write-back gave up on a turn with {turn['npc_name']} "
+              f"after {turn['attempts']} attempts: {error}")
+        return
+    delay = min(RETRY_MAX, RETRY_BASE * 2 ** (turn["attempts"] - 1))
+    print(f"Memory write-back failed for a turn with {turn['npc_name']}, retrying in {delay:.0f}s: {error}")
+    retries.append((time.monotonic() + delay, turn))
+
+
+def _claim_expired():
+    """Queue pending turns whose owner stopped renewing its lease (e.g. a crashed worker)."""
+    turns = _journal_claim(QUEUE_SIZE - _queue.qsize())
+    for i, turn in enumerate(turns):
+        try:
+            _queue.put_nowait(turn)
+        except queue.Full:
+            # New turns filled the queue meanwhile; leave the rest for later
+            _journal_release(turns[i:])
+            break
+
+
+def _run():
+    # (due time, turn) for turns waiting to be retried
+    retries: List[Tuple[float, Dict[str, Any]]] = []
+    renewed = claimed = time.monotonic()
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix="memory-extract") as pool:
+        while True:
+            if _stop.is_set() and _queue.empty():
+                # Turns waiting for a retry are still journaled; hand them to whoever starts next
+                _journal_renew(0)
+                return
+            now = time.monotonic()
+            if now - renewed >= LEASE / 3:
+                _journal_renew(time.time() + LEASE)
+                renewed = now
+            if now - claimed >= LEASE:
+                _claim_expired()
+                claimed = now
+            batch = _next_batch(retries)
+            if not batch:
+                continue
+            for turn, error in process_batch(batch, pool):
+                _retry_or_give_up(turn, error, retries)
+
+
+# -----------------------------------------------------------------------------
+# Lifecycle
+# -----------------------------------------------------------------------------
+
+def start():
+    """Start the worker and queue the turns left in the journal. No-op when disabled."""
+    global _thread
+    if not ENABLED or _thread is not None:
+        return
+    _open_journal()
+    _stop.clear()
+    _claim_expired()
+    _thread = threading.Thread(target=_run, name="memory-writer", daemon=True)
+    _thread.start()
+
+
+def stop(timeout: float = 30):
+    """Write what is queued (waiting at most timeout seconds) and stop the worker."""
+    global _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join(timeout)
+    _thread = None
+
+
+def stats() -> Dict[str, Any]:
+    """Counters for /stats."""
+    with _counters_lock:
+        counters = dict(_counters)
+    return {"enabled": ENABLED, "queued": _queue.qsize(), "failed_turns": _journal_failed_count(), **counters}
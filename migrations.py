@@ -0,0 +1,199 @@
+"""
+Versioned schema migrations: constraints, indexes and derived data.
+
+Every migration has a version and a list of idempotent statements. Applied
+versions are recorded as (:Migration {version, name, applied_at}) nodes, so
+running the migrations again only applies what is new.
+
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # show what is applied and pending
+    python migrations.py --dry-run  # print the statements without running them
+"""
+from dataclasses import dataclass, field
+from db_neo4j import ex_query
+from knowledge_view import REBUILD_QUERY
+from typing import List, Tuple
+import argparse
+import schema
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: List[str]
+    # Undo statements, used by rollback() and the migration benchmark
+    down: List[str] = field(default_factory=list)
+    # (label, property) pairs that must be unique before the statements can run
+    unique: List[Tuple[str, str]] = field(default_factory=list)
+
+
+def _unique(name: str, label: str, prop: str) -> Tuple[str, str]:
+    return (
+        f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE",
+        f"DROP CONSTRAINT {name} IF EXISTS",
+    )
+
+
+def _unique_migration(version: int, name: str, constraints: List[Tuple[str, str, str]]) -> Migration:
+    statements = [_unique(*c) for c in constraints]
+    return Migration(
+        version=version,
+        name=name,
+        statements=[up for up, _ in statements],
+        down=[down for _, down in statements],
+        unique=[(label, prop) for _, label, prop in constraints],
+    )
+
+
+MIGRATIONS: List[Migration] = [
+    _unique_migration(1, "Unique migration versions", [
+        ("migration_version_unique", "Migration", "version"),
+    ]),
+    _unique_migration(2, "Unique NPC names", [
+        ("npc_name_unique", "NPC", "name"),
+    ]),
+    _unique_migration(3, "Unique event and memory ids", [
+        ("event_id_unique", "Event", "event_id"),
+        ("memory_id_unique", "Memory", "memory_id"),
+    ]),
+    _unique_migration(4, "Unique group, object and place names", [
+        ("group_name_unique", "GROUP", "name"),
+        ("object_name_unique", "OBJECT", "name"),
+        ("place_name_unique", "PLACE", "name"),
+    ]),
+    Migration(
+        version=5,
+        name="Claim vector index",
+        statements=[
+            "CREATE VECTOR INDEX claim_index IF NOT EXISTS FOR (c:CLAIM) ON c.embedding "
+            "OPTIONS {indexConfig: {`vector.dimensions`: 1024, `vector.similarity_function`: 'cosine'}}"
+        ],
+        down=["DROP INDEX claim_index IF EXISTS"],
+    ),
+    Migration(
+        version=6,
+        name="Materialized KNOWS view",
+        # Populates the view for existing data; the writers keep it up to date from here
+        statements=[REBUILD_QUERY],
+        down=["MATCH (:NPC)-[k:KNOWS]->(:CLAIM) DELETE k"],
+    ),
+    Migration(
+        version=7,
+        name="Memory vector index",
+        statements=[
+            "CREATE VECTOR INDEX memory_index IF NOT EXISTS FOR (m:Memory) ON m.embedding "
+            "OPTIONS {indexConfig: {`vector.dimensions`: 1024, `vector.similarity_function`: 'cosine'}}"
+        ],
+        down=["DROP INDEX memory_index IF EXISTS"],
+    ),
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+def applied_versions() -> List[int]:
+    records, _, _ = ex_query("MATCH (m:Migration) RETURN m.version AS version ORDER BY version")
+    return [r["version"] for r in records]
+
+
+def pending() -> List[Migration]:
+    applied = set(applied_versions())
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m.version) if m.version not in applied]
+
+
+def find_duplicates(label: str, prop: str, limit: int = 10) -> List[Tuple[object, int]]:
+    """Values of label.prop held by more than one node, which block a uniqueness constraint."""
+    records, _, _ = ex_query(
+        f"MATCH (n:`{label}`) WHERE n.`{prop}` IS NOT NULL "
+        f"WITH n.`{prop}` AS value, count(*) AS nodes WHERE nodes > 1 "
+        "RETURN value, nodes ORDER BY nodes DESC LIMIT $limit",
+        {"limit": limit},
+    )
+    return [(r["value"], r["nodes"]) for r in records]
+
+
+def apply(migration: Migration):
+    """Run one migration and record it. Stops before any statement if duplicates block it."""
+    for label, prop in migration.unique:
+        duplicates = find_duplicates(label, prop)
+        if duplicates:
+            listed = ", ".join(f"{value!r} ({nodes} nodes)" for value, nodes in duplicates)
+            raise MigrationError(
+                f"Migration {migration.version} needs unique {label}.{prop}; "
+                f"merge or remove these first: {listed}"
+            )
+
+    # Schema statements must each run in their own transaction
+    for statement in migration.statements:
+        ex_query(statement)
+    ex_query(
+        "MERGE (m:Migration {version: $version}) SET m.name = $name, m.applied_at = datetime()",
+        {"version": migration.version, "name": migration.name},
+    )
+    print(f"✓ Migration {migration.version}: {migration.name}")
+
+
+def migrate(dry_run: bool = False, await_indexes: float = 300) -> List[int]:
+    """
+    Apply all pending migrations in version order.
+
+    Returns the versions that were applied (or would be, with dry_run).
+    """
+    todo = pending()
+    if dry_run:
+        for migration in todo:
+            print(f"-- {migration.version}: {migration.name}")
+            for statement in migration.statements:
+                print(statement + ";")
+        return [m.version for m in todo]
+
+    for migration in todo:
+        apply(migration)
+    if todo:
+        # New indexes are populated in the background; wait so callers see them online
+        ex_query("CALL db.awaitIndexes($seconds)", {"seconds": int(await_indexes)})
+        schema.invalidate()
+    return [m.version for m in todo]
+
+
+def rollback(to_version: int = 0) -> List[int]:
+    """Undo applied migrations above to_version, newest first."""
+    applied = set(applied_versions())
+    undone = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version, reverse=True):
+        if migration.version <= to_version or migration.version not in applied:
+            continue
+        # Forget it first, so a drop that fails is simply re-applied by the next migrate()
+        ex_query("MATCH (m:Migration {version: $version}) DELETE m", {"version": migration.version})
+        for statement in migration.down:
+            ex_query(statement)
+        undone.append(migration.version)
+        print(f"✓ Rolled back {migration.version}: {migration.name}")
+    if undone:
+        schema.invalidate()
+    return undone
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations (constraints and indexes).")
+    parser.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    parser.add_argument("--dry-run", action="store_true", help="print pending statements without running them")
+    args = parser.parse_args()
+
+    if args.status:
+        applied = set(applied_versions())
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            state = "applied" if migration.version in applied else "pending"
+            print(f"{migration.version:>3}  {state:<8} {migration.name}")
+        return
+
+    applied = migrate(dry_run=args.dry_run)
+    if not applied:
+        print("Nothing to migrate.")
+
+
+if __name__ == "__main__":
+    main()
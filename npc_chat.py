@@ -1,58 +1,164 @@
-from llms.groq import chat
-from db_neo4j import ex_query
-from typing import List, Dict, Any, Optional
+from llms.backend import chat, chat_async, chat_stream
+from db_neo4j import ex_query, ex_query_async, add_invalidation_listener
+from embeddings import create_query_embedding
+from cache import LRUCache
+import sessions
+from typing import List, Dict, Any, Iterator, Optional
+import asyncio
+import hashlib
+import os
 
 
-def get_npc_context(npc_name: str) -> Optional[Dict[str, Any]]:
-    """
-    Retrieve all context for an NPC from Neo4j database.
-    Returns personality, traits, memories, and related events.
-    """
-    query = """
-    MATCH (npc:NPC {name: $npc_name})
-    OPTIONAL MATCH (npc)-[:HAS_PERSONALITY]->(p:Personality)
-    OPTIONAL MATCH (p)-[:HAS_TRAIT]->(t:Trait)
-    OPTIONAL MATCH (npc)-[:HAS_MEMORY]->(m:Memory)
-    OPTIONAL MATCH (m)-[:MEMORY_OF]->(e:Event)
-    RETURN 
-        npc,
-        p as personality,
-        collect(DISTINCT t.trait) as traits,
-        collect(DISTINCT {
+# Loaded NPC contexts, keyed by NPC name. Writers in db_neo4j invalidate
+# entries through notify_npc_changed; the TTL bounds staleness from writes
+# made by other processes.
+context_cache = LRUCache(
+    max_size=int(os.getenv("NPC_CONTEXT_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("NPC_CONTEXT_CACHE_TTL", "300")),
+)
+
+
+def invalidate_npc_context(npc_name: Optional[str] = None):
+    """Drop the cached context of one NPC, or of all NPCs if npc_name is None."""
+    if npc_name is None:
+        context_cache.clear()
+    else:
+        context_cache.invalidate(npc_name)
+
+
+add_invalidation_listener(invalidate_npc_context)
+
+
+# Loads the contexts of a list of NPCs in one round trip. Each part of the
+# context is collected in its own subquery, so traits and memories are never
+# multiplied into traits x memories rows before being collapsed.
+NPC_CONTEXTS_QUERY = """
+    UNWIND $npc_names AS npc_name
+    MATCH (npc:NPC {name: npc_name})
+    CALL {
+        WITH npc
+        OPTIONAL MATCH (npc)-[:HAS_PERSONALITY]->(p:Personality)
+        RETURN head(collect(p)) AS personality
+    }
+    CALL {
+        WITH personality
+        OPTIONAL MATCH (personality)-[:HAS_TRAIT]->(t:Trait)
+        RETURN collect(DISTINCT t.trait) AS traits
+    }
+    CALL {
+        WITH npc
+        OPTIONAL MATCH (npc)-[:HAS_MEMORY]->(m:Memory)
+        OPTIONAL MATCH (m)-[:MEMORY_OF]->(e:Event)
+        RETURN collect(DISTINCT {
             memory_id: m.memory_id,
             memory: m.memory,
             event_id: e.event_id,
             event_location: e.location,
             event_time: e.start_time + ' - ' + e.stop_time,
             event_summary: e.summary
-        }) as memories
+        }) AS memories
+    }
+    RETURN npc.name AS npc_name, npc, personality, traits, memories
     """
-    
-    records, summary, keys = ex_query(query, {"npc_name": npc_name})
-    
-    if not records:
-        return None
-    
-    record = records[0]
-    context = {
+
+
+def _context_from_record(record) -> Dict[str, Any]:
+    """Turn one row of NPC_CONTEXTS_QUERY into a context dict."""
+    return {
         "npc": dict(record["npc"]),
         "personality": dict(record["personality"]) if record["personality"] else None,
         "traits": record["traits"],
         "memories": [m for m in record["memories"] if m["memory_id"]]
     }
-    return context
 
 
-def build_npc_system_prompt(context: Dict[str, Any]) -> str:
+def _split_cached(npc_names: List[str]):
+    """Look up npc_names in the cache; return hits and the versions of misses."""
+    contexts = {}
+    versions = {}
+    for name in dict.fromkeys(npc_names):
+        context = context_cache.get(name)
+        if context is not None:
+            contexts[name] = context
+        else:
+            versions[name] = context_cache.version(name)
+    return contexts, versions
+
+
+def _store_loaded(records, contexts: Dict[str, Dict[str, Any]], versions: Dict[str, Any]):
+    for record in records:
+        name = record["npc_name"]
+        if name in contexts:
+            continue
+        context = _context_from_record(record)
+        contexts[name] = context
+        context_cache.set(name, context, version=versions.get(name))
+
+
+def get_npc_contexts(npc_names: List[str]) -> Dict[str, Dict[str, Any]]:
     """
-    Build a system prompt that instructs the LLM to roleplay as the NPC.
+    Retrieve the contexts of several NPCs, keyed by name.
+
+    Cached contexts are reused; the rest are loaded in a single query.
+    NPCs that don't exist are left out of the result. The returned dicts
+    are shared with the cache and must not be modified.
+    """
+    contexts, versions = _split_cached(npc_names)
+    if versions:
+        records, summary, keys = ex_query(NPC_CONTEXTS_QUERY, {"npc_names": list(versions)})
+        _store_loaded(records, contexts, versions)
+    return contexts
+
+
+async def get_npc_contexts_async(npc_names: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Async version of get_npc_contexts()."""
+    contexts, versions = _split_cached(npc_names)
+    if versions:
+        records, summary, keys = await ex_query_async(NPC_CONTEXTS_QUERY, {"npc_names": list(versions)})
+        _store_loaded(records, contexts, versions)
+    return contexts
+
+
+def get_npc_context(npc_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Retrieve all context for an NPC from Neo4j database.
+    Returns personality, traits, memories, and related events.
+
+    Contexts are served from context_cache when possible. The returned dict
+    is shared with the cache and must not be modified.
     """
+    return get_npc_contexts([npc_name]).get(npc_name)
+
+
+async def get_npc_context_async(npc_name: str) -> Optional[Dict[str, Any]]:
+    """Async version of get_npc_context(), sharing the same cache."""
+    contexts = await get_npc_contexts_async([npc_name])
+    return contexts.get(npc_name)
+
+
+PROMPT_FOOTER = """
+
+INSTRUCTIONS:
+- Stay in character at all times
+- Draw from your memories and personality when responding
+- Be consistent with your traits and behavioral patterns
+- If asked about events, refer to your memories
+- You may be evasive, lie, or reveal information based on your personality
+- Respond naturally as this character would in conversation
+"""
+
+# Compiled system prompts, keyed by NPC name. Each entry remembers the
+# content hash of the context it was built from, so it is reused until the
+# NPC's persona or memories actually change.
+prompt_cache = LRUCache(max_size=int(os.getenv("NPC_PROMPT_CACHE_SIZE", "256")))
+
+
+def _build_prompt_header(context: Dict[str, Any]) -> str:
     npc = context["npc"]
     personality = context["personality"]
     traits = context["traits"]
-    memories = context["memories"]
     
-    prompt = f"""You are {npc['name']}, a {npc.get('age', 'unknown age')} year old {npc.get('role', 'person')}.
+    return f"""You are {npc['name']}, a {npc.get('age', 'unknown age')} year old {npc.get('role', 'person')}.
 
 PERSONALITY:
 {personality['summary'] if personality else 'No personality data available.'}
@@ -67,61 +173,330 @@ YOUR BEHAVIOR PATTERNS:
 
 YOUR MEMORIES AND EXPERIENCES:
 """
+
+
+def _format_memory(i: int, mem: Dict[str, Any]) -> str:
+    line = f"\n{i}. {mem['memory']}"
+    if mem.get('event_summary'):
+        line += f"\n   (Event: {mem['event_summary']})"
+    return line
+
+
+def _memory_key(mem: Dict[str, Any]) -> tuple:
+    """The parts of a memory that end up in the prompt."""
+    return (mem["memory_id"], mem["memory"], mem.get("event_summary"))
+
+
+def _content_hash(header: str, memory_keys: List[tuple]) -> str:
+    digest = hashlib.sha256(header.encode())
+    for key in sorted(memory_keys, key=repr):
+        digest.update(repr(key).encode())
+    return digest.hexdigest()
+
+
+# How many memories, and roughly how many tokens of them, go into a prompt
+MEMORY_TOP_K = int(os.getenv("NPC_MEMORY_TOP_K", "20"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("NPC_MEMORY_TOKEN_BUDGET", "1500"))
+
+# Memories searched in memory_index per ranking, as a multiple of top_k. The
+# index spans every NPC's memories; only this NPC's hits are kept.
+MEMORY_CANDIDATES = int(os.getenv("NPC_MEMORY_CANDIDATES", "10"))
+
+MEMORY_RELEVANCE_QUERY = """
+    CALL db.index.vector.queryNodes('memory_index', $candidates, $query_vector)
+    YIELD node AS m, score
+    WITH collect([m, score]) AS hits, count(*) AS searched
+    UNWIND hits AS hit
+    WITH hit[0] AS m, hit[1] AS score, searched
+    WHERE EXISTS { (:NPC {name: $npc_name})-[:HAS_MEMORY]->(m) }
+    RETURN m.memory_id AS memory_id, score, searched
+    ORDER BY score DESC
+    LIMIT $top_k
+    """
+
+# Exact cosine ranking over one NPC's own memories, for when the index
+# search was filled up by other NPCs' memories before top_k of this one's.
+MEMORY_EXACT_QUERY = """
+    MATCH (npc:NPC {name: $npc_name})-[:HAS_MEMORY]->(m:Memory)
+    WHERE m.embedding IS NOT NULL
+    WITH m, vector.similarity.cosine(m.embedding, $query_vector) AS score
+    ORDER BY score DESC
+    LIMIT $top_k
+    RETURN m.memory_id AS memory_id, score
+    """
+
+
+def _ranking_params(context: Dict[str, Any], query_vector: List[float], top_k: int) -> Dict[str, Any]:
+    return {
+        "npc_name": context["npc"]["name"],
+        "query_vector": query_vector,
+        "top_k": top_k,
+        "candidates": top_k * MEMORY_CANDIDATES,
+    }
+
+
+def _needs_exact_ranking(records, params: Dict[str, Any]) -> bool:
+    """Whether the index search may have missed some of the NPC's memories."""
+    return len(records) < params["top_k"] and (not records or records[0]["searched"] >= params["candidates"])
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _memory_tokens(mem: Dict[str, Any]) -> int:
+    return estimate_tokens(_format_memory(0, mem))
+
+
+# Whether an NPC's memories fit the prompt, per NPC name. Like prompt_cache,
+# an entry is only used for the very context object it was computed from.
+_fit_cache = LRUCache(max_size=int(os.getenv("NPC_CONTEXT_CACHE_SIZE", "256")))
+
+
+def _fits_prompt(context: Dict[str, Any], top_k: int, token_budget: int) -> bool:
+    name = context["npc"]["name"]
+    cached = _fit_cache.get(name)
+    if cached and cached["context"] is context and cached["limits"] == (top_k, token_budget):
+        return cached["fits"]
+
+    memories = context["memories"]
+    fits = len(memories) <= top_k and sum(_memory_tokens(m) for m in memories) <= token_budget
+    _fit_cache.set(name, {"context": context, "limits": (top_k, token_budget), "fits": fits})
+    return fits
+
+
+def _rank_memories(memories: List[Dict[str, Any]], records) -> List[Dict[str, Any]]:
+    """
+    Order memories by the ranked memory_ids in records. Memories that were
+    not ranked (e.g. not embedded yet) follow in their original order.
+    """
+    ranked_ids = {r["memory_id"] for r in records}
+    by_id: Dict[str, List[Dict[str, Any]]] = {}
+    for mem in memories:
+        by_id.setdefault(mem["memory_id"], []).append(mem)
+    ranked = [mem for r in records for mem in by_id.get(r["memory_id"], [])]
+    return ranked + [mem for mem in memories if mem["memory_id"] not in ranked_ids]
+
+
+def _take_within_budget(memories: List[Dict[str, Any]], top_k: int, token_budget: int) -> List[Dict[str, Any]]:
+    selected = []
+    used = 0
+    for mem in memories[:top_k]:
+        tokens = _memory_tokens(mem)
+        if used + tokens > token_budget:
+            break
+        selected.append(mem)
+        used += tokens
+    return selected
+
+
+def select_relevant_memories(context: Dict[str, Any], user_message: str,
+                             top_k: int = MEMORY_TOP_K,
+                             token_budget: int = MEMORY_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """
+    Pick the memories most relevant to user_message, within top_k and token_budget.
+
+    NPCs whose memories already fit get all of them (no embedding call).
+    Memories without embeddings come after the ranked ones; if ranking
+    fails, the first memories that fit are used instead.
+    """
+    memories = context["memories"]
+    if _fits_prompt(context, top_k, token_budget):
+        return memories
     
-    for i, mem in enumerate(memories, 1):
-        prompt += f"\n{i}. {mem['memory']}"
-        if mem.get('event_summary'):
-            prompt += f"\n   (Event: {mem['event_summary']})"
+    try:
+        params = _ranking_params(context, create_query_embedding(user_message), top_k)
+        records, _, _ = ex_query(MEMORY_RELEVANCE_QUERY, params)
+        if _needs_exact_ranking(records, params):
+            records, _, _ = ex_query(MEMORY_EXACT_QUERY, params)
+        ranked = _rank_memories(memories, records)
+    except Exception as e:
+        print(f"Memory ranking failed, using unranked memories: {e}")
+        ranked = memories
+    return _take_within_budget(ranked, top_k, token_budget)
+
+
+async def select_relevant_memories_async(context: Dict[str, Any], user_message: str,
+                                         top_k: int = MEMORY_TOP_K,
+                                         token_budget: int = MEMORY_TOKEN_BUDGET) -> List[Dict[str, Any]]:
+    """Async version of select_relevant_memories()."""
+    memories = context["memories"]
+    if _fits_prompt(context, top_k, token_budget):
+        return memories
     
-    prompt += """
+    try:
+        query_vector = await asyncio.to_thread(create_query_embedding, user_message)
+        params = _ranking_params(context, query_vector, top_k)
+        records, _, _ = await ex_query_async(MEMORY_RELEVANCE_QUERY, params)
+        if _needs_exact_ranking(records, params):
+            records, _, _ = await ex_query_async(MEMORY_EXACT_QUERY, params)
+        ranked = _rank_memories(memories, records)
+    except Exception as e:
+        print(f"Memory ranking failed, using unranked memories: {e}")
+        ranked = memories
+    return _take_within_budget(ranked, top_k, token_budget)
 
-INSTRUCTIONS:
-- Stay in character at all times
-- Draw from your memories and personality when responding
-- Be consistent with your traits and behavioral patterns
-- If asked about events, refer to your memories
-- You may be evasive, lie, or reveal information based on your personality
-- Respond naturally as this character would in conversation
-"""
-    print(prompt)
+
+def build_npc_system_prompt(context: Dict[str, Any], memories: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Build a system prompt that instructs the LLM to roleplay as the NPC.
+
+    If memories is given (see select_relevant_memories), only those are
+    listed, in that order. Otherwise all of the NPC's memories are.
+
+    Full prompts are compiled once per NPC and cached. A context that hashes
+    to the cached content reuses the prompt as is; if the only change is new
+    memories, they are appended to the cached prompt instead of rebuilding it.
+    """
+    name = context["npc"]["name"]
+    compiled = prompt_cache.get(name)
+    
+    if memories is not None and memories is not context["memories"]:
+        if compiled and compiled["context"] is context:
+            header = compiled["header"]
+        else:
+            header = _build_prompt_header(context)
+        return header + "".join(_format_memory(i, mem) for i, mem in enumerate(memories, 1)) + PROMPT_FOOTER
+    
+    # Same context object as last time (served from context_cache)
+    if compiled and compiled["context"] is context:
+        return compiled["prompt"]
+    
+    header = _build_prompt_header(context)
+    memories = context["memories"]
+    memory_keys = [_memory_key(mem) for mem in memories]
+    content_hash = _content_hash(header, memory_keys)
+    
+    if compiled and compiled["hash"] == content_hash:
+        body = compiled["body"]
+        known_keys = compiled["memory_keys"]
+    elif compiled and compiled["header"] == header and compiled["memory_keys"] <= set(memory_keys):
+        # Only new memories: number them after the ones already in the prompt
+        known_keys = compiled["memory_keys"]
+        new_memories = [mem for mem, key in zip(memories, memory_keys) if key not in known_keys]
+        first = len(known_keys) + 1
+        body = compiled["body"] + "".join(
+            _format_memory(i, mem) for i, mem in enumerate(new_memories, first)
+        )
+        known_keys = set(memory_keys)
+    else:
+        body = header + "".join(_format_memory(i, mem) for i, mem in enumerate(memories, 1))
+        known_keys = set(memory_keys)
+    
+    prompt = body + PROMPT_FOOTER
+    prompt_cache.set(name, {
+        "context": context,
+        "hash": content_hash,
+        "header": header,
+        "memory_keys": known_keys,
+        "body": body,
+        "prompt": prompt,
+    })
     return prompt
 
 
-def chat_with_npc(npc_name: str, user_message: str) -> str:
+def build_chat_prompt(context: Dict[str, Any], user_message: str,
+                      memories: Optional[List[Dict[str, Any]]] = None,
+                      history: str = "") -> str:
+    """
+    Combine the NPC's system prompt, the conversation so far (see
+    sessions.Session.history) and the user's message.
+    """
+    system_prompt = build_npc_system_prompt(context, memories)
+    
+    if history:
+        system_prompt += "\n\n" + history
+    full_prompt = system_prompt + "\n\nUser: " + user_message + "\n\nYou:"
+    return full_prompt
+
+
+def prepare_chat_prompt(npc_name: str, user_message: str, history: str = "") -> Optional[str]:
+    """
+    Build the full LLM prompt for a message to an NPC.
+    
+    Returns None if the NPC doesn't exist.
+    """
+    # Get NPC context from database
+    context = get_npc_context(npc_name)
+    
+    if not context:
+        return None
+    
+    # Build prompt with the NPC's most relevant memories
+    memories = select_relevant_memories(context, user_message)
+    return build_chat_prompt(context, user_message, memories, history)
+
+
+async def prepare_chat_prompt_async(npc_name: str, user_message: str, history: str = "") -> Optional[str]:
+    """Async version of prepare_chat_prompt()."""
+    context = await get_npc_context_async(npc_name)
+    
+    if not context:
+        return None
+    
+    memories = await select_relevant_memories_async(context, user_message)
+    return build_chat_prompt(context, user_message, memories, history)
+
+
+def chat_with_npc(npc_name: str, user_message: str, history: str = "") -> str:
     """
     Have a conversation with an NPC.
     
     Args:
         npc_name: Name of the NPC to chat with
         user_message: The user's message
+        history: The conversation so far, from a session (optional)
     
     Returns:
         The NPC's response
     """
-    # Get NPC context from database
-    context = get_npc_context(npc_name)
+    full_prompt = prepare_chat_prompt(npc_name, user_message, history)
     
-    if not context:
+    if full_prompt is None:
         return f"Error: NPC '{npc_name}' not found in database."
     
-    # Build system prompt with NPC's context
-    system_prompt = build_npc_system_prompt(context)
-    
-    # Combine system prompt with user message
-    full_prompt = system_prompt + "\n\nUser: " + user_message + "\n\nYou:"
-    print(full_prompt)
     # Get response from LLM
     response = chat(full_prompt)
     
     return response
 
 
+def chat_with_npc_stream(npc_name: str, user_message: str, history: str = "") -> Iterator[str]:
+    """
+    Like chat_with_npc(), but yields the response as it is generated.
+    """
+    full_prompt = prepare_chat_prompt(npc_name, user_message, history)
+    
+    if full_prompt is None:
+        yield f"Error: NPC '{npc_name}' not found in database."
+        return
+    
+    yield from chat_stream(full_prompt)
+
+
+async def chat_with_npc_async(npc_name: str, user_message: str, history: str = "") -> str:
+    """
+    Async version of chat_with_npc(), used by the API so that database
+    and LLM round trips never block the event loop.
+    """
+    full_prompt = await prepare_chat_prompt_async(npc_name, user_message, history)
+    
+    if full_prompt is None:
+        return f"Error: NPC '{npc_name}' not found in database."
+    
+    response = await chat_async(full_prompt)
+    
+    return response
+
+
 def interactive_npc_chat(npc_name: str):
     """
     Start an interactive chat session with an NPC.
     """
     print(f"\n=== Starting conversation with {npc_name} ===")
     print("Type 'exit' to end the conversation\n")
+    session = sessions.get_session(None, npc_name)
     
     while True:
         user_input = input("You: ").strip()
@@ -133,10 +508,17 @@ def interactive_npc_chat(npc_name: str):
         if not user_input:
             continue
         
-        # Get NPC response
-        response = chat_with_npc(npc_name, user_input)
+        # Print the NPC's response as it is generated
+        print(f"\n{npc_name}: ", end="", flush=True)
+        reply = ""
+        for token in chat_with_npc_stream(npc_name, user_input, session.history()):
+            print(token, end="", flush=True)
+            reply += token
+        print("\n")
         
-        print(f"\n{npc_name}: {response}\n")
+        sessions.record_turn(session, user_input, reply)
+        if session.needs_summary:
+            session.summarize()
 
 
 if __name__ == "__main__":
@@ -1,15 +1,51 @@
 # hybrid_npc_chat.py
-from llms.groq import chat
-from db_neo4j import ex_query
-from npc_chat import get_npc_context, build_npc_system_prompt
-from query_rag import query_rag, DATABASE_SCHEMA
-# from query_rag import generate_cypher_query
+from llms.backend import chat, chat_stream
+from npc_chat import get_npc_context, build_npc_system_prompt, select_relevant_memories
+from query_rag import query_rag, cypher_for_question
+from question_classifier import question_classifier, LABELS
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 import json
+import os
+import sessions
+
+
+# Trådpool för de steg i hybrid-kedjan som kan köras samtidigt
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HYBRID_WORKERS", "16")),
+    thread_name_prefix="hybrid",
+)
+
+# Börja generera Cypher redan medan frågan klassificeras (kostar ett
+# LLM-anrop i onödan när frågan inte visar sig vara FACTUAL)
+SPECULATIVE_CYPHER = os.getenv("HYBRID_SPECULATIVE_CYPHER", "0") == "1"
 
 
 def classify_question(user_message: str) -> dict:
     """
     Avgör om frågan behöver databas-lookup eller bara personlighet/minnen.
+    Den lokala klassificeraren svarar först; LLM:en frågas bara när den är osäker.
+    """
+    prediction = question_classifier.predict(user_message)
+    if prediction.confident:
+        question_classifier.maybe_shadow(user_message, prediction, classify_question_llm)
+        return {"type": prediction.label, "reason": f"Local classifier ({prediction.confidence:.2f})"}
+    
+    result = classify_question_llm(user_message)
+    if result and result.get("type") in LABELS:
+        question_classifier.record_llm_label(user_message, result["type"], prediction)
+        return result
+    
+    # Fallback - leta efter nyckelord
+    msg_lower = user_message.lower()
+    if any(word in msg_lower for word in ["is your", "was your", "who", "what", "when", "where", "which"]):
+        return {"type": "FACTUAL", "reason": "Contains factual keywords"}
+    return {"type": "GENERAL", "reason": "Failed to parse, defaulting to general"}
+
+
+def classify_question_llm(user_message: str) -> Optional[dict]:
+    """
+    Låt LLM:en klassificera frågan. Returnerar None om svaret inte går att tolka.
     """
     prompt = f"""
 Classify this question/statement into one of these categories:
@@ -42,7 +78,7 @@ Question/Statement: "{user_message}"
 Return JSON: {{"type": "FACTUAL|EMOTIONAL|GENERAL", "reason": "brief explanation"}}
 """
     
-    response = chat(prompt)
+    response = chat(prompt, cache_site="classify")
     
     # Parse JSON
     try:
@@ -51,11 +87,7 @@ Return JSON: {{"type": "FACTUAL|EMOTIONAL|GENERAL", "reason": "brief explanation
             response = response.split("```")[1].replace("json", "").strip()
         return json.loads(response)
     except:
-        # Fallback - leta efter nyckelord
-        msg_lower = user_message.lower()
-        if any(word in msg_lower for word in ["is your", "was your", "who", "what", "when", "where", "which"]):
-            return {"type": "FACTUAL", "reason": "Contains factual keywords"}
-        return {"type": "GENERAL", "reason": "Failed to parse, defaulting to general"}
+        return None
 
 # def query_for_context(user_message: str, npc_name: str) -> list:
 #     """
@@ -98,34 +130,61 @@ Return JSON: {{"type": "FACTUAL|EMOTIONAL|GENERAL", "reason": "brief explanation
 #         return []
     
   
-def chat_with_npc_hybrid(npc_name: str, user_message: str) -> str:
+def _load_npc_context(npc_name: str, user_message: str):
+    """Hämta NPC:ns kontext och de minnen som är mest relevanta för frågan."""
+    npc_context = get_npc_context(npc_name)
+    if not npc_context:
+        return None, []
+    return npc_context, select_relevant_memories(npc_context, user_message)
+
+
+def build_hybrid_prompt(npc_name: str, user_message: str,
+                        speculative: bool = SPECULATIVE_CYPHER,
+                        history: str = "") -> Optional[str]:
     """
-    Hybrid NPC chat: Kombinerar personlighet med dynamic query RAG.
+    Bygg hela prompten för hybrid-chatten (steg 1-4).
+    Returnerar None om NPC:n inte finns. history är samtalet hittills
+    (sessions.Session.history), om det finns något.
+    
+    Kontexten hämtas samtidigt som frågan klassificeras. Med speculative
+    genereras Cypher-queryn också parallellt och kastas om frågan inte är FACTUAL.
     """
     print(f"\n{'='*60}")
     print(f"💬 {npc_name} | Question: {user_message}")
     print('='*60)
     
-    # 1. Klassificera frågan
+    # 1 & 2. Hämta NPC base context och (ev.) Cypher medan frågan klassificeras
+    context_future = _executor.submit(_load_npc_context, npc_name, user_message)
+    cypher_future = _executor.submit(cypher_for_question, user_message) if speculative else None
+    
     classification = classify_question(user_message)
     print(f"\n🏷️  Type: {classification['type']} - {classification['reason']}")
     
-    # 2. Hämta NPC base context
-    npc_context = get_npc_context(npc_name)
-    if not npc_context:
-        return f"Error: NPC '{npc_name}' not found"
+    if cypher_future and classification['type'] != 'FACTUAL':
+        cypher_future.cancel()  # Resultatet ignoreras om anropet redan startat
+        cypher_future = None
+    
+    # Avbryt tidigt om vi redan vet att NPC:n saknas
+    if context_future.done() and context_future.result()[0] is None:
+        if cypher_future:
+            cypher_future.cancel()
+        return None
     
     # 3. Om FACTUAL - hämta extra kontext via query
     additional_context = ""
     if classification['type'] == 'FACTUAL':
         # query_results = query_for_context(user_message, npc_name)
-        query_results = query_rag(user_message)
+        cypher, cache_key = cypher_future.result() if cypher_future else (None, None)
+        # Rådata i stället för ett LLM-formulerat svar: ett LLM-anrop mindre
+        # och exakta värden i prompten
+        query_results = query_rag(user_message, cypher=cypher, synthesize=False, cache_key=cache_key)
         
-        if query_results:
+        if query_results.get("records"):
           additional_context = f"""
 
           VERIFIED DATA FROM DATABASE:
-          {json.dumps(query_results, indent=2)}
+          Query: {query_results["cypher"]}
+          Records: {json.dumps(query_results["records"], indent=2, default=str)}
 
           IMPORTANT: Use this data to verify facts. If the user made an incorrect statement, 
           correct them naturally in character. For example, if they say "your father" but 
@@ -134,12 +193,18 @@ def chat_with_npc_hybrid(npc_name: str, user_message: str) -> str:
         else:
             additional_context = "NO VERIFIED DATA FROM DATABASE FOUND, YOU CAN'T DISPUTE OR ACCEPT THE FACT. DON'T SAY ANYTHING YOU CAN'T VERIFY SPECIFICALLY"
     
+    npc_context, memories = context_future.result()
+    if not npc_context:
+        return None
+    
     # 4. Bygg prompt
-    base_prompt = build_npc_system_prompt(npc_context)
+    base_prompt = build_npc_system_prompt(npc_context, memories)
     
     full_prompt = f"""{base_prompt}
 {additional_context}
 
+{history}
+
 User says: "{user_message}"
 
 Respond in character as {npc_name}. 
@@ -149,6 +214,16 @@ Respond in character as {npc_name}.
 - Stay true to your personality and how you'd react to being corrected or questioned
 """
     print('full prompt: ', full_prompt)
+    return full_prompt
+
+
+def chat_with_npc_hybrid(npc_name: str, user_message: str, history: str = "") -> str:
+    """
+    Hybrid NPC chat: Kombinerar personlighet med dynamic query RAG.
+    """
+    full_prompt = build_hybrid_prompt(npc_name, user_message, history=history)
+    if full_prompt is None:
+        return f"Error: NPC '{npc_name}' not found"
     
     # 5. Få svar från LLM
     # print("\n💭 Generating response...\n")
@@ -157,6 +232,18 @@ Respond in character as {npc_name}.
     return response
 
 
+def chat_with_npc_hybrid_stream(npc_name: str, user_message: str, history: str = "") -> Iterator[str]:
+    """
+    Som chat_with_npc_hybrid, men svaret strömmas bit för bit.
+    """
+    full_prompt = build_hybrid_prompt(npc_name, user_message, history=history)
+    if full_prompt is None:
+        yield f"Error: NPC '{npc_name}' not found"
+        return
+    
+    yield from chat_stream(full_prompt)
+
+
 
 
 def interactive_hybrid_chat(npc_name: str):
@@ -176,6 +263,7 @@ def interactive_hybrid_chat(npc_name: str):
 
 # Type 'exit' to quit.
 # """)
+    session = sessions.get_session(None, npc_name)
     
     while True:
         user_input = input("\nYou: ").strip()
@@ -187,9 +275,17 @@ def interactive_hybrid_chat(npc_name: str):
         if not user_input:
             continue
         
-        response = chat_with_npc_hybrid(npc_name, user_input)
-        print(f"\n{npc_name}: {response}\n")
+        print(f"\n{npc_name}: ", end="", flush=True)
+        reply = ""
+        for token in chat_with_npc_hybrid_stream(npc_name, user_input, session.history()):
+            print(token, end="", flush=True)
+            reply += token
+        print("\n")
         print("-" * 60)
+        
+        sessions.record_turn(session, user_input, reply)
+        if session.needs_summary:
+            session.summarize()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,13 @@
-from llms.groq import chat
-from db_neo4j import ex_query
+from llms.backend import chat
+from cypher_guard import CypherRejected, run_guarded
+from cache import LRUCache
+import schema
+from neo4j.graph import Node, Path, Relationship
+from typing import Any, Dict, Optional, Tuple, Union
 import json
+import os
+import re
+import unicodedata
 
 
 DATABASE_SCHEMA = """
@@ -19,7 +26,10 @@ RELATIONSHIPS:
 - (NPC)-[:HAS_PERSONALITY]->(Personality)
 - (Personality)-[:HAS_TRAIT]->(Trait)
 - (NPC)-[:UNCLE_OF|NIECE_OF|BROTHER_OF|SISTER_OF]->(NPC)  [family relationships]
+"""
 
+# Gäller oavsett om schemat är det hårdkodade ovan eller läst från databasen
+QUERY_GUIDANCE = """
 IMPORTANT:
 - Use full names: "Elin von Dahlen", "Alrik von Dahlen", "Magnus Kreutz", "Sister Helena"
 - For relationships between NPCs, use: MATCH (a:NPC)-[r]-(b:NPC)
@@ -42,10 +52,68 @@ QUERY EXAMPLES:
    RETURN DISTINCT n.name
 """
 
+# Reserv om databasen inte går att introspektera
+DATABASE_SCHEMA = DATABASE_SCHEMA + QUERY_GUIDANCE
+
+
+# Genererade queries, nycklade på schemats fingeravtryck och normaliserad
+# fråga. Varje post minns om queryn gick att köra; bara queries som lyckats
+# återanvänds. Ändras schemat genereras queries om.
+cypher_cache = LRUCache(
+    max_size=int(os.getenv("CYPHER_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CYPHER_CACHE_TTL", "86400")),
+)
+
+
+def normalize_question(user_question: str) -> str:
+    """Normalisera frågan så att skiftläge, skiljetecken och blanksteg inte spelar roll."""
+    text = unicodedata.normalize("NFKC", user_question).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def _cache_key(user_question: str):
+    # get_schema() kollar fingeravtrycket (högst var SCHEMA_CHECK_INTERVAL:e
+    # sekund), så att nyckeln följer ett ändrat schema även när cachen träffar
+    live = schema.get_schema()
+    return live.fingerprint if live else None, normalize_question(user_question)
+
+
+def schema_for_question(user_question: str) -> str:
+    """Det live-schema som är relevant för frågan, annars DATABASE_SCHEMA."""
+    live = schema.schema_prompt(user_question)
+    if live is None:
+        return DATABASE_SCHEMA
+    return live + "\n" + QUERY_GUIDANCE
+
+
+def record_cypher_result(user_question: str, cypher: str, succeeded: bool, cache_key=None):
+    """
+    Spara om en genererad query gick att köra. cache_key är nyckeln queryn
+    genererades under (från cypher_for_question); annars räknas den om.
+    """
+    key = cache_key if cache_key is not None else _cache_key(user_question)
+    entry = cypher_cache.peek(key)
+    if entry and entry["cypher"] == cypher:
+        cypher_cache.set(key, {"cypher": cypher, "succeeded": succeeded})
+
 
 def generate_cypher_query(user_question: str) -> str:
-    """LLM genererar Cypher query"""
-    prompt = f"""{DATABASE_SCHEMA}
+    """LLM genererar Cypher query (eller återanvänder en som redan fungerat)"""
+    return cypher_for_question(user_question)[0]
+
+
+def cypher_for_question(user_question: str) -> Tuple[str, Any]:
+    """Som generate_cypher_query, men returnerar även cache-nyckeln för record_cypher_result."""
+    # Cachen först: schemat behövs bara om queryn måste genereras. Poster
+    # som inte lyckats (eller inte körts än) räknas som missar.
+    key = _cache_key(user_question)
+    cached = cypher_cache.get(key, accept=lambda entry: entry["succeeded"])
+    if cached:
+        return cached["cypher"], key
+    
+    database_schema = schema_for_question(user_question)
+    prompt = f"""{database_schema}
 
 User question: "{user_question}"
 
@@ -56,42 +124,85 @@ Return ONLY the Cypher query, no explanations.
 
 Query:"""
     
+    # Inget svarscache här: en query som misslyckats ska genereras om
     query = chat(prompt).strip()
     
     # Ta bort markdown om den finns
     if query.startswith("```"):
         query = "\n".join(query.split("\n")[1:-1])
     
-    return query.strip()
-
-
-def query_rag(user_question: str) -> str:
-    """Query-based RAG pipeline"""
+    query = query.strip()
+    cypher_cache.set(key, {"cypher": query, "succeeded": None})
+    return query, key
+
+
+def to_jsonable(value: Any) -> Any:
+    """Gör om Neo4j-noder, relationer och paths till vanliga dicts/listor."""
+    if isinstance(value, Node):
+        props = {k: v for k, v in value.items() if k != "embedding"}
+        return {"labels": sorted(value.labels), **props}
+    if isinstance(value, Relationship):
+        return {"type": value.type, **dict(value.items())}
+    if isinstance(value, Path):
+        return [to_jsonable(node) for node in value.nodes]
+    if isinstance(value, dict):
+        return {k: to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    return value
+
+
+def query_rag(user_question: str, cypher: Optional[str] = None,
+              synthesize: bool = True, cache_key=None) -> Union[str, Dict[str, Any]]:
+    """
+    Query-based RAG pipeline.
+    
+    cypher: en redan genererad query (t.ex. spekulativt genererad i förväg);
+            annars genereras en här.
+    cache_key: nyckeln som cypher genererades under (se cypher_for_question).
+    synthesize: om False hoppas svarssteget (ett LLM-anrop) över och
+                {"cypher": ..., "records": [...], "truncated": bool} returneras
+                i stället, eller {"cypher": ..., "error": ...} om queryn
+                misslyckades eller stoppades av cypher_guard.
+    """
     
     # 1. Generera query
-    print(f"\n📝 Generating query for: {user_question}")
-    cypher = generate_cypher_query(user_question)
+    if cypher is None:
+        print(f"\n📝 Generating query for: {user_question}")
+        cypher, cache_key = cypher_for_question(user_question)
     print(f"Query: {cypher}")
     
-    # 2. Kör query
+    # 2. Kör query (genererad, alltså okontrollerad: se cypher_guard)
     try:
-        records, _, _ = ex_query(cypher)
-        results = [dict(r) for r in records]
+        guarded = run_guarded(cypher)
+        results = [to_jsonable(dict(r)) for r in guarded.records]
         print(f"✅ Found {len(results)} results")
+    except CypherRejected as e:
+        record_cypher_result(user_question, cypher, succeeded=False, cache_key=cache_key)
+        if not synthesize:
+            return {"cypher": cypher, "error": f"Query rejected: {e}"}
+        return f"Query rejected: {e}"
     except Exception as e:
+        record_cypher_result(user_question, cypher, succeeded=False, cache_key=cache_key)
+        if not synthesize:
+            return {"cypher": cypher, "error": str(e)}
         return f"Query failed: {e}"
+    record_cypher_result(user_question, cypher, succeeded=True, cache_key=cache_key)
+    
+    if not synthesize:
+        return {"cypher": cypher, "records": results, "truncated": guarded.truncated}
     
     # 3. Formulera svar
     answer_prompt = f"""
 Question: "{user_question}"
 
 Data from database:
-{json.dumps(results, indent=2)}
+{json.dumps(results, indent=2, default=str)}
 
 Answer the question naturally based on this data.
 """
     
-    return chat(answer_prompt)
+    return chat(answer_prompt, cache_site="rag_answer")
 
 
 # Test
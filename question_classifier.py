@@ -0,0 +1,292 @@
+"""
+Local fast-path classifier for npc_hybrid_chat.classify_question.
+
+A multinomial Naive Bayes model over words and word pairs, trained on the
+labels the LLM has given earlier messages. It answers in microseconds;
+classify_question only asks the LLM when the local model is unsure, and
+every LLM label is logged, learned from, and compared with the local guess
+to track accuracy.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dotenv import load_dotenv
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import json
+import math
+import os
+import random
+import re
+import threading
+
+load_dotenv()
+
+LABELS = ("FACTUAL", "EMOTIONAL", "GENERAL")
+
+# Where LLM-labelled messages are appended (one JSON object per line)
+LOG_PATH = os.getenv(
+    "CLASSIFIER_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "classifier_examples.jsonl")
+)
+# Size at which the log is rotated to <path>.1 (the previous .1 is dropped), so
+# at most about twice this much player text is kept
+LOG_MAX_BYTES = int(os.getenv("CLASSIFIER_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+# Minimum posterior probability to answer without the LLM
+CONFIDENCE_THRESHOLD = float(os.getenv("CLASSIFIER_CONFIDENCE", "0.85"))
+# Never answer locally before the LLM has labelled this many messages (the
+# seed examples don't count)
+MIN_EXAMPLES = int(os.getenv("CLASSIFIER_MIN_EXAMPLES", "50"))
+# Share of confident local answers that are also sent to the LLM to measure accuracy
+SHADOW_RATE = float(os.getenv("CLASSIFIER_SHADOW_RATE", "0.05"))
+# Shadow calls in flight at once; samples taken while they are busy are skipped
+SHADOW_WORKERS = int(os.getenv("CLASSIFIER_SHADOW_WORKERS", "1"))
+
+# The examples from the classification prompt, so the model starts somewhere
+SEED_EXAMPLES = [
+    ("So Alrik is your father", "FACTUAL"),
+    ("Who was at dinner?", "FACTUAL"),
+    ("Who was at dinner with you?", "FACTUAL"),
+    ("What happened in the Great hall at 20:00?", "FACTUAL"),
+    ("Where were you last night?", "FACTUAL"),
+    ("When did the event start?", "FACTUAL"),
+    ("How did you feel?", "EMOTIONAL"),
+    ("How did you feel about your uncle?", "EMOTIONAL"),
+    ("What do you think about your sister?", "EMOTIONAL"),
+    ("Why did you do it?", "EMOTIONAL"),
+    ("Hello", "GENERAL"),
+    ("Hello, how are you?", "GENERAL"),
+    ("Good evening", "GENERAL"),
+    ("Thank you, goodbye", "GENERAL"),
+]
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words plus adjacent word pairs."""
+    words = re.findall(r"\w+", text.casefold())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class NaiveBayesModel:
+    """Multinomial Naive Bayes with add-one smoothing, trainable one example at a time."""
+
+    def __init__(self, labels: Iterable[str] = LABELS):
+        self.labels = tuple(labels)
+        self.label_counts: Dict[str, int] = {label: 0 for label in self.labels}
+        self.token_counts: Dict[str, Dict[str, int]] = {label: {} for label in self.labels}
+        self.token_totals: Dict[str, int] = {label: 0 for label in self.labels}
+        self.vocabulary: set = set()
+
+    @property
+    def examples(self) -> int:
+        return sum(self.label_counts.values())
+
+    def learn(self, text: str, label: str):
+        self.label_counts[label] += 1
+        counts = self.token_counts[label]
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+            self.token_totals[label] += 1
+            self.vocabulary.add(token)
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        tokens = tokenize(text)
+        total = self.examples
+        vocabulary_size = len(self.vocabulary) + 1
+        scores = {}
+        for label in self.labels:
+            counts = self.token_counts[label]
+            denominator = self.token_totals[label] + vocabulary_size
+            score = math.log((self.label_counts[label] + 1) / (total + len(self.labels)))
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / denominator)
+            scores[label] = score
+
+        top = max(scores.values())
+        exps = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exps.values())
+        return {label: value / norm for label, value in exps.items()}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probabilities = self.predict_proba(text)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+
+@dataclass
+class Prediction:
+    label: str
+    confidence: float
+    confident: bool
+
+
+class QuestionClassifier:
+    """
+    Local classifier with an LLM fallback.
+
+    Keeps counters of how often it answered locally, how often it escalated,
+    and how often its guess matched the LLM's label.
+    """
+
+    def __init__(self, log_path: Optional[str] = LOG_PATH, threshold: float = CONFIDENCE_THRESHOLD,
+                 min_examples: int = MIN_EXAMPLES, shadow_rate: float = SHADOW_RATE):
+        self.log_path = log_path
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.shadow_rate = shadow_rate
+        self.model = NaiveBayesModel()
+        self._lock = threading.Lock()
+        # LLM-labelled messages learned so far, logged or live
+        self.labelled = 0
+        self._shadow_pool = ThreadPoolExecutor(max_workers=SHADOW_WORKERS, thread_name_prefix="classifier-shadow")
+        self._shadow_slots = threading.BoundedSemaphore(SHADOW_WORKERS)
+        # Appends to the log happen here, in order, off the request path
+        self._log_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classifier-log")
+
+        self.local_answers = 0
+        self.escalations = 0
+        self.compared = 0
+        self.agreed = 0
+        self.confident_compared = 0
+        self.confident_agreed = 0
+
+        for text, label in SEED_EXAMPLES:
+            self.model.learn(text, label)
+        for text, label in load_examples(log_path):
+            self.model.learn(text, label)
+            self.labelled += 1
+
+    def predict(self, text: str) -> Prediction:
+        with self._lock:
+            label, confidence = self.model.predict(text)
+            confident = self.labelled >= self.min_examples and confidence >= self.threshold
+            if confident:
+                self.local_answers += 1
+            else:
+                self.escalations += 1
+        return Prediction(label, confidence, confident)
+
+    def record_llm_label(self, text: str, label: str, prediction: Optional[Prediction] = None):
+        """Learn from a label given by the LLM and compare it with the local guess."""
+        if label not in LABELS:
+            return
+        with self._lock:
+            if prediction is not None:
+                self.compared += 1
+                self.agreed += prediction.label == label
+                if prediction.confident:
+                    self.confident_compared += 1
+                    self.confident_agreed += prediction.label == label
+            self.model.learn(text, label)
+            self.labelled += 1
+        if self.log_path:
+            self._log_writer.submit(self._append_example, text, label)
+
+    def _append_example(self, text: str, label: str):
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) >= LOG_MAX_BYTES:
+                os.replace(self.log_path, self.log_path + ".1")
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"text": text, "label": label}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Logging a classifier example failed: {e}")
+
+    def maybe_shadow(self, text: str, prediction: Prediction,
+                     classify_with_llm: Callable[[str], Optional[dict]]):
+        """
+        For a sample of confident answers, ask the LLM in the background as
+        well, so accuracy is also measured where the LLM was skipped.
+        """
+        if random.random() >= self.shadow_rate or not self._shadow_slots.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                result = classify_with_llm(text)
+            except Exception as e:
+                print(f"Shadow classification failed: {e}")
+                return
+            finally:
+                self._shadow_slots.release()
+            if result:
+                self.record_llm_label(text, result.get("type"), prediction)
+
+        self._shadow_pool.submit(run)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            answered = self.local_answers + self.escalations
+            return {
+                "examples": self.model.examples,
+                "labelled_examples": self.labelled,
+                "threshold": self.threshold,
+                "local_answers": self.local_answers,
+                "escalations": self.escalations,
+                "local_rate": self.local_answers / answered if answered else 0.0,
+                "accuracy_vs_llm": self.agreed / self.compared if self.compared else None,
+                "confident_accuracy_vs_llm": (
+                    self.confident_agreed / self.confident_compared if self.confident_compared else None
+                ),
+            }
+
+
+def load_examples(path: Optional[str]) -> List[Tuple[str, str]]:
+    """Read logged (text, label) pairs, rotated log first, skipping lines that don't parse."""
+    if not path:
+        return []
+    examples = []
+    for part in (path + ".1", path):
+        if not os.path.exists(part):
+            continue
+        with open(part, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if row.get("label") in LABELS and row.get("text"):
+                    examples.append((row["text"], row["label"]))
+    return examples
+
+
+def evaluate(examples: List[Tuple[str, str]], threshold: float = CONFIDENCE_THRESHOLD,
+             folds: int = 5) -> Dict[str, float]:
+    """
+    Cross-validate the local model against LLM labels.
+
+    Returns overall accuracy, the share of messages it would answer on its
+    own at threshold (coverage), and the accuracy on those messages.
+    """
+    examples = list(examples)
+    random.Random(0).shuffle(examples)
+    correct = covered = covered_correct = 0
+    for fold in range(folds):
+        model = NaiveBayesModel()
+        for text, label in SEED_EXAMPLES:
+            model.learn(text, label)
+        test = examples[fold::folds]
+        for i, (text, label) in enumerate(examples):
+            if i % folds != fold:
+                model.learn(text, label)
+        for text, label in test:
+            predicted, confidence = model.predict(text)
+            correct += predicted == label
+            if confidence >= threshold:
+                covered += 1
+                covered_correct += predicted == label
+
+    total = len(examples)
+    return {
+        "examples": total,
+        "accuracy": correct / total if total else 0.0,
+        "coverage": covered / total if total else 0.0,
+        "covered_accuracy": covered_correct / covered if covered else 0.0,
+    }
+
+
+question_classifier = QuestionClassifier()
+
+
+if __name__ == "__main__":
+    report = evaluate(load_examples(LOG_PATH))
+    print(f"Examples:          {report['examples']}")
+    print(f"Accuracy:          {report['accuracy']:.1%}")
+    print(f"Answered locally:  {report['coverage']:.1%} (threshold {CONFIDENCE_THRESHOLD})")
+    print(f"Accuracy on those: {report['covered_accuracy']:.1%}")
@@ -0,0 +1,290 @@
+"""
+Graph schema for the Cypher-generation prompt, read from the database.
+
+The schema (labels with their properties, relationship patterns and indexed
+properties) is introspected once and cached. Every SCHEMA_CHECK_INTERVAL
+seconds a cheap fingerprint of the labels, relationship types, property keys
+and indexes is compared with the cached one, and the schema is only read
+again when it changed.
+
+schema_prompt() renders the part of the schema that is relevant to a
+question, so the prompt stays small as the graph grows.
+"""
+from dataclasses import dataclass, field
+from db_neo4j import ex_query
+from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional, Set, Tuple
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+load_dotenv()
+
+# Seconds between fingerprint checks
+CHECK_INTERVAL = float(os.getenv("SCHEMA_CHECK_INTERVAL", "60"))
+# Most node labels rendered for one question
+MAX_LABELS = int(os.getenv("SCHEMA_MAX_LABELS", "10"))
+# Relationships sampled per type to find which labels it connects
+PATTERN_SAMPLE = int(os.getenv("SCHEMA_PATTERN_SAMPLE", "200"))
+
+# Properties that never help the model write a query
+EXCLUDED_PROPERTIES = {"embedding", "embedding_hash", "embedding_model"}
+
+# Labels that are always rendered: almost every question is about an NPC
+ANCHOR_LABELS = ("NPC",)
+
+FINGERPRINT_QUERY = """
+CALL db.labels() YIELD label
+WITH collect(label) AS labels
+CALL db.relationshipTypes() YIELD relationshipType
+WITH labels, collect(relationshipType) AS types
+CALL db.propertyKeys() YIELD propertyKey
+RETURN labels, types, collect(propertyKey) AS keys
+"""
+
+_TYPE_NAMES = {
+    "long": "int", "integer": "int", "double": "float", "float": "float",
+    "string": "string", "boolean": "boolean",
+}
+
+
+@dataclass
+class GraphSchema:
+    fingerprint: str
+    # label -> property -> type
+    nodes: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # (start label, relationship type, end label)
+    patterns: Set[Tuple[str, str, str]] = field(default_factory=set)
+    # relationship type -> property -> type
+    relationship_properties: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    # "Label.property" with a range/text/lookup index or constraint
+    indexed: Set[str] = field(default_factory=set)
+
+
+_schema: Optional[GraphSchema] = None
+_checked_at: Optional[float] = None
+_lock = threading.Lock()
+_checks = 0
+_refreshes = 0
+
+
+def _quote(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _type_name(types: Optional[List[str]]) -> Optional[str]:
+    """Short type name for the prompt, or None for vectors and other lists of floats."""
+    names = []
+    for t in types or []:
+        t = t.replace(" NOT NULL", "")
+        lowered = t.casefold()
+        if lowered.startswith("list") or lowered.endswith("array"):
+            inner = lowered.removeprefix("list<").removesuffix(">").removesuffix("array")
+            if inner in ("float", "double"):
+                return None
+            names.append(f"list<{_TYPE_NAMES.get(inner, inner)}>")
+        else:
+            names.append(_TYPE_NAMES.get(lowered, lowered))
+    return "|".join(sorted(set(names))) or "any"
+
+
+def _fingerprint() -> str:
+    records, _, _ = ex_query(FINGERPRINT_QUERY)
+    indexes, _, _ = ex_query("SHOW INDEXES YIELD name, state RETURN name, state")
+    row = records[0]
+    payload = {
+        "labels": sorted(row["labels"]),
+        "types": sorted(row["types"]),
+        "keys": sorted(row["keys"]),
+        "indexes": sorted((r["name"], r["state"]) for r in indexes),
+    }
+    return hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()[:16]
+
+
+def _introspect(fingerprint: str) -> GraphSchema:
+    schema = GraphSchema(fingerprint=fingerprint)
+
+    records, _, _ = ex_query(
+        "CALL db.schema.nodeTypeProperties() "
+        "YIELD nodeLabels, propertyName, propertyTypes "
+        "RETURN nodeLabels, propertyName, propertyTypes"
+    )
+    for r in records:
+        for label in r["nodeLabels"]:
+            props = schema.nodes.setdefault(label, {})
+            name = r["propertyName"]
+            if name is None or name in EXCLUDED_PROPERTIES:
+                continue
+            type_name = _type_name(r["propertyTypes"])
+            if type_name is not None:
+                props[name] = type_name
+
+    records, _, _ = ex_query(
+        "CALL db.schema.relTypeProperties() "
+        "YIELD relType, propertyName, propertyTypes "
+        "RETURN relType, propertyName, propertyTypes"
+    )
+    for r in records:
+        rel_type = r["relType"].lstrip(":").strip("`")
+        props = schema.relationship_properties.setdefault(rel_type, {})
+        name = r["propertyName"]
+        if name is None or name in EXCLUDED_PROPERTIES:
+            continue
+        type_name = _type_name(r["propertyTypes"])
+        if type_name is not None:
+            props[name] = type_name
+
+    # Which labels a type connects is sampled instead of scanning every relationship
+    for rel_type in schema.relationship_properties:
+        records, _, _ = ex_query(
+            f"MATCH (a)-[r:{_quote(rel_type)}]->(b) "
+            "WITH labels(a) AS starts, labels(b) AS ends LIMIT $sample "
+            "UNWIND starts AS s UNWIND ends AS e "
+            "RETURN DISTINCT s, e",
+            {"sample": PATTERN_SAMPLE},
+        )
+        for r in records:
+            schema.patterns.add((r["s"], rel_type, r["e"]))
+
+    records, _, _ = ex_query(
+        "SHOW INDEXES YIELD type, entityType, labelsOrTypes, properties "
+        "WHERE entityType = 'NODE' AND type <> 'VECTOR' AND labelsOrTypes IS NOT NULL "
+        "RETURN labelsOrTypes, properties"
+    )
+    for r in records:
+        for label in r["labelsOrTypes"]:
+            for prop in r["properties"]:
+                if prop not in EXCLUDED_PROPERTIES:
+                    schema.indexed.add(f"{label}.{prop}")
+
+    return schema
+
+
+def _recently_checked() -> bool:
+    return _checked_at is not None and time.monotonic() - _checked_at < CHECK_INTERVAL
+
+
+def get_schema() -> Optional[GraphSchema]:
+    """
+    The cached schema, refreshed if the database schema changed.
+
+    Returns None if the database could not be introspected and nothing is
+    cached yet.
+    """
+    global _schema, _checked_at, _checks, _refreshes
+    if _recently_checked():
+        return _schema
+
+    with _lock:
+        if _recently_checked():
+            return _schema
+        try:
+            _checks += 1
+            fingerprint = _fingerprint()
+            if _schema is None or _schema.fingerprint != fingerprint:
+                _schema = _introspect(fingerprint)
+                _refreshes += 1
+                print(f"Schema loaded ({len(_schema.nodes)} labels, fingerprint {fingerprint})")
+        except Exception as e:
+            print(f"Schema introspection failed: {e}")
+        # Also after a failure, so a broken database isn't hammered on every question
+        _checked_at = time.monotonic()
+        return _schema
+
+
+def invalidate():
+    """Check the fingerprint on the next call, e.g. after a migration."""
+    global _checked_at
+    _checked_at = None
+
+
+def fingerprint() -> Optional[str]:
+    """Fingerprint of the cached schema, without touching the database."""
+    return _schema.fingerprint if _schema is not None else None
+
+
+def _words(text: str) -> Set[str]:
+    words = set(re.findall(r"[a-z0-9]+", text.casefold()))
+    return words | {w[:-1] for w in words if w.endswith("s") and len(w) > 3}
+
+
+def _name_words(name: str) -> Set[str]:
+    """HAS_MEMORY -> {has, memory}, nodeLabel -> {node, label}."""
+    return _words(re.sub(r"([a-z])([A-Z])", r"\1 \2", name).replace("_", " "))
+
+
+def relevant_labels(schema: GraphSchema, question: str) -> List[str]:
+    """
+    Labels worth showing for question: those named in it (directly, through
+    one of their properties or through a relationship type), the anchor
+    labels, and their direct neighbours, at most MAX_LABELS in total.
+    """
+    words = _words(question) - {"has", "of", "the", "a", "is"}
+
+    matched = [label for label in ANCHOR_LABELS if label in schema.nodes]
+    for label, props in sorted(schema.nodes.items()):
+        if _name_words(label) & words or any(_name_words(p) & words for p in props if p != "name"):
+            matched.append(label)
+    for start, rel_type, end in sorted(schema.patterns):
+        if _name_words(rel_type) & words:
+            matched.extend((start, end))
+
+    neighbours = []
+    for start, _, end in sorted(schema.patterns):
+        if start in matched:
+            neighbours.append(end)
+        if end in matched:
+            neighbours.append(start)
+
+    selected: List[str] = []
+    for label in matched + neighbours:
+        if label not in selected:
+            selected.append(label)
+    return selected[:MAX_LABELS]
+
+
+def render(schema: GraphSchema, labels: Optional[List[str]] = None) -> str:
+    """Schema as prompt text, limited to labels if given."""
+    labels = sorted(schema.nodes) if labels is None else labels
+    shown = set(labels)
+
+    lines = ["Neo4j Database Schema:", "", "NODES:"]
+    for label in labels:
+        props = ", ".join(f"{name}: {t}" for name, t in sorted(schema.nodes.get(label, {}).items()))
+        lines.append(f"- {label} {{{props}}}" if props else f"- {label}")
+
+    lines += ["", "RELATIONSHIPS:"]
+    for start, rel_type, end in sorted(schema.patterns):
+        if start in shown and end in shown:
+            props = schema.relationship_properties.get(rel_type)
+            prop_text = " {" + ", ".join(f"{n}: {t}" for n, t in sorted(props.items())) + "}" if props else ""
+            lines.append(f"- ({start})-[:{rel_type}{prop_text}]->({end})")
+
+    indexed = sorted(p for p in schema.indexed if p.split(".", 1)[0] in shown)
+    if indexed:
+        lines += ["", "INDEXED PROPERTIES (prefer these for lookups):"]
+        lines += [f"- {p}" for p in indexed]
+    return "\n".join(lines)
+
+
+def schema_prompt(question: str) -> Optional[str]:
+    """The schema relevant to question, or None if it could not be read."""
+    schema = get_schema()
+    if schema is None or not schema.nodes:
+        return None
+    return render(schema, relevant_labels(schema, question))
+
+
+def stats() -> Dict[str, Any]:
+    """Introspection counters for monitoring."""
+    schema = _schema
+    return {
+        "fingerprint": schema.fingerprint if schema else None,
+        "labels": len(schema.nodes) if schema else 0,
+        "relationship_patterns": len(schema.patterns) if schema else 0,
+        "checks": _checks,
+        "refreshes": _refreshes,
+    }
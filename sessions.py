@@ -0,0 +1,168 @@
+"""
+Server-side conversation sessions with a rolling window and running summary.
+
+A session holds the last HISTORY_TURNS turns of one conversation with one
+NPC verbatim. Turns that fall out of the window are folded into a running
+summary by the LLM, a few at a time, so the history in the prompt stays
+roughly constant in size however long the conversation gets.
+
+Sessions are keyed by (session_id, npc_name): one player session can talk
+to several NPCs, each with its own history. Every session is bounded
+(messages and summary are truncated), there are at most MAX_SESSIONS of
+them, and sessions idle for longer than IDLE_TIMEOUT seconds are dropped.
+"""
+from cache import LRUCache
+from collections import deque
+from llms.backend import chat
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import os
+import threading
+import uuid
+
+# Turns kept verbatim
+HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "6"))
+# Longest message, and longest summary, kept in a session (characters)
+MESSAGE_MAX_CHARS = int(os.getenv("SESSION_MESSAGE_MAX_CHARS", "2000"))
+SUMMARY_MAX_CHARS = int(os.getenv("SESSION_SUMMARY_MAX_CHARS", "2000"))
+# Sessions kept at once, and seconds without a turn before one is dropped
+MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+
+SUMMARY_PROMPT = """You maintain the running summary of a conversation between a player and {npc_name}.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW TURNS TO ADD:
+{turns}
+
+Rewrite the summary so it also covers the new turns. Keep what the player said
+about themselves, what they asked, what {npc_name} revealed, denied or promised,
+and how the mood changed. Drop small talk. Write at most {max_words} words of
+plain prose and return only the summary.
+"""
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def _format_turns(turns: List[Tuple[str, str]], npc_name: str) -> str:
+    return "\n".join(f"User: {user}\n{npc_name}: {reply}" for user, reply in turns)
+
+
+class Session:
+    """One conversation with one NPC."""
+
+    def __init__(self, session_id: str, npc_name: str):
+        self.session_id = session_id
+        self.npc_name = npc_name
+        self.summary = ""
+        self.turns: Deque[Tuple[str, str]] = deque()
+        # Turns that left the window but are not in the summary yet
+        self.unsummarized: List[Tuple[str, str]] = []
+        self.turn_count = 0
+        self._lock = threading.Lock()
+        self._summarizing = False
+
+    def add_turn(self, user_message: str, reply: str):
+        with self._lock:
+            self.turns.append((_clip(user_message, MESSAGE_MAX_CHARS), _clip(reply, MESSAGE_MAX_CHARS)))
+            self.turn_count += 1
+            while len(self.turns) > HISTORY_TURNS:
+                self.unsummarized.append(self.turns.popleft())
+            # If summarizing keeps failing, the oldest turns are given up on
+            del self.unsummarized[:-HISTORY_TURNS]
+
+    @property
+    def needs_summary(self) -> bool:
+        return bool(self.unsummarized) and not self._summarizing
+
+    def summarize(self):
+        """Fold the turns that left the window into the summary (one LLM call)."""
+        with self._lock:
+            if not self.unsummarized or self._summarizing:
+                return
+            self._summarizing = True
+            turns = list(self.unsummarized)
+            summary = self.summary
+
+        try:
+            updated = chat(SUMMARY_PROMPT.format(
+                npc_name=self.npc_name,
+                summary=summary or "(none yet)",
+                turns=_format_turns(turns, self.npc_name),
+                max_words=SUMMARY_MAX_CHARS // 6,
+            ), temperature=0.3, max_tokens=SUMMARY_MAX_CHARS // 3).strip()
+        except Exception as e:
+            print(f"Session summary failed, keeping turns for the next attempt: {e}")
+            with self._lock:
+                self._summarizing = False
+            return
+
+        with self._lock:
+            self.summary = _clip(updated, SUMMARY_MAX_CHARS)
+            # New turns may have left the window meanwhile; keep those
+            folded = {id(t) for t in turns}
+            self.unsummarized = [t for t in self.unsummarized if id(t) not in folded]
+            self._summarizing = False
+        _counters["summaries"] += 1
+
+    def history(self) -> str:
+        """The conversation so far, for the prompt ("" for a new session)."""
+        with self._lock:
+            parts = []
+            if self.summary:
+                parts.append(f"EARLIER IN THIS CONVERSATION (summary):\n{self.summary}")
+            recent = self.unsummarized + list(self.turns)
+            if recent:
+                parts.append(f"RECENT CONVERSATION:\n{_format_turns(recent, self.npc_name)}")
+            return "\n\n".join(parts)
+
+
+# Sessions by (session_id, npc_name). Every turn stores the session again,
+# which restarts its idle timer.
+_sessions = LRUCache(max_size=MAX_SESSIONS, ttl=IDLE_TIMEOUT)
+_sessions_lock = threading.Lock()
+
+_counters: Dict[str, int] = {"created": 0, "summaries": 0}
+
+
+def get_session(session_id: Optional[str], npc_name: str) -> Session:
+    """
+    The session session_id has with npc_name, or a new one if it is missing
+    or expired (with a generated id if session_id is None).
+
+    A new session is only stored by record_turn(), after its first
+    successful turn, so requests that fail (unknown NPC, LLM error) don't
+    take up room in the session store.
+    """
+    if session_id:
+        session = _sessions.get((session_id, npc_name))
+        if session is not None:
+            return session
+    return Session(session_id or uuid.uuid4().hex, npc_name)
+
+
+def record_turn(session: Session, user_message: str, reply: str):
+    """Add a finished turn, storing the session if new, and restart its idle timer."""
+    session.add_turn(user_message, reply)
+    key = (session.session_id, session.npc_name)
+    with _sessions_lock:
+        stored = _sessions.peek(key)
+        if stored is None:
+            _counters["created"] += 1
+        elif stored is not session:
+            # Two first turns of the same new session raced; keep the stored one
+            stored.add_turn(user_message, reply)
+            session = stored
+        _sessions.set(key, session)
+
+
+def end_session(session_id: str, npc_name: str):
+    _sessions.invalidate((session_id, npc_name))
+
+
+def stats() -> Dict[str, Any]:
+    """Counters for /stats."""
+    return {**_sessions.stats(), **_counters}
@@ -0,0 +1,436 @@
+"""
+Declarative world files and diff-based sync to Neo4j.
+
+A world file is JSON describing NPCs (with personality and traits), groups,
+objects, places, claims (with references), beliefs, NPC relations, events
+and memories. sync() reads the live graph, computes what differs and applies
+only that, in UNWIND batches, instead of one session per node.
+
+    python world_sync.py worlds/example.json            # show the diff
+    python world_sync.py worlds/example.json --apply    # write it
+    python world_sync.py worlds/example.json --apply --prune
+
+Without --prune, nodes and relationships that exist in the graph but not in
+the file are only reported. Claims are identified by their "key", which is
+stored on the CLAIM node; claims without a key (made with the interactive
+tools) are never touched.
+
+Format (every section is optional):
+
+    {
+      "npcs": [{"name": "Elin von Dahlen", "age": 19, "role": "Niece",
+                "personality": {"summary": "...", "lie_style": "...", "conflict_style": "...",
+                                "stress_response": "...", "traits": ["Curious"]}}],
+      "groups": [{"name": "Family", "members": ["Elin von Dahlen"]}],
+      "objects": [{"name": "Letter"}],
+      "places": [{"name": "Great hall"}],
+      "claims": [{"key": "letter-burned", "content": "...", "veracity": "FACT", "type": null,
+                  "references": [{"type": "OBJECT", "target": "Letter"}]}],
+      "beliefs": [{"entity": "Elin von Dahlen", "entity_type": "NPC", "claim": "letter-burned",
+                   "belief": 0.8, "stance": -0.2}],
+      "relations": [{"from": "Alrik von Dahlen", "to": "Elin von Dahlen", "type": "PARENT_TO", "secrecy": 0}],
+      "affections": [{"from": "Elin von Dahlen", "to": "Alrik von Dahlen", "affection": 0.5, "demeanour": 0.2}],
+      "events": [{"event_id": "dinner", "location": "Great hall", "start_time": "20:00",
+                  "stop_time": "21:00", "summary": "..."}],
+      "memories": [{"memory_id": "elin-dinner", "npc": "Elin von Dahlen", "memory": "...", "event": "dinner"}]
+    }
+"""
+from dataclasses import dataclass, field
+from db_neo4j import ex_query, notify_npc_changed
+from embedding_backfill import backfill
+from knowledge_view import REFRESH_BY_KEY_QUERY, REFRESH_QUERY
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import schema
+
+BATCH_SIZE = int(os.getenv("WORLD_SYNC_BATCH_SIZE", "1000"))
+
+# Same pairs as STRUCTURAL_RELATIONS in the legacy db_utils: every relation
+# is stored in both directions
+INVERSE_RELATIONS = {
+    "SIBLING_WITH": "SIBLING_WITH",
+    "FRIENDS_WITH": "FRIENDS_WITH",
+    "DATING": "DATING",
+    "MARRIED_TO": "MARRIED_TO",
+    "DIVORCED_FROM": "DIVORCED_FROM",
+    "PARENT_TO": "CHILD_TO",
+    "CHILD_TO": "PARENT_TO",
+}
+
+# Labels whose text is embedded, and the property holding it
+EMBEDDED_TEXT = {"CLAIM": "content", "Memory": "memory"}
+
+REFERENCE_TARGETS = ("CLAIM", "NPC", "GROUP", "OBJECT", "PLACE")
+
+
+class WorldFileError(Exception):
+    pass
+
+
+@dataclass
+class NodeSet:
+    """Desired nodes of one label, by key value."""
+    label: str
+    key: str
+    fields: Tuple[str, ...]
+    rows: Dict[Any, Dict[str, Any]] = field(default_factory=dict)
+
+
+@dataclass
+class EdgeSet:
+    """Desired relationships of one type between two labels, by (start key, end key)."""
+    type: str
+    start: Tuple[str, str]
+    end: Tuple[str, str]
+    fields: Tuple[str, ...] = ()
+    rows: Dict[Tuple[Any, Any], Dict[str, Any]] = field(default_factory=dict)
+
+    @property
+    def name(self) -> str:
+        return f"({self.start[0]})-[:{self.type}]->({self.end[0]})"
+
+
+@dataclass
+class Change:
+    name: str
+    create: List[Any] = field(default_factory=list)
+    update: List[Any] = field(default_factory=list)
+    delete: List[Any] = field(default_factory=list)
+    # Created or updated keys whose embedded text changed
+    reembed: List[Any] = field(default_factory=list)
+
+
+def _q(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def _batches(rows: List[Any]):
+    for i in range(0, len(rows), BATCH_SIZE):
+        yield rows[i:i + BATCH_SIZE]
+
+
+def load_world(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build(world: Dict[str, Any]) -> Tuple[List[NodeSet], List[EdgeSet]]:
+    """Turn a world definition into the node and relationship sets it describes."""
+    npcs = NodeSet("NPC", "name", ("age", "role"))
+    personalities = NodeSet("Personality", "personality_id",
+                            ("summary", "lie_style", "conflict_style", "stress_response"))
+    traits = NodeSet("Trait", "trait", ())
+    groups = NodeSet("GROUP", "name", ())
+    objects = NodeSet("OBJECT", "name", ())
+    places = NodeSet("PLACE", "name", ())
+    claims = NodeSet("CLAIM", "key", ("content", "veracity", "type"))
+    events = NodeSet("Event", "event_id", ("location", "start_time", "stop_time", "summary"))
+    memories = NodeSet("Memory", "memory_id", ("memory",))
+    nodes = [npcs, personalities, traits, groups, objects, places, claims, events, memories]
+    by_label = {n.label: n for n in nodes}
+
+    has_personality = EdgeSet("HAS_PERSONALITY", ("NPC", "name"), ("Personality", "personality_id"))
+    has_trait = EdgeSet("HAS_TRAIT", ("Personality", "personality_id"), ("Trait", "trait"))
+    member_of = EdgeSet("MEMBER_OF", ("NPC", "name"), ("GROUP", "name"))
+    has_memory = EdgeSet("HAS_MEMORY", ("NPC", "name"), ("Memory", "memory_id"))
+    memory_of = EdgeSet("MEMORY_OF", ("Memory", "memory_id"), ("Event", "event_id"))
+    affection = EdgeSet("AFFECTION", ("NPC", "name"), ("NPC", "name"), ("intensity",))
+    demeanour = EdgeSet("DEMEANOUR", ("NPC", "name"), ("NPC", "name"), ("intensity",))
+    edges = [has_personality, has_trait, member_of, has_memory, memory_of, affection, demeanour]
+    dynamic: Dict[Tuple[str, str, str], EdgeSet] = {}
+
+    def edge(rel_type: str, start: str, end: str, fields: Tuple[str, ...] = ()) -> EdgeSet:
+        if (rel_type, start, end) not in dynamic:
+            dynamic[(rel_type, start, end)] = EdgeSet(
+                rel_type, (start, by_label[start].key), (end, by_label[end].key), fields)
+        return dynamic[(rel_type, start, end)]
+
+    for npc in world.get("npcs", []):
+        npcs.rows[npc["name"]] = {f: npc.get(f) for f in npcs.fields}
+        personality = npc.get("personality")
+        if personality:
+            pid = personality.get("personality_id", f"{npc['name']}-personality")
+            personalities.rows[pid] = {f: personality.get(f) for f in personalities.fields}
+            has_personality.rows[(npc["name"], pid)] = {}
+            for trait in personality.get("traits", []):
+                traits.rows[trait] = {}
+                has_trait.rows[(pid, trait)] = {}
+
+    for group in world.get("groups", []):
+        groups.rows[group["name"]] = {}
+        for member in group.get("members", []):
+            member_of.rows[(member, group["name"])] = {}
+
+    for obj in world.get("objects", []):
+        objects.rows[obj["name"]] = {}
+    for place in world.get("places", []):
+        places.rows[place["name"]] = {}
+
+    for claim in world.get("claims", []):
+        claims.rows[claim["key"]] = {f: claim.get(f) for f in claims.fields}
+        for ref in claim.get("references", []):
+            if ref["type"] not in REFERENCE_TARGETS:
+                raise WorldFileError(f"Claim {claim['key']!r}: unknown reference type {ref['type']!r}")
+            edge("REFERENCE", "CLAIM", ref["type"]).rows[(claim["key"], ref["target"])] = {}
+
+    for belief in world.get("beliefs", []):
+        entity_type = belief.get("entity_type", "NPC")
+        if entity_type not in ("NPC", "GROUP"):
+            raise WorldFileError(f"Belief of {belief['entity']!r}: entity_type must be NPC or GROUP")
+        key = (belief["entity"], belief["claim"])
+        edge("BELIEF", entity_type, "CLAIM", ("intensity",)).rows[key] = {"intensity": belief["belief"]}
+        edge("STANCE", entity_type, "CLAIM", ("intensity",)).rows[key] = {"intensity": belief["stance"]}
+
+    for relation in world.get("relations", []):
+        rel_type = relation["type"]
+        if rel_type not in INVERSE_RELATIONS:
+            raise WorldFileError(f"Unknown relation type {rel_type!r}")
+        props = {"secrecy": relation.get("secrecy", 0)}
+        edge(rel_type, "NPC", "NPC", ("secrecy",)).rows[(relation["from"], relation["to"])] = props
+        edge(INVERSE_RELATIONS[rel_type], "NPC", "NPC", ("secrecy",)).rows[(relation["to"], relation["from"])] = props
+
+    for row in world.get("affections", []):
+        affection.rows[(row["from"], row["to"])] = {"intensity": row["affection"]}
+        demeanour.rows[(row["from"], row["to"])] = {"intensity": row["demeanour"]}
+
+    for event in world.get("events", []):
+        events.rows[event["event_id"]] = {f: event.get(f) for f in events.fields}
+    for memory in world.get("memories", []):
+        memories.rows[memory["memory_id"]] = {"memory": memory["memory"]}
+        has_memory.rows[(memory["npc"], memory["memory_id"])] = {}
+        if memory.get("event"):
+            memory_of.rows[(memory["memory_id"], memory["event"])] = {}
+
+    edges += list(dynamic.values())
+    _validate(by_label, edges)
+    return nodes, edges
+
+
+def _validate(nodes: Dict[str, NodeSet], edges: List[EdgeSet]):
+    """Every relationship must point at nodes defined in the same file."""
+    missing = []
+    for edge in edges:
+        for start, end in edge.rows:
+            if start not in nodes[edge.start[0]].rows:
+                missing.append(f"{edge.name}: no {edge.start[0]} {start!r}")
+            if end not in nodes[edge.end[0]].rows:
+                missing.append(f"{edge.name}: no {edge.end[0]} {end!r}")
+    if missing:
+        raise WorldFileError("Undefined references in world file:\n  " + "\n  ".join(sorted(set(missing))))
+
+
+def _projection(var: str, fields: Tuple[str, ...]) -> str:
+    return f"{var} {{" + ", ".join(f".{_q(f)}" for f in fields) + "}" if fields else "{}"
+
+
+def _live_nodes(nodes: NodeSet) -> Dict[Any, Dict[str, Any]]:
+    records, _, _ = ex_query(
+        f"MATCH (n:{_q(nodes.label)}) WHERE n.{_q(nodes.key)} IS NOT NULL "
+        f"RETURN n.{_q(nodes.key)} AS key, {_projection('n', nodes.fields)} AS props"
+    )
+    return {r["key"]: {f: r["props"].get(f) for f in nodes.fields} for r in records}
+
+
+def _live_edges(edges: EdgeSet) -> Dict[Tuple[Any, Any], Dict[str, Any]]:
+    (start_label, start_key), (end_label, end_key) = edges.start, edges.end
+    records, _, _ = ex_query(
+        f"MATCH (a:{_q(start_label)})-[r:{_q(edges.type)}]->(b:{_q(end_label)}) "
+        f"WHERE a.{_q(start_key)} IS NOT NULL AND b.{_q(end_key)} IS NOT NULL "
+        f"RETURN a.{_q(start_key)} AS start, b.{_q(end_key)} AS end, {_projection('r', edges.fields)} AS props"
+    )
+    return {(r["start"], r["end"]): {f: r["props"].get(f) for f in edges.fields} for r in records}
+
+
+def _diff(name: str, desired: Dict[Any, Dict[str, Any]], live: Dict[Any, Dict[str, Any]],
+          text_field: Optional[str] = None) -> Change:
+    change = Change(name)
+    for key, props in desired.items():
+        if key not in live:
+            change.create.append(key)
+        elif live[key] != props:
+            change.update.append(key)
+        if text_field and props.get(text_field) and live.get(key, {}).get(text_field) != props[text_field]:
+            change.reembed.append(key)
+    change.delete = [key for key in live if key not in desired]
+    return change
+
+
+def diff(nodes: List[NodeSet], edges: List[EdgeSet]) -> Tuple[List[Change], List[Change]]:
+    """Compare the desired world with the live graph."""
+    node_changes = [_diff(n.label, n.rows, _live_nodes(n), EMBEDDED_TEXT.get(n.label)) for n in nodes]
+    edge_changes = [_diff(e.name, e.rows, _live_edges(e)) for e in edges]
+    return node_changes, edge_changes
+
+
+def _upsert_nodes(nodes: NodeSet, keys: List[Any], stale_embeddings: List[Any]):
+    stale = set(stale_embeddings)
+    rows = []
+    for key in keys:
+        props = dict(nodes.rows[key])
+        if key in stale:
+            # The old vector no longer matches the text
+            props["embedding"] = None
+        rows.append({"key": key, "props": props})
+    for batch in _batches(rows):
+        ex_query(
+            f"UNWIND $rows AS row MERGE (n:{_q(nodes.label)} {{{_q(nodes.key)}: row.key}}) SET n += row.props",
+            {"rows": batch},
+        )
+
+
+def _delete_nodes(nodes: NodeSet, keys: List[Any]):
+    for batch in _batches(keys):
+        ex_query(
+            f"UNWIND $keys AS key MATCH (n:{_q(nodes.label)} {{{_q(nodes.key)}: key}}) DETACH DELETE n",
+            {"keys": batch},
+        )
+
+
+def _match_ends(edges: EdgeSet) -> str:
+    (start_label, start_key), (end_label, end_key) = edges.start, edges.end
+    return (f"MATCH (a:{_q(start_label)} {{{_q(start_key)}: row.start}}) "
+            f"MATCH (b:{_q(end_label)} {{{_q(end_key)}: row.end}}) ")
+
+
+def _upsert_edges(edges: EdgeSet, keys: List[Tuple[Any, Any]]):
+    rows = [{"start": s, "end": e, "props": edges.rows[(s, e)]} for s, e in keys]
+    for batch in _batches(rows):
+        ex_query(
+            f"UNWIND $rows AS row {_match_ends(edges)}"
+            f"MERGE (a)-[r:{_q(edges.type)}]->(b) SET r += row.props",
+            {"rows": batch},
+        )
+
+
+def _delete_edges(edges: EdgeSet, keys: List[Tuple[Any, Any]]):
+    rows = [{"start": s, "end": e} for s, e in keys]
+    for batch in _batches(rows):
+        ex_query(
+            f"UNWIND $rows AS row {_match_ends(edges)}"
+            f"MATCH (a)-[r:{_q(edges.type)}]->(b) DELETE r",
+            {"rows": batch},
+        )
+
+
+def _knowledge_changes(edges: List[EdgeSet], edge_changes: List[Change], prune: bool):
+    """
+    What the written diff changed in the KNOWS view: claim keys per NPC, claim
+    keys per GROUP (for all its members) and NPCs whose memberships changed.
+    """
+    npc_claims: Dict[str, set] = {}
+    group_claims: Dict[str, set] = {}
+    members_changed = set()
+    for edge_set, change in zip(edges, edge_changes):
+        keys = change.create + change.update + (change.delete if prune else [])
+        if edge_set.type == "MEMBER_OF":
+            members_changed.update(npc for npc, _ in keys)
+        elif edge_set.type in ("BELIEF", "STANCE"):
+            by_entity = npc_claims if edge_set.start[0] == "NPC" else group_claims
+            for entity, claim in keys:
+                by_entity.setdefault(entity, set()).add(claim)
+    return npc_claims, group_claims, members_changed
+
+
+def refresh_knowledge(edges: List[EdgeSet], edge_changes: List[Change], prune: bool = False):
+    """
+    Recompute the KNOWS rows the diff touched. An NPC whose memberships
+    changed gets all its claims recomputed, other NPCs only the claims
+    whose beliefs or stances (their own or their groups') changed.
+    """
+    npc_claims, group_claims, members_changed = _knowledge_changes(edges, edge_changes, prune)
+    if group_claims:
+        records, _, _ = ex_query(
+            "MATCH (n:NPC)-[:MEMBER_OF]->(g:GROUP) WHERE g.name IN $groups "
+            "RETURN g.name AS group, collect(n.name) AS members",
+            {"groups": list(group_claims)},
+        )
+        for r in records:
+            for npc in r["members"]:
+                npc_claims.setdefault(npc, set()).update(group_claims[r["group"]])
+
+    for batch in _batches(sorted(members_changed)):
+        ex_query(REFRESH_QUERY, {"names": batch, "claim_id": None})
+    rows = [(npc, sorted(claims)) for npc, claims in npc_claims.items() if npc not in members_changed]
+    for batch in _batches(rows):
+        ex_query(REFRESH_BY_KEY_QUERY, {"claims": dict(batch)})
+
+
+def apply(nodes: List[NodeSet], edges: List[EdgeSet], node_changes: List[Change],
+          edge_changes: List[Change], prune: bool = False, embed: bool = True):
+    """Write a diff: nodes first, then relationships, then (with prune) deletions."""
+    for node_set, change in zip(nodes, node_changes):
+        _upsert_nodes(node_set, change.create + change.update, change.reembed)
+
+    for edge_set, change in zip(edges, edge_changes):
+        _upsert_edges(edge_set, change.create + change.update)
+
+    if prune:
+        for edge_set, change in zip(edges, edge_changes):
+            _delete_edges(edge_set, change.delete)
+        for node_set, change in zip(nodes, node_changes):
+            _delete_nodes(node_set, change.delete)
+
+    # Beliefs, stances and memberships feed the materialized KNOWS view.
+    # Deleted NPCs and claims took their KNOWS edges with them.
+    refresh_knowledge(edges, edge_changes, prune)
+
+    if embed:
+        # The cleared vectors are now stale, and the backfill only embeds those
+        for node_set, change in zip(nodes, node_changes):
+            if change.reembed:
+                backfill(node_set.label)
+
+
+def print_diff(changes: List[Change], prune: bool):
+    for change in changes:
+        if not (change.create or change.update or change.delete):
+            continue
+        line = f"  {change.name:<40} +{len(change.create):<6} ~{len(change.update):<6}"
+        if change.delete:
+            line += f" -{len(change.delete)}" if prune else f" ({len(change.delete)} not in file)"
+        print(line.rstrip())
+
+
+def sync(path: str, dry_run: bool = True, prune: bool = False, embed: bool = True) -> bool:
+    """
+    Make the graph match the world file at path.
+
+    Returns True if anything was (or, with dry_run, would be) written.
+    """
+    nodes, edges = build(load_world(path))
+    node_changes, edge_changes = diff(nodes, edges)
+    changes = node_changes + edge_changes
+
+    print("Nodes:")
+    print_diff(node_changes, prune)
+    print("Relationships:")
+    print_diff(edge_changes, prune)
+
+    changed = any(c.create or c.update or (prune and c.delete) for c in changes)
+    if dry_run or not changed:
+        if not changed:
+            print("Graph already matches the world file.")
+        return changed
+
+    apply(nodes, edges, node_changes, edge_changes, prune=prune, embed=embed)
+    # Any NPC's context may have changed, and so may the labels in use
+    notify_npc_changed(None)
+    schema.invalidate()
+    print("✓ World synced")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync a declarative world file to Neo4j.")
+    parser.add_argument("world", help="path to the world JSON file")
+    parser.add_argument("--apply", action="store_true", help="write the changes (default: only show them)")
+    parser.add_argument("--prune", action="store_true", help="delete what is in the graph but not in the file")
+    parser.add_argument("--no-embed", action="store_true", help="don't embed new or changed claims and memories")
+    args = parser.parse_args()
+    sync(args.world, dry_run=not args.apply, prune=args.prune, embed=not args.no_embed)
+
+
+if __name__ == "__main__":
+    main()